@@ -0,0 +1,338 @@
+"""
+# compression module includes streaming codecs per Content-Encoding
+
+The codecs (gzip, zstd and lz4) are named by HTTP Content-Encoding values,
+as stored in s3 object metadata.
+
+Note: gzip is always available (by zlib); zstd requires the `zstandard`
+      package, and lz4 requires the `lz4` package.
+
+example:
+    chunks = iter_compress(open('data.json', 'rb'), 'gzip')
+    contents = b''.join(iter_decompress(chunks, 'gzip'))
+"""
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # optional
+    lz4_frame = None
+
+# the default compression levels per encoding
+COMPRESS_LEVELS = {'gzip': 6, 'zstd': 3, 'lz4': 0}
+
+# the Content-Encoding values of uncompressed contents
+IDENTITY_ENCODINGS = (None, '', 'identity')
+
+
+class _Lz4Compressor(object):
+    """
+    An lz4 frame compressor with the zlib compressobj interface
+    """
+    def __init__(self, level):
+        self._compressor = lz4_frame.LZ4FrameCompressor(
+            compression_level=level)
+        self._header = self._compressor.begin()
+
+    def compress(self, data):
+        """Compress a chunk of data"""
+        header, self._header = self._header, b''
+        return header + self._compressor.compress(data)
+
+    def flush(self):
+        """Finish the frame"""
+        header, self._header = self._header, b''
+        return header + self._compressor.flush()
+
+
+class _ZstdDecompressor(object):
+    """
+    A zstd decompressor, reading concatenated frames
+
+    Note: zstandard has no output limit on a decompressobj, so max_length
+          is ignored and all input is always consumed.
+    """
+    needs_input = True
+
+    def __init__(self):
+        self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data, max_length=-1):
+        """Decompress a chunk of data"""
+        result = []
+        while data:
+            result.append(self._decompressor.decompress(data))
+            data = getattr(self._decompressor, 'unused_data', b'')
+            if data:
+                self._decompressor = \
+                    zstandard.ZstdDecompressor().decompressobj()
+        return b''.join(result)
+
+
+class _ZlibDecompressor(object):
+    """
+    A gzip (or zlib) decompressor, reading concatenated gzip members
+
+    Note: like lz4 (and bz2), decompress returns at most max_length bytes
+          (if >= 0), keeping the unconsumed input until the next call, and
+          needs_input is False while any input is kept.
+    """
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        self._tail = b''
+
+    @property
+    def needs_input(self):
+        """Check if all input is consumed"""
+        return not self._tail
+
+    def decompress(self, data, max_length=-1):
+        """Decompress a chunk of data, up to @max_length bytes (if >= 0)"""
+        if self._tail:
+            data = self._tail + data
+        result = []
+        size = 0
+        while data:
+            if max_length < 0:
+                chunk = self._decompressor.decompress(data)
+            elif size < max_length:
+                chunk = self._decompressor.decompress(data, max_length - size)
+            else:
+                break
+            result.append(chunk)
+            size += len(chunk)
+            # at the end of a member, the rest is in unused_data (also kept
+            # in unconsumed_tail if the output was limited)
+            data = self._decompressor.unused_data
+            if data:
+                self._decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+            else:
+                data = self._decompressor.unconsumed_tail
+        self._tail = data
+        return b''.join(result)
+
+    def flush(self):
+        """Decompress all kept input and any pending output (at EOF)"""
+        return self.decompress(b'') + self._decompressor.flush()
+
+
+def _get_compressor(content_encoding, level=None):
+    """
+    Get a compressor object (with compress and flush) per encoding
+    """
+    name = get_encoding(content_encoding)
+    if level is None:
+        level = COMPRESS_LEVELS[name]
+    if name == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if name == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    return _Lz4Compressor(level)
+
+
+def _get_decompressor(content_encoding):
+    """
+    Get a decompressor object (with decompress) per encoding
+    """
+    name = get_encoding(content_encoding)
+    if name == 'gzip':
+        return _ZlibDecompressor()
+    if name == 'zstd':
+        return _ZstdDecompressor()
+    return lz4_frame.LZ4FrameDecompressor()
+
+
+class DecompressedStream(object):
+    """
+    class DecompressedStream implements a file-like (read-only) stream of
+    decompressed contents over a compressed file-like stream
+
+    Note: a read decompresses only up to the requested size (where the
+          codec supports an output limit, i.e. gzip and lz4), so memory
+          stays bounded by the read size rather than the compression ratio.
+    """
+    def __init__(self, stream, content_encoding, chunk_size=1024 * 1024):
+        """
+        Initializes a stream to decompress @stream per @content_encoding
+        """
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self._decompressor = _get_decompressor(content_encoding)
+        self._buffer = bytearray()
+        self._offset = 0
+        self._eof = False
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def _consume(self, size):
+        """
+        Move the read offset by @size bytes, compacting the buffer once
+        more than half of it is read
+        """
+        self._offset += size
+        if self._offset >= len(self._buffer):
+            del self._buffer[:]
+            self._offset = 0
+        elif self._offset > len(self._buffer) // 2:
+            del self._buffer[:self._offset]
+            self._offset = 0
+
+    def _decompress(self, max_length=-1):
+        """
+        Decompress the next data, up to @max_length bytes (if >= 0), reading
+        from the stream only if the decompressor needs input
+
+        @return: the decompressed bytes (b'' at EOF, or if more input needed)
+        """
+        data = b''
+        if getattr(self._decompressor, 'needs_input', True) or \
+           getattr(self._decompressor, 'eof', False):
+            data = self.stream.read(self.chunk_size)
+            if not data:
+                self._eof = True
+                flush = getattr(self._decompressor, 'flush', None)
+                return flush() if flush is not None else b''
+        return self._decompressor.decompress(data, max_length)
+
+    def close(self):
+        """
+        Close the underlying stream
+        """
+        self.stream.close()
+
+    def iter_chunks(self, chunk_size=None):
+        """
+        Yield decompressed chunks until EOF
+        """
+        while True:
+            chunk = self.read(chunk_size or self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def read(self, size=-1):
+        """
+        Read up to @size decompressed bytes (all, if size < 0)
+        """
+        if size is None or size < 0:
+            size = -1
+        while not self._eof and (
+                size < 0 or len(self._buffer) - self._offset < size):
+            self._buffer += self._decompress(
+                size - len(self._buffer) + self._offset if size >= 0 else -1)
+        end = len(self._buffer)
+        if size >= 0:
+            end = min(self._offset + size, end)
+        result = bytes(self._buffer[self._offset:end])
+        self._consume(end - self._offset)
+        return result
+
+    def readinto(self, buffer):
+        """
+        Read up to len(buffer) decompressed bytes into a writable buffer
+
+        @return: the number of bytes read (0 at EOF)
+        """
+        view = memoryview(buffer)
+        size = len(view)
+        count = min(len(self._buffer) - self._offset, size)
+        view[:count] = self._buffer[self._offset:self._offset + count]
+        self._consume(count)
+        while count < size and not self._eof:
+            data = self._decompress(size - count)
+            length = min(len(data), size - count)
+            view[count:count + length] = data[:length]
+            count += length
+            self._buffer += data[length:]  # only if max_length is ignored
+        return count
+
+
+def compress(data, content_encoding, level=None):
+    """
+    Compress data (bytes, or text in UTF-8) per a Content-Encoding
+    """
+    if isinstance(data, type(u'')):
+        data = data.encode('utf-8')
+    compressor = _get_compressor(content_encoding, level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data, content_encoding):
+    """
+    Decompress data (bytes) per a Content-Encoding
+    """
+    return _get_decompressor(content_encoding).decompress(data)
+
+
+def get_encoding(content_encoding):
+    """
+    Get the normalized name of a supported Content-Encoding
+
+    @raise: ValueError on an unknown or unavailable encoding
+    """
+    name = str(content_encoding).strip().lower()
+    if name == 'x-gzip':
+        name = 'gzip'
+    if name not in COMPRESS_LEVELS:
+        raise ValueError("unknown content encoding: '{}'".format(
+            content_encoding))
+    if (name == 'zstd' and zstandard is None) or \
+       (name == 'lz4' and lz4_frame is None):
+        raise ValueError("content encoding '{}' requires package '{}'".format(
+            name, 'zstandard' if name == 'zstd' else 'lz4'))
+    return name
+
+
+def get_encodings():
+    """
+    Get a list of available Content-Encoding names
+    """
+    names = ['gzip']
+    if zstandard is not None:
+        names.append('zstd')
+    if lz4_frame is not None:
+        names.append('lz4')
+    return names
+
+
+def is_compressed(content_encoding):
+    """
+    Check if a Content-Encoding is a known compression encoding (which
+    may still require an optional package, see get_encoding)
+    """
+    if content_encoding in IDENTITY_ENCODINGS:
+        return False
+    name = str(content_encoding).strip().lower()
+    return name in COMPRESS_LEVELS or name == 'x-gzip'
+
+
+def iter_compress(chunks, content_encoding, level=None):
+    """
+    Yield compressed chunks from an iterable of chunks (bytes or text)
+    """
+    compressor = _get_compressor(content_encoding, level)
+    for chunk in chunks:
+        if isinstance(chunk, type(u'')):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    data = compressor.flush()
+    if data:
+        yield data
+
+
+def iter_decompress(chunks, content_encoding):
+    """
+    Yield decompressed chunks from an iterable of compressed chunks
+    """
+    decompressor = _get_decompressor(content_encoding)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
@@ -12,6 +12,8 @@ import jsonpickle
 import os
 import pytz
 
+from pyapi.utils import json_codec
+
 class DictEncoder(json.JSONEncoder):
     """
     Default encoder for json.dumps
@@ -165,7 +167,7 @@ def get_json(obj, indent=4):
     """
     Get formatted JSON dump string
     """
-    return json.dumps(obj, sort_keys=True, indent=indent)
+    return json_codec.dumps(obj, sort_keys=True, indent=indent)
 
 
 def get_list_subsets(object_list, subset_size):
@@ -191,7 +193,7 @@ def pickle_object(obj, *rm_keys):
     """
     Convert an object to serialized JSON object
     """
-    json_obj = json.loads(jsonpickle.encode(obj))
+    json_obj = json_codec.loads(jsonpickle.encode(obj))
 
     for key in rm_keys:
         try:
@@ -209,4 +211,4 @@ def pickle_to_str(obj, *rm_keys):
     """
     json_obj = pickle_object(obj, *rm_keys)
 
-    return json.dumps(json_obj)
+    return json_codec.dumps(json_obj)
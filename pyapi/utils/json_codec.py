@@ -0,0 +1,132 @@
+"""
+# json_codec module includes a pluggable JSON codec (loads and dumps)
+
+The codec (with fast=True) uses the fastest installed backend, in order
+of orjson, ujson and simdjson (pysimdjson), and falls back to the stdlib
+json module; the environment variable PYAPI_JSON_BACKEND selects one
+explicitly.
+
+Note: loads and dumps use the stdlib json module unless called with
+      fast=True, so parsed data (e.g. integers over 64-bit, NaN) and
+      output format of logs and files (e.g. separators, escaping of
+      non-ASCII, NaN) are the same with any backend; a fast dump is
+      compact and may differ by backend.
+
+example:
+    data = json_codec.loads(response['Body'].read())
+    text = json_codec.dumps(data, sort_keys=True)
+"""
+import json
+import logging
+import os
+import sys
+
+from pyapi.utils.logger import get_logger
+LOGGER = get_logger(__name__, logging.WARN)
+
+# the JSON backends (module names) in the order of preference
+JSON_BACKENDS = ('orjson', 'ujson', 'simdjson', 'json')
+
+# the backend in use, see set_backend()
+_BACKEND_NAME = 'json'
+_BACKEND = json
+
+
+def _get_backend_module(name):
+    """
+    Get an installed JSON backend module by name, or None
+    """
+    if name == 'json':
+        return json
+    if name not in JSON_BACKENDS:
+        raise ValueError("unknown JSON backend: '{}'".format(name))
+    try:
+        return __import__(name)
+    except ImportError:
+        return None
+
+
+def dumps(obj, sort_keys=False, indent=None, default=None, fast=False):
+    """
+    Serialize an object to a JSON string
+
+    @param obj: the object to serialize
+    @param sort_keys: True to output dict keys in sorted order
+    @param indent: the indent of pretty-printed output (by stdlib json)
+    @param default: a function to convert an object not serializable
+    @param fast: True to serialize by the backend (if supported), whose
+                 output is compact and may differ from stdlib json, e.g.
+                 orjson writes non-ASCII unescaped and NaN as null, and
+                 ujson escapes '/'; only for output read back as JSON
+
+    @return: the JSON string
+    """
+    fast = fast and indent is None
+    if fast and _BACKEND_NAME == 'orjson':
+        option = _BACKEND.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= _BACKEND.OPT_SORT_KEYS
+        try:
+            return _BACKEND.dumps(
+                obj, default=default, option=option).decode('utf-8')
+        except TypeError:
+            pass  # e.g. an int subclass, or integer over 64-bit
+    elif fast and default is None and _BACKEND_NAME == 'ujson':
+        try:
+            return _BACKEND.dumps(obj, sort_keys=sort_keys)
+        except (OverflowError, TypeError):
+            pass
+    return json.dumps(obj, sort_keys=sort_keys, indent=indent, default=default)
+
+
+def get_backend():
+    """
+    Get the name of the JSON backend in use
+    """
+    return _BACKEND_NAME
+
+
+def loads(data, fast=False):
+    """
+    Deserialize a JSON string (text, or bytes in UTF-8) to an object
+
+    @param data: the JSON string
+    @param fast: True to deserialize by the backend, falling back to the
+                 stdlib json module on any error of the backend (e.g.
+                 NaN, or a lone surrogate, with orjson); note orjson
+                 decodes an integer over 64-bit as a float
+
+    @raise: ValueError on invalid JSON
+    """
+    if fast and _BACKEND is not json:
+        try:
+            return _BACKEND.loads(data)
+        except ValueError:
+            pass  # parsed again by stdlib json, raising on invalid JSON
+    if isinstance(data, bytes) and sys.version_info[0] > 2:
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def set_backend(name=None):
+    """
+    Set the JSON backend by name (one of JSON_BACKENDS), or the first
+    installed one if name is None
+
+    @return: the name of the JSON backend
+    @raise: ValueError on an unknown or not installed backend
+    """
+    global _BACKEND, _BACKEND_NAME  # pylint: disable=global-statement
+    for backend_name in [name] if name else JSON_BACKENDS:
+        module = _get_backend_module(backend_name)
+        if module is not None:
+            _BACKEND_NAME, _BACKEND = backend_name, module
+            return backend_name
+    raise ValueError("JSON backend '{}' is not installed".format(name))
+
+
+try:
+    set_backend(os.environ.get('PYAPI_JSON_BACKEND') or None)
+except ValueError as ex:
+    LOGGER.warning('%s, using the default backend', ex)
+    set_backend()
@@ -9,14 +9,33 @@
 AWS_DEFAULT_REGION=us-west-2
 AWS_SECRET_ACCESS_KEY=
 AWS_ACCESS_KEY_ID=
+S3_ENDPOINT_URL= (optional, e.g. http://localhost:5000 for a local S3)
 
 """
-import json
+import bisect
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
 import types
 import logging
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent import futures
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
 import boto3.session as boto3_session
 import botocore
+from botocore.config import Config as BotoConfig
 
+from pyapi.utils import compression
+from pyapi.utils import json_codec
+from pyapi.utils import s3_metrics
+from pyapi.utils import s3_retry
 from pyapi.utils.logger import get_logger
 LOGGER = get_logger(__name__, logging.WARN)
 
@@ -24,6 +43,1187 @@ BUCKET_DEFAULT = 'cyber-intel'
 PREFIX_PROCESSED = 'pyapi/processed-json'
 PREFIX_MINED = 'pyapi/mined-json'
 
+# the size of urllib3 connection pool of each pooled client (botocore: 10)
+MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 50))
+
+# the max number of s3 requests in flight, shared by all threads; the
+# limit is cut down on throttling and grown back adaptively (see s3_retry)
+MAX_CONCURRENCY = int(os.environ.get('S3_MAX_CONCURRENCY', 64))
+
+# the retry policy of s3 requests on throttling and transient errors:
+# the max attempts, and the base and max delays (in seconds) of jittered
+# exponential backoff
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 20.0
+
+# the key metadata (HEAD) cache: max entries, and TTLs (in seconds) for
+# existing keys and for missing keys (negative entries)
+KEY_CACHE_SIZE = 10000
+KEY_CACHE_TTL = 60
+KEY_CACHE_TTL_MISSING = 10
+
+# the chunk size (in bytes) of reading an object body as a stream
+READ_CHUNK_SIZE = 1024 * 1024
+
+# the number of keys fetching in parallel, and the max total size (in
+# bytes) of fetched contents in flight (not yet consumed), by
+# get_contents_many and get_json_many
+FETCH_WORKERS = 16
+FETCH_MAX_BYTES = 64 * 1024 * 1024
+
+# the max size (in bytes) of contents read by get_content_into and
+# download_to_fd, by default
+CONTENT_MAX_SIZE = 256 * 1024 * 1024
+
+# the part size (in bytes) and parallelism of ranged downloads
+RANGE_PART_SIZE = 8 * 1024 * 1024
+RANGE_WORKERS = 8
+
+# the part size (in bytes) and parallelism of multipart uploads, where
+# a payload no larger than one part is uploaded by a single PUT request
+MULTIPART_PART_SIZE = 16 * 1024 * 1024
+MULTIPART_PART_SIZE_MIN = 5 * 1024 * 1024
+MULTIPART_WORKERS = 8
+
+# the max number of keys per DeleteObjects request, and the number of
+# DeleteObjects requests in parallel
+DELETE_BATCH_SIZE = 1000
+DELETE_WORKERS = 4
+
+# the max size (in bytes) of a single CopyObject request, and the part
+# size of a multipart copy for larger objects
+COPY_SIZE_MAX = 5 * 1024 * 1024 * 1024
+COPY_PART_SIZE = 512 * 1024 * 1024
+
+# the number of keys moving in parallel by mv_prefix
+MOVE_WORKERS = 16
+
+# the number of shards listing in parallel, and the max number of listed
+# pages buffered per shard, by list_objects_sharded
+LIST_WORKERS = 8
+LIST_QUEUE_PAGES = 4
+
+# the max number of characters (after the common part of a key range) to
+# look into for a key splitting the range, see _split_key_range
+LIST_SPLIT_DEPTH = 16
+
+# the max total size (in bytes) of object contents fetched ahead of the
+# consumer by generate_pages (with prefetch_bodies)
+PREFETCH_MAX_BYTES = 64 * 1024 * 1024
+
+# the upper bounds (in bytes, exclusive) of size histogram bins of
+# prefix_stats, where the last bin counts any larger objects
+SIZE_HISTOGRAM_BOUNDS = (
+    1024, 16 * 1024, 256 * 1024, 4 * 1024 * 1024, 64 * 1024 * 1024,
+    1024 * 1024 * 1024)
+
+# the characters (in order) of the key space to split shards by StartAfter
+KEYSPACE_CHARS = ''.join(chr(c) for c in range(0x21, 0x7f))
+
+# the error codes of a missing key in ClientError
+ERR_CODES_NOT_FOUND = ('404', 'NoSuchKey', 'NotFound')
+ERR_CODES_NOT_MODIFIED = ('304', 'NotModified')
+
+# the min interval (in seconds) of saving a checkpoint of process() and
+# process_keys()
+CHECKPOINT_INTERVAL = 30
+
+# the keyword arguments of process() and process_keys() for concurrent mode
+# (not passed to a_func): `workers` (0 as sequential), `max_in_flight`
+# (default: 2 x workers) and `ordered` (completion in listing order);
+# and for checkpoints: `checkpoint` (a local file path, or 's3://bucket/key'),
+# `checkpoint_interval` (in seconds) and `resume` (from the checkpoint)
+PROCESS_OPTIONS = {
+    'workers': 0, 'max_in_flight': 0, 'ordered': False,
+    'checkpoint': None, 'checkpoint_interval': CHECKPOINT_INTERVAL,
+    'resume': False,
+}
+
+
+class ProcessError(Exception):
+    """
+    ProcessError aggregates the errors of processing keys concurrently
+    """
+    def __init__(self, message, errors=None, counts=0):
+        super(ProcessError, self).__init__(message)
+        self.errors = errors or []  # a list of tuple (key, exception)
+        self.counts = counts  # the number of keys processed successfully
+
+
+class BufferPool(object):
+    """
+    A thread-safe pool of reusable bytearray buffers of a fixed size, for
+    get_content_into (to avoid allocating a buffer per read)
+
+    example:
+        pool = BufferPool(16 * 1024 * 1024)
+        with pool.buffer() as buffer:
+            view = get_content_into("mined-json/part-0", buffer=buffer)
+            process_contents(view)  # valid within the block only
+    """
+    def __init__(self, buffer_size, max_buffers=8):
+        """
+        Initializes a pool of buffers of @buffer_size bytes, keeping up to
+        @max_buffers released buffers
+        """
+        self.buffer_size = int(buffer_size)
+        self.max_buffers = max_buffers
+        self._lock = threading.Lock()
+        self._buffers = []
+
+    def acquire(self):
+        """
+        Get a buffer from the pool (or a new one if none is free)
+        """
+        with self._lock:
+            if self._buffers:
+                return self._buffers.pop()
+        return bytearray(self.buffer_size)
+
+    @contextmanager
+    def buffer(self):
+        """
+        Get a context manager of a buffer, released on exit
+        """
+        buffer = self.acquire()
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+    def release(self, buffer):
+        """
+        Return a buffer to the pool (any view of it must not be used after)
+        """
+        if len(buffer) != self.buffer_size:
+            return
+        with self._lock:
+            if len(self._buffers) < self.max_buffers:
+                self._buffers.append(buffer)
+
+
+class _ByteBudget(object):
+    """
+    A budget of bytes in flight, shared by threads: acquiring blocks until
+    the size fits in the budget (a size over the budget fits only alone)
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        """
+        Wait until @size bytes fit in the budget, and take them
+
+        @raise: RuntimeError if the budget is closed (before or in waiting)
+        """
+        with self._cond:
+            while not self.closed and \
+                    self.used and self.used + size > self.max_bytes:
+                self._cond.wait()
+            if self.closed:
+                raise RuntimeError("byte budget closed")
+            self.used += size
+
+    def close(self):
+        """
+        Close the budget, dropping all reservations, and wake up waiters
+        """
+        with self._cond:
+            self.closed = True
+            self.used = 0
+            self._cond.notify_all()
+
+    def release(self, size):
+        """
+        Return @size bytes to the budget (ignored once closed)
+        """
+        with self._cond:
+            if not self.closed:
+                self.used -= size
+                self._cond.notify_all()
+
+
+class _Checkpoint(object):
+    """
+    A checkpoint of processing listed keys, saved to a local file or a s3
+    key ('s3://bucket/key') as JSON
+
+    The checkpoint records the marker (the last key, in listing order, of
+    which all keys up to are done), and the counts of processed and failed
+    keys; a resumed run lists keys after the marker (by Marker), so no key
+    up to the marker is listed or processed again.
+
+    Note: failed keys are done (and recorded in 'failed_keys'), so a resumed
+          run does not retry them; a key raising an error in sequential mode
+          stops the run before it is done, so it is retried.
+    """
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL, **scope):
+        """
+        Initializes a checkpoint at @path of a listing @scope (e.g. bucket,
+        prefix and suffix), saved at most once per @interval seconds
+        """
+        self.path = path
+        self.interval = interval
+        self.scope = scope
+        self.state = {
+            'marker': None, 'processed': 0, 'failed': 0, 'failed_keys': [],
+            'completed': False}
+        self._pending = deque()  # key names in listing order, not done
+        self._done = set()
+        self._saved = time.time()
+
+    def _read(self):
+        """
+        Read the checkpoint contents, or None if not found
+
+        @raise: any error but not found (e.g. access denied, or throttling
+                after retries), so a run never restarts over a checkpoint
+        """
+        if self.path.startswith('s3://'):
+            bucket, _, key_name = self.path[5:].partition('/')
+            response = _get_object_or_none(key_name, bucket)
+            if response is None:
+                return None
+            return _read_body(response)
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, 'rb') as file_obj:
+            return file_obj.read()
+
+    def _write(self, contents):
+        """
+        Write the checkpoint contents (atomically, by renaming a local file)
+        """
+        if self.path.startswith('s3://'):
+            bucket, _, key_name = self.path[5:].partition('/')
+            _call(get_client().put_object,
+                  Body=contents, Bucket=bucket, Key=key_name)
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                temp_file.write(contents)
+            os.rename(temp_path, self.path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def done(self, key_name, error=None):
+        """
+        Mark a submitted key done (or failed), advancing the marker and
+        saving the checkpoint per interval
+        """
+        if error is None:
+            self.state['processed'] += 1
+        else:
+            self.state['failed'] += 1
+            self.state['failed_keys'].append(key_name)
+        self._done.add(key_name)
+        while self._pending and self._pending[0] in self._done:
+            self.state['marker'] = self._pending.popleft()
+            self._done.discard(self.state['marker'])
+        if time.time() - self._saved >= self.interval:
+            self.save()
+
+    def is_done(self, key_name):
+        """
+        Check if a listed key is up to the marker (done in a previous run)
+        """
+        marker = self.state['marker']
+        return marker is not None and key_name <= marker
+
+    def load(self):
+        """
+        Load the saved checkpoint, if any, to resume from
+
+        @raise: ValueError if the checkpoint is of another listing scope
+        """
+        contents = self._read()
+        if not contents:
+            LOGGER.info("- no checkpoint to resume: %s", self.path)
+            return
+        data = json_codec.loads(contents)
+        if data.get('scope') != self.scope:
+            raise ValueError("checkpoint {} is of {}, not {}".format(
+                self.path, data.get('scope'), self.scope))
+        for name in self.state:
+            if name in data:
+                self.state[name] = data[name]
+        self.state['completed'] = False
+        LOGGER.info("- resuming after %s (%s processed): %s",
+                    self.state['marker'], self.state['processed'], self.path)
+
+    def save(self, completed=False):
+        """
+        Save the checkpoint
+        """
+        self.state['completed'] = completed
+        data = dict(self.state, scope=self.scope, updated=time.time())
+        self._write(json_codec.dumps(data, sort_keys=True).encode('utf-8'))
+        self._saved = time.time()
+
+    def submit(self, key_name):
+        """
+        Mark a listed key submitted (in listing order)
+        """
+        self._pending.append(key_name)
+
+
+class _ClientRegistry(object):
+    """
+    A process-wide, thread-safe and fork-aware registry of S3 clients
+
+    Note: A boto3 client is thread-safe and owns a connection pool, so one
+          client per region/credentials is shared by all threads; but a
+          boto3 session or resource is not, so sessions are only used
+          under the lock, and resources are cached per thread.
+          All cached objects are dropped in a forked child process, since
+          connections (sockets) cannot be shared with the parent process.
+    """
+    def __init__(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sessions = {}
+        self._clients = {}
+
+    def _check_pid(self):
+        """
+        Reset the registry if running in a forked process
+        """
+        if self._pid != os.getpid():
+            self.reset()
+
+    def _get_session(self, key, options):
+        """
+        Get a cached boto3 session (must be called with the lock held)
+        """
+        session = self._sessions.get(key)
+        if session is None:
+            session = boto3_session.Session(**options)
+            self._sessions[key] = session
+        return session
+
+    def get_client(self, **kwargs):
+        """
+        Get a pooled S3 client per configurations in kwargs
+        """
+        self._check_pid()
+        key, options, pool_size, endpoint_url = _get_client_options(**kwargs)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    session = self._get_session(key, options)
+                    client = session.client('s3', **_get_client_kwargs(
+                        pool_size, endpoint_url))
+                    s3_metrics.register(client)
+                    self._clients[key] = client
+        return client
+
+    def get_resource(self, **kwargs):
+        """
+        Get a per-thread cached S3 resource per configurations in kwargs
+        """
+        self._check_pid()
+        key, options, pool_size, endpoint_url = _get_client_options(**kwargs)
+        resources = getattr(self._local, 'resources', None)
+        if resources is None:
+            resources = self._local.resources = {}
+        resource = resources.get(key)
+        if resource is None:
+            with self._lock:
+                session = self._get_session(key, options)
+                resource = session.resource('s3', **_get_client_kwargs(
+                    pool_size, endpoint_url))
+                s3_metrics.register(resource.meta.client)
+            resources[key] = resource
+        return resource
+
+    def reset(self):
+        """
+        Drop all cached sessions, clients and resources
+        """
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sessions = {}
+        self._clients = {}
+
+
+def _call(a_func, *args, **kwargs):
+    """
+    Call a s3 request function by the retry policy (see set_retry_policy),
+    within the shared limit of requests in flight
+    """
+    if s3_metrics.is_enabled():
+        a_func = s3_metrics.count_retries(a_func)
+    return _RETRY.call(a_func, *args, **kwargs)
+
+
+def _get_client_kwargs(pool_size, endpoint_url=None):
+    """
+    Get the keyword arguments to create a boto3 client or resource
+
+    Note: botocore retries are off (max_attempts is the number of retries),
+          so the shared retry policy is the only one retrying a request,
+          and the limiter sees every throttling error.
+    """
+    kwargs = {'config': BotoConfig(
+        max_pool_connections=pool_size, retries={'max_attempts': 0})}
+    if endpoint_url:
+        kwargs['endpoint_url'] = endpoint_url
+    return kwargs
+
+
+def _get_client_options(**kwargs):
+    """
+    Get a tuple of (registry key, session options, pool size, endpoint url)
+
+    Note: region and credentials default to AWS environment variables, and
+          endpoint url to S3_ENDPOINT_URL (e.g. a local S3 stand-in);
+          the secret and token are hashed in the key, never kept in clear.
+    """
+    env = os.environ
+    options = {
+        'region_name': kwargs.get(
+            'region_name') or env.get('AWS_DEFAULT_REGION'),
+        'profile_name': kwargs.get('profile_name') or env.get('AWS_PROFILE'),
+        'aws_access_key_id': kwargs.get(
+            'aws_access_key_id') or env.get('AWS_ACCESS_KEY_ID'),
+        'aws_secret_access_key': kwargs.get(
+            'aws_secret_access_key') or env.get('AWS_SECRET_ACCESS_KEY'),
+        'aws_session_token': kwargs.get(
+            'aws_session_token') or env.get('AWS_SESSION_TOKEN'),
+    }
+    pool_size = kwargs.get('max_pool_connections') or MAX_POOL_CONNECTIONS
+    endpoint_url = kwargs.get('endpoint_url') or env.get('S3_ENDPOINT_URL')
+    secret = '{}:{}'.format(
+        options['aws_secret_access_key'], options['aws_session_token'])
+    key = (
+        options['region_name'], options['profile_name'],
+        options['aws_access_key_id'],
+        hashlib.sha256(secret.encode('utf-8')).hexdigest(),
+        endpoint_url, pool_size)
+    # only pass explicit arguments to boto3 session
+    session_options = dict(
+        (k, v) for k, v in kwargs.items() if k in options and v)
+    return key, session_options, pool_size, endpoint_url
+
+
+class _KeyCache(object):
+    """
+    A thread-safe bounded LRU cache with TTL for S3 key metadata
+
+    Note: a missing key is cached as None (a negative entry) with a
+          shorter TTL, so a key created by another process is not hidden
+          for long; the write functions in this module invalidate the
+          key in cache, which only covers writes in this process.
+    """
+    def __init__(self, maxsize=KEY_CACHE_SIZE,
+                 ttl=KEY_CACHE_TTL, ttl_missing=KEY_CACHE_TTL_MISSING):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttl_missing = ttl_missing
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        with self._lock:
+            self._data.clear()
+
+    def get(self, key):
+        """
+        Get a tuple of (hit, metadata) per key, where metadata is None
+        for a cached missing key
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return (False, None)
+            expires, meta = entry
+            if expires < time.time():
+                return (False, None)
+            self._data[key] = entry  # move to the most recently used
+            return (True, meta)
+
+    def invalidate(self, key):
+        """
+        Remove an entry per key
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def set(self, key, meta):
+        """
+        Set metadata (None for missing key) per key
+        """
+        ttl = self.ttl_missing if meta is None else self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + ttl, meta)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+def _get_content_cached(s3_client, cache, key_name, bucket, reserve=None):
+    """
+    Get content of an object via the content cache, by a conditional GET
+
+    @param reserve: a function called with the size (ContentLength, or the
+                    cached size) before the body is read, e.g. to wait for
+                    a budget of bytes in flight
+    """
+    etag = cache.get_etag(bucket, key_name)
+    params = {'Bucket': bucket, 'Key': key_name}
+    if etag:
+        params['IfNoneMatch'] = etag
+    try:
+        response = _call(s3_client.get_object, **params)
+    except botocore.exceptions.ClientError as ex:
+        if etag and _get_error_code(ex) in ERR_CODES_NOT_MODIFIED:
+            cached = cache.get(bucket, key_name)
+            if cached and cached[0] == etag:
+                LOGGER.debug("- content cached: %s [etag=%s]", key_name, etag)
+                if reserve is not None:
+                    reserve(len(cached[1] or ""))
+                return cached[1] or ""
+            return _get_content_cached(
+                s3_client, cache, key_name, bucket, reserve)
+        if _get_error_code(ex) in ERR_CODES_NOT_FOUND:
+            cache.invalidate(bucket, key_name)
+        raise
+    if reserve is not None:
+        reserve(response['ContentLength'])
+    contents = _read_body(response) if response['ContentLength'] else b''
+    cache.put(bucket, key_name, response.get('ETag'), contents)
+    return contents or ""
+
+
+def _get_many(keys, bucket, workers, max_bytes, use_cache, parse=None):
+    """
+    Yield tuple (key name, contents or parse(contents), or the exception)
+    of keys fetched concurrently, within a budget of bytes in flight
+
+    Note: the budget is closed when the generator is closed (e.g. by the
+          consumer breaking out early), so no fetch waits for it forever.
+    """
+    s3_client = get_client()
+    cache = _CONTENT_CACHE if use_cache else None
+    budget = _ByteBudget(max_bytes)
+
+    def fetch(key_name):
+        """Fetch a key, returning tuple (data, reserved bytes)"""
+        if cache is not None:
+            reserved = []
+
+            def reserve(size):
+                """Reserve the size before reading the body"""
+                budget.acquire(size)
+                reserved.append(size)
+
+            try:
+                contents = _get_content_cached(
+                    s3_client, cache, key_name, bucket, reserve)
+            except Exception:
+                budget.release(sum(reserved))
+                raise
+            size = sum(reserved)
+        else:
+            response = _call(
+                s3_client.get_object, Bucket=bucket, Key=key_name)
+            size = response['ContentLength']
+            budget.acquire(size)
+            try:
+                contents = _read_body(response) if size else b''
+            except Exception:
+                budget.release(size)
+                raise
+        try:
+            return (parse(contents) if parse else contents), size
+        except Exception:
+            budget.release(size)
+            raise
+
+    results = _map_concurrent(fetch, keys, workers, max_in_flight=workers)
+    try:
+        for key_name, result, error in results:
+            if error is not None:
+                LOGGER.debug("- fetch error: %s [%s]", key_name, error)
+                yield key_name, error
+                continue
+            data, size = result
+            try:
+                yield key_name, data
+            finally:
+                budget.release(size)
+    finally:
+        # release reservations of fetched but unyielded results, and wake
+        # up fetches waiting for the budget, before the pool shuts down
+        budget.close()
+        results.close()
+
+
+def _get_object_or_none(key_name, bucket):
+    """
+    Get a get_object response, or None if the key does not exist
+    """
+    try:
+        return _call(get_client().get_object, Bucket=bucket, Key=key_name)
+    except Exception as ex:
+        if _get_error_code(ex) in ERR_CODES_NOT_FOUND:
+            return None
+        raise
+
+
+def _get_error_code(error):
+    """
+    Get the error code of a ClientError, or the exception type name
+    """
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') or type(error).__name__
+
+
+def _get_list_shards(s3_client, prefix, bucket, delimiter=None):
+    """
+    Get a list of shards to list all keys with a prefix, in key order
+
+    @return: a list of dict, each of which has either 'objects' (a list of
+             objects listed already), or 'prefix', 'start_after' and 'end'
+             (listing keys with the prefix in range (start_after, end])
+
+    Note: with a delimiter, the shards are the common prefixes (and the
+          objects directly under prefix); otherwise, the first page, and
+          the rest of keys (if the first page is truncated) as one shard,
+          which is split by the actual keys while listing.
+    """
+    if not delimiter:
+        response = _call(
+            s3_client.list_objects_v2, Bucket=bucket, Prefix=prefix)
+        contents = response.get('Contents') or []
+        units = [{'objects': contents}]
+        if response.get('IsTruncated') and contents:
+            units.append({'prefix': prefix, 'start_after': contents[-1]['Key'],
+                          'end': None})
+        return units
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+    p_iterator = paginator.paginate(
+        Bucket=bucket, Prefix=prefix, Delimiter=delimiter)
+    units = []
+    for page in p_iterator:
+        for obj in page.get('Contents') or []:
+            units.append((obj['Key'], {'objects': [obj]}))
+        for path in page.get('CommonPrefixes') or []:
+            units.append((path['Prefix'], {
+                'prefix': path['Prefix'], 'start_after': None, 'end': None}))
+    units.sort(key=lambda unit: unit[0])
+    return [unit for _, unit in units]
+
+
+def _list_shard_page(s3_client, bucket, shard):
+    """
+    List the next page of a shard (see _get_list_shards), moving its
+    'start_after' to the last key listed
+
+    @return: a tuple of (a list of objects, True if the shard has more)
+    """
+    params = {'Bucket': bucket, 'Prefix': shard['prefix']}
+    if shard.get('start_after'):
+        params['StartAfter'] = shard['start_after']
+    response = _call(s3_client.list_objects_v2, **params)
+    contents = response.get('Contents') or []
+    end = shard.get('end')
+    if end is not None and contents and contents[-1]['Key'] > end:
+        return [obj for obj in contents if obj['Key'] <= end], False
+    if not contents or not response.get('IsTruncated'):
+        return contents, False
+    shard['start_after'] = contents[-1]['Key']
+    return contents, True
+
+
+def _iter_batches(items, batch_size):
+    """
+    Yield lists of up to batch_size items from an iterable
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _iter_bodies_prefetched(objects, bucket, depth, max_bytes):
+    """
+    Yield listed objects with their 'Contents' (bytes, decompressed per
+    ContentEncoding), fetching up to depth objects, of up to max_bytes in
+    total, ahead in parallel
+
+    Note: an object larger than max_bytes is fetched alone; a fetching
+          error (e.g. NoSuchKey, after retries) is raised when its object
+          is reached.
+    """
+    s3_client = get_client()
+    pending = deque()  # tuples of (object, future) in listed order
+    in_flight = 0  # the total size of pending objects
+
+    def fetch(key_name):
+        """Fetch contents of a key, raising any error"""
+        response = _call(s3_client.get_object, Bucket=bucket, Key=key_name)
+        return _read_body(response) if response['ContentLength'] else b''
+
+    executor = futures.ThreadPoolExecutor(max_workers=depth)
+    try:
+        iterator = iter(objects)
+        obj = next(iterator, None)
+        while obj is not None or pending:
+            while obj is not None and len(pending) < depth and (
+                    not pending or
+                    in_flight + obj.get('Size', 0) <= max_bytes):
+                pending.append((obj, executor.submit(fetch, obj['Key'])))
+                in_flight += obj.get('Size', 0)
+                obj = next(iterator, None)
+            first, future = pending.popleft()
+            in_flight -= first.get('Size', 0)
+            first['Contents'] = future.result()
+            yield first
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _iter_chunks(stream, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield chunks (of up to chunk_size) from a file-like stream until EOF
+    """
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _iter_lines(stream, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield lines (bytes, without the line break) from a file-like stream,
+    reading one chunk at a time
+    """
+    parts = []  # the partial line from previous chunks
+    for chunk in _iter_chunks(stream, chunk_size):
+        start = 0
+        pos = chunk.find(b'\n')
+        while pos >= 0:
+            parts.append(chunk[start:pos])
+            yield b''.join(parts)
+            parts = []
+            start = pos + 1
+            pos = chunk.find(b'\n', start)
+        if start < len(chunk):
+            parts.append(chunk[start:])
+    if parts:
+        yield b''.join(parts)
+
+
+def _iter_pages_prefetched(p_iterator, pages):
+    """
+    Yield listed pages of a paginator iterator, fetching up to pages
+    pages ahead on a background thread
+    """
+    page_queue = queue.Queue(maxsize=max(int(pages), 1))
+    stop = threading.Event()
+
+    def put(item):
+        """Put an item in queue until stopped"""
+        while not stop.is_set():
+            try:
+                page_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def list_pages():
+        """List all pages into the queue, ended by None or an exception"""
+        try:
+            for page in p_iterator:
+                if not put(page):
+                    return
+        except Exception as ex:
+            put(ex)
+            return
+        put(None)
+
+    thread = threading.Thread(target=list_pages)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            page = page_queue.get()
+            if page is None:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield page
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _iter_parts(source, part_size):
+    """
+    Yield parts (bytes) of part_size, except the last one, from a source
+    of bytes/string, an iterable of bytes/string, or a file-like object
+    """
+    parts, size = [], 0
+    for chunk in _iter_source(source, part_size):
+        if isinstance(chunk, type(u'')):
+            chunk = chunk.encode('utf-8')
+        offset = 0  # slicing by offset copies each byte once, not the rest
+        while offset < len(chunk):
+            piece = chunk[offset:offset + part_size - size]
+            offset += len(piece)
+            parts.append(piece)
+            size += len(piece)
+            if size >= part_size:
+                yield parts[0] if len(parts) == 1 else b''.join(parts)
+                parts, size = [], 0
+    if parts:
+        yield parts[0] if len(parts) == 1 else b''.join(parts)
+
+
+def _iter_source(source, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield chunks from a source of bytes/string, an iterable of
+    bytes/string, or a file-like object
+    """
+    if isinstance(source, (bytes, type(u''))):
+        return iter([source])
+    if hasattr(source, 'read'):
+        return _iter_chunks(source, chunk_size)
+    return iter(source)
+
+
+def _split_key_range(prefix, start_after, end=None):
+    """
+    Get a key name splitting a key range (start_after, end] of a prefix in
+    about half, at the first character (up to LIST_SPLIT_DEPTH) where the
+    range is wide enough, or None if the range cannot be split
+
+    @param start_after: the lower bound (exclusive), e.g. the last listed
+                        key, or None for the start of the prefix
+    @param end: the upper bound (inclusive), or None for the end of the
+                prefix (in the key space of KEYSPACE_CHARS)
+    """
+    min_char, max_char = ord(KEYSPACE_CHARS[0]), ord(KEYSPACE_CHARS[-1])
+    low = start_after or prefix
+    high = end if end is not None else prefix + chr(max_char + 1)
+    index = 0
+    while index < min(len(low), len(high)) and low[index] == high[index]:
+        index += 1
+    for index in range(index, index + LIST_SPLIT_DEPTH):
+        if index >= len(high):
+            return None
+        lower = ord(low[index]) if index < len(low) else min_char - 1
+        upper = ord(high[index])
+        if upper - lower >= 2:
+            return low[:index] + chr((lower + upper) // 2)
+        if upper - lower != 1 or lower > max_char:
+            return None
+        # keys after low at this character: split deeper under low
+        high = low[:index + 1] + chr(max_char + 1)
+    return None
+
+
+def _log_error(error, message, *args):
+    """
+    Log an error to be swallowed, as a warning if the error is retryable
+    (e.g. throttling), so that work lost after all retries is not silent
+    """
+    if s3_retry.classify_error(error):
+        LOGGER.warning(message + ': %s', *(args + (error,)))
+    else:
+        LOGGER.debug(message + ': %s', *(args + (error,)))
+
+
+def _map_concurrent(a_func, items, workers, max_in_flight=0, ordered=False):
+    """
+    Call a_func on each of the items in a bounded thread pool
+
+    @param a_func: the function to call with one item
+    @param items: an iterable (e.g. generator) of items, consumed lazily
+    @param workers: the number of worker threads
+    @param max_in_flight: the max number of items submitted but not yet
+                          yielded (default: 2 x workers)
+    @param ordered: True to yield in order of items; otherwise, as completed
+
+    @return: a generator of tuple (item, result, error), where error is
+             the exception raised by a_func (or None on success)
+    """
+    workers = max(int(workers), 1)
+    max_in_flight = max(int(max_in_flight or 2 * workers), workers)
+    pending = deque()  # tuples of (item, future) in submission order
+
+    def get_done():
+        """
+        Pop completed futures (the first one only, if ordered)
+        """
+        if ordered:
+            item, future = pending.popleft()
+            return [(item, future)]
+        done, _ = futures.wait(
+            [f for _, f in pending], return_when=futures.FIRST_COMPLETED)
+        results = [(i, f) for i, f in pending if f in done]
+        remains = [(i, f) for i, f in pending if f not in done]
+        pending.clear()
+        pending.extend(remains)
+        return results
+
+    executor = futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        iterator = iter(items)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.append((item, executor.submit(a_func, item)))
+            if not pending:
+                break
+            for item, future in get_done():
+                error = future.exception()
+                result = None if error else future.result()
+                yield (item, result, error)
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _open_checkpoint(options, **scope):
+    """
+    Get a checkpoint per process options (loaded if to resume), or None
+
+    @raise: ValueError if to resume without a checkpoint path
+    """
+    if not options.get('checkpoint'):
+        if options.get('resume'):
+            raise ValueError("param 'resume' requires a 'checkpoint' path")
+        return None
+    checkpoint = _Checkpoint(
+        options['checkpoint'], options.get('checkpoint_interval'), **scope)
+    if options.get('resume'):
+        checkpoint.load()
+    return checkpoint
+
+
+def _pop_process_options(kwargs):
+    """
+    Pop the concurrent mode options (see PROCESS_OPTIONS) from kwargs
+    """
+    options = dict(PROCESS_OPTIONS)
+    for name in PROCESS_OPTIONS:
+        if name in kwargs:
+            options[name] = kwargs.pop(name)
+    return options
+
+
+def _process_items(a_func, items, options, checkpoint=None, **kwargs):
+    """
+    Call a_func on each item, sequentially or concurrently per options,
+    marking each one done in the checkpoint (if any)
+
+    @return: the number of items processed successfully
+    @raise: ProcessError with all errors, in concurrent mode
+    """
+    def get_key(item):
+        """get the key name of an item"""
+        return item.get('Key') if isinstance(item, dict) else item
+
+    if checkpoint is not None:
+        def iter_items(items):
+            """Yield items not done yet, marking each one submitted"""
+            for item in items:
+                if checkpoint.is_done(get_key(item)):
+                    continue
+                checkpoint.submit(get_key(item))
+                yield item
+        items = iter_items(items)
+
+    if not options.get('workers'):
+        counts = 0
+        try:
+            for item in items:
+                a_func(item, **kwargs)
+                counts += 1
+                if checkpoint is not None:
+                    checkpoint.done(get_key(item))
+        except BaseException:
+            if checkpoint is not None:
+                checkpoint.save()
+            raise
+        if checkpoint is not None:
+            checkpoint.save(completed=True)
+        return counts
+
+    def call_func(item):
+        """call a_func with kwargs"""
+        return a_func(item, **kwargs)
+
+    counts, errors = 0, []
+    results = _map_concurrent(
+        call_func, items, options['workers'],
+        max_in_flight=options.get('max_in_flight'),
+        ordered=options.get('ordered'))
+    try:
+        for item, _, error in results:
+            key = get_key(item)
+            if checkpoint is not None:
+                checkpoint.done(key, error)
+            if error is None:
+                counts += 1
+                continue
+            LOGGER.error("- failed to process %s: %s", key, error)
+            errors.append((key, error))
+    except BaseException:
+        if checkpoint is not None:
+            checkpoint.save()
+        raise
+    if checkpoint is not None:
+        checkpoint.save(completed=True)
+
+    if errors:
+        raise ProcessError(
+            "failed to process {} key(s), {} succeeded".format(
+                len(errors), counts), errors=errors, counts=counts)
+    return counts
+
+
+def _read_body(response):
+    """
+    Read the body of a get_object response, decompressed per its
+    ContentEncoding
+    """
+    contents = response['Body'].read()
+    content_encoding = response.get('ContentEncoding')
+    if compression.is_compressed(content_encoding):
+        contents = compression.decompress(contents, content_encoding)
+    return contents
+
+
+def _readinto(stream, view):
+    """
+    Read from a file-like stream into a writable memoryview until it is
+    full or EOF, by stream.readinto (no allocation) if supported, or else
+    by chunks
+
+    @return: the number of bytes read
+    """
+    readinto = getattr(stream, 'readinto', None)
+    total, size = 0, len(view)
+    while total < size:
+        if readinto is not None:
+            count = readinto(view[total:])
+        else:
+            chunk = stream.read(min(size - total, READ_CHUNK_SIZE))
+            count = len(chunk)
+            view[total:total + count] = chunk
+        if not count:
+            break
+        total += count
+    return total
+
+
+def _run_multipart(s3_client, part_func, parts, key_name, bucket, workers,
+                   **kwargs):
+    """
+    Run a multipart upload, or abort it on any error
+
+    @param s3_client: the s3 client
+    @param part_func: the function to upload or copy a part, with the
+                      signature `def func(upload_id, part)`, returning the
+                      ETag of the part
+    @param parts: an iterable of tuple (part number, payload) of all parts
+    @param key_name: the destination key name
+    @param bucket: the destination bucket name
+    @param workers: the number of parts in parallel
+    @param kwargs: additional create_multipart_upload parameters
+
+    @return: the complete_multipart_upload response
+    """
+    upload_id = _call(
+        s3_client.create_multipart_upload,
+        Bucket=bucket, Key=key_name, **kwargs)['UploadId']
+    LOGGER.debug("- multipart upload: %s [bucket=%s, id=%s]",
+                 key_name, bucket, upload_id)
+
+    def call_part_func(part):
+        """call part_func with upload id"""
+        return part_func(upload_id, part)
+
+    uploaded = []
+    results = _map_concurrent(call_part_func, parts, workers)
+    try:
+        for part, etag, error in results:
+            if error is not None:
+                raise error
+            uploaded.append({'ETag': etag, 'PartNumber': part[0]})
+        uploaded.sort(key=lambda part: part['PartNumber'])
+        return _call(
+            s3_client.complete_multipart_upload,
+            Bucket=bucket, Key=key_name, UploadId=upload_id,
+            MultipartUpload={'Parts': uploaded})
+    except Exception:
+        results.close()  # cancel pending parts before aborting
+        LOGGER.error("- aborting multipart upload: %s [bucket=%s]",
+                     key_name, bucket)
+        _call(s3_client.abort_multipart_upload,
+              Bucket=bucket, Key=key_name, UploadId=upload_id)
+        raise
+
+
+_CLIENTS = _ClientRegistry()
+_KEYS = _KeyCache()
+
+# the opt-in on-disk content cache (see set_content_cache)
+_CONTENT_CACHE = None
+
+# the retry policy, with the shared concurrency limiter, of s3 requests
+_RETRY = s3_retry.RetryPolicy(
+    RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+    limiter=s3_retry.AdaptiveLimiter(MAX_CONCURRENCY))
+
+
+def call_with_retry(a_func, *args, **kwargs):
+    """
+    Call a s3 client request function (e.g. get_client().get_object) by
+    the shared retry policy, within the shared limit of requests in flight
+
+    @return: the response of a_func
+    @raise: the last error after retries, or any error not retryable
+
+    example:
+        response = call_with_retry(
+            get_client().get_object, Bucket=bucket, Key=key_name,
+            Range='bytes=0-1023')
+    """
+    return _call(a_func, *args, **kwargs)
+
 
 def check_arg_bucket(bucket):
     """
@@ -85,7 +1285,7 @@ def check_empty_folder(key_name, bucket=BUCKET_DEFAULT):
     empty = True
     contents = None
     s3_client = get_client()
-    result = s3_client.list_objects(Bucket=bucket, Prefix=key_name)
+    result = _call(s3_client.list_objects, Bucket=bucket, Prefix=key_name)
 
     if result:
         contents = result.get('Contents', None)
@@ -102,8 +1302,7 @@ def check_key(key_name, bucket=BUCKET_DEFAULT):
     """
     Check if a S3 key exists
     """
-    key = get_key(key_name, bucket)
-    return key is not None
+    return head_key(key_name, bucket) is not None
 
 
 def check_prefix(prefix, bucket=BUCKET_DEFAULT):
@@ -111,7 +1310,7 @@ def check_prefix(prefix, bucket=BUCKET_DEFAULT):
     Check if a S3 prefix exists
     """
     s3_client = get_client()
-    results = s3_client.list_objects(Bucket=bucket, Prefix=prefix)
+    results = _call(s3_client.list_objects, Bucket=bucket, Prefix=prefix)
     return 'Contents' in results
 
 
@@ -119,14 +1318,11 @@ def check_size(key, bucket=BUCKET_DEFAULT):
     """
     Check the size of a s3 file (key) in a bucket
     """
-    s3_client = get_client()
     try:
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        size = response['ContentLength']
-        return size > 0
+        meta = head_key(key, bucket)
+        return meta is not None and meta['ContentLength'] > 0
     except Exception as ex:
-        LOGGER.debug(ex)
-        pass
+        _log_error(ex, "- size error: %s [bucket=%s]", key, bucket)
     return False
 
 
@@ -148,32 +1344,75 @@ def convert_parquet_to_json(parquet_content):
     for parquet in parquet_content.strip().split("\n"):
         LOGGER.debug("- Parquet: %s\n", parquet)
         # parquet = clean_json(parquet)  # removing trailing commas
-        data.append(json.loads(parquet, 'utf-8'))
+        data.append(json_codec.loads(parquet))
     return data
 
 
-def copy_contents_to_bucket(contents, key_name, bucket=BUCKET_DEFAULT):
+def copy_contents_to_bucket(contents, key_name, bucket=BUCKET_DEFAULT,
+                            content_encoding=None):
     """
     Copy a string content to specified key in s3 bucket and
     overwrite original key if it already exists
+
+    Note: a PUT request overwrites any existing key, so there is no need
+          to check or delete the key first; contents can also be any
+          source supported by upload(), e.g. a file-like object, and
+          compressed per content_encoding (e.g. 'gzip', see upload()).
     """
-    s3_client = get_client()
-    key = get_key(key_name, bucket)
     msg = "{} [{}]".format(key_name, bucket)
-    if key is None:
-        LOGGER.debug('new key: %s', msg)
-    else:
-        LOGGER.debug('deleting %s', msg)
-        # acl = s3_client.get_object_acl(Bucket=bucket, Key=key_name)
-        s3_client.delete_object(Bucket=bucket, Key=key_name)
     LOGGER.debug('put_object: %s', msg)
     try:
-        return s3_client.put_object(Body=contents, Bucket=bucket, Key=key_name)
+        return upload(
+            contents, key_name, bucket, content_encoding=content_encoding)
     except Exception as ex:
         LOGGER.error('failure on putting %s:\n%s', msg, ex)
     return None
 
 
+def copy_key(src_key, dst_key, bucket=BUCKET_DEFAULT, dst_bucket=None,
+             size=None, workers=MULTIPART_WORKERS):
+    """
+    Copy a key by server-side copy, using a multipart copy (with parts
+    copying in parallel) for an object larger than 5 GB
+
+    @param src_key: the source key name
+    @param dst_key: the destination key name
+    @param bucket: the source bucket name
+    @param dst_bucket: the destination bucket name (default: bucket)
+    @param size: the size of source object, or None to get by head_key()
+    @param workers: the number of parts copying in parallel
+
+    @return: the copy_object or complete_multipart_upload response
+    """
+    dst_bucket = dst_bucket or bucket
+    source = {'Bucket': bucket, 'Key': src_key}
+    s3_client = get_client()
+    invalidate_key(dst_key, dst_bucket)
+
+    if size is None:
+        meta = head_key(src_key, bucket, use_cache=False)
+        size = meta['ContentLength'] if meta else 0
+    if size <= COPY_SIZE_MAX:
+        return _call(
+            s3_client.copy_object,
+            Bucket=dst_bucket, CopySource=source, Key=dst_key)
+
+    def copy_part(upload_id, part):
+        """Copy one byte range of source as a part, and return its ETag"""
+        number, start = part
+        end = min(start + COPY_PART_SIZE, size) - 1
+        response = _call(
+            s3_client.upload_part_copy, Bucket=dst_bucket, Key=dst_key,
+            CopySource=source,
+            CopySourceRange='bytes={}-{}'.format(start, end),
+            PartNumber=number, UploadId=upload_id)
+        return response['CopyPartResult']['ETag']
+
+    parts = enumerate(range(0, size, COPY_PART_SIZE), 1)
+    return _run_multipart(
+        s3_client, copy_part, parts, dst_key, dst_bucket, workers)
+
+
 def copy_to_bucket(filename, prefix_path=PREFIX_MINED, bucket=BUCKET_DEFAULT):
     """
     Upload a local file per path prefix in bucket
@@ -194,6 +1433,7 @@ def copy_to_bucket(filename, prefix_path=PREFIX_MINED, bucket=BUCKET_DEFAULT):
             basename = os.path.basename(filename)
             prefix = prefix_path.strip('/') + "/" + basename
             LOGGER.debug("uploading [" + filename + "] to [" + prefix + "]")
+            invalidate_key(prefix, bucket)
             s3_resource.meta.client.upload_file(filename, bucket, prefix)
             LOGGER.debug("uploaded: [" + prefix + "]")
         else:
@@ -205,11 +1445,12 @@ def copy_to_bucket(filename, prefix_path=PREFIX_MINED, bucket=BUCKET_DEFAULT):
     return True
 
 
-def create_key(contents, key_name, bucket=BUCKET_DEFAULT):
-    """Create a key on s3"""
+def create_key(contents, key_name, bucket=BUCKET_DEFAULT,
+               content_encoding=None):
+    """Create a key on s3 (see upload() for contents and content_encoding)"""
     try:
-        s3_client = get_client()
-        return s3_client.put_object(Body=contents, Bucket=bucket, Key=key_name)
+        return upload(
+            contents, key_name, bucket, content_encoding=content_encoding)
     except Exception as ex:
         LOGGER.error('failure on creating %s [%s]:\n%s', key_name, bucket, ex)
         return None
@@ -225,7 +1466,7 @@ def delete_empty_folder(key_name, bucket=BUCKET_DEFAULT):
     empty = True
     contents = None
     s3_client = get_client()
-    result = s3_client.list_objects(Bucket=bucket, Prefix=key_name)
+    result = _call(s3_client.list_objects, Bucket=bucket, Prefix=key_name)
 
     if result:
         contents = result.get('Contents', None)
@@ -251,62 +1492,371 @@ def delete_key(key_name, bucket=BUCKET_DEFAULT):
     try:
         s3_client = get_client()
         LOGGER.info("deleting key: %s [bucket=%s]", key_name, bucket)
-        s3_client.delete_object(Bucket=bucket, Key=key_name)
+        invalidate_key(key_name, bucket)
+        _call(s3_client.delete_object, Bucket=bucket, Key=key_name)
         return True
     except Exception as ex:
-        LOGGER.debug(ex)
+        _log_error(ex, "- delete error: %s [bucket=%s]", key_name, bucket)
         return False
 
 
-def get_client():
+def delete_keys(keys, bucket=BUCKET_DEFAULT, workers=DELETE_WORKERS):
     """
-    Get S3 client
-    note: This function can be customized to accept configurations
+    Delete keys in batches of DeleteObjects requests (1000 keys each)
+
+    @param keys: an iterable (e.g. generator) of key names, or of listed
+                 objects (dict with 'Key')
+    @param bucket: the bucket name (top-level directory in S3)
+    @param workers: the number of DeleteObjects requests in parallel
+
+    @return: a dict of 'deleted' (the number of keys deleted) and 'errors'
+             (a list of dict with 'Key', 'Code' and 'Message' per key)
     """
-    session = boto3_session.Session()
-    s3_client = session.client('s3')
-    return s3_client
+    s3_client = get_client()
+
+    def delete_batch(batch):
+        """
+        Delete a batch of keys, retrying keys failed by throttling or
+        transient errors, and return a list of errors
+        """
+        for key_name in batch:
+            invalidate_key(key_name, bucket)
+        failed, pending = [], batch
+        for attempt in range(1, _RETRY.max_attempts + 1):
+            response = _call(
+                s3_client.delete_objects, Bucket=bucket,
+                Delete={'Objects': [{'Key': k} for k in pending],
+                        'Quiet': True})
+            errors, retries = [], []
+            for err in response.get('Errors', []):
+                kind = s3_retry.classify_error_code(str(err.get('Code')))
+                (retries if kind else errors).append(err)
+                if kind == s3_retry.ERROR_THROTTLE and _RETRY.limiter:
+                    _RETRY.limiter.on_throttle()
+            failed.extend(errors)
+            if not retries or attempt >= _RETRY.max_attempts:
+                return failed + retries
+            pending = [err['Key'] for err in retries]
+            time.sleep(_RETRY.get_delay(attempt))
+        return failed
+
+    key_names = (k.get('Key') if isinstance(k, dict) else k for k in keys)
+    batches = _iter_batches(key_names, DELETE_BATCH_SIZE)
+    result = {'deleted': 0, 'errors': []}
+
+    for batch, errors, error in _map_concurrent(
+            delete_batch, batches, workers):
+        if error is not None:
+            errors = [{'Key': k, 'Code': _get_error_code(error),
+                       'Message': str(error)} for k in batch]
+        for err in errors:
+            LOGGER.error("- failed to delete %s [bucket=%s]: %s",
+                         err.get('Key'), bucket, err.get('Message'))
+        result['errors'].extend(errors)
+        result['deleted'] += len(batch) - len(errors)
+
+    LOGGER.info("deleted %s key(s) [bucket=%s]", result['deleted'], bucket)
+    return result
 
 
-def get_resource():
+def delete_prefix(prefix, bucket=BUCKET_DEFAULT, workers=DELETE_WORKERS):
     """
-    Get S3 resource
-    note: This function can be customized to accept configurations
+    Delete all keys with a prefix, streaming keys from the paginator into
+    batched DeleteObjects requests (see delete_keys)
+
+    @param prefix: the prefix (starting under the bucket), must not be empty
+    @param bucket: the bucket name (top-level directory in S3)
+    @param workers: the number of DeleteObjects requests in parallel
+
+    @return: the same as delete_keys()
+    """
+    if not prefix:
+        raise ValueError("param 'prefix' must not be empty")
+
+    s3_client = get_client()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    p_iterator = paginator.paginate(Bucket=bucket, Prefix=prefix)
+    objects = (obj for obj in p_iterator.search('Contents') if obj)
+    return delete_keys(objects, bucket, workers)
+
+
+def download_to_fd(key_name, fd, bucket=BUCKET_DEFAULT,
+                   max_size=CONTENT_MAX_SIZE, decompress=True,
+                   chunk_size=READ_CHUNK_SIZE):
     """
-    session = boto3_session.Session()
-    s3_resource = session.resource('s3')
-    return s3_resource
+    Stream a s3 file (key_name) straight to a file descriptor, through one
+    reused chunk buffer (no allocation per chunk)
 
+    @param key_name: the key name
+    @param fd: a file descriptor (int, e.g. of a file or a socket) or a
+               file object (flushed first) to write to, from its position
+    @param bucket: the bucket name (top-level directory in S3)
+    @param max_size: the max number of bytes to write
+    @param decompress: True to decompress a compressed object (per its
+                       ContentEncoding)
+    @param chunk_size: the size (in bytes) of the chunk buffer
+
+    @return: the number of bytes written, or None if the key does not exist
+    @raise: ValueError if the content is larger than max_size (where a
+            decompressed content may be written partly)
+    """
+    if hasattr(fd, 'fileno'):
+        fd.flush()
+        fd = fd.fileno()
+    response = _get_object_or_none(key_name, bucket)
+    if response is None:
+        return None
+    body = stream = response['Body']
+    content_encoding = response.get('ContentEncoding')
+    try:
+        if decompress and compression.is_compressed(content_encoding):
+            stream = compression.DecompressedStream(
+                body, content_encoding, chunk_size)
+        elif response['ContentLength'] > max_size:
+            raise ValueError("content too large: {} > {} bytes [{}]".format(
+                response['ContentLength'], max_size, key_name))
+        chunk = memoryview(bytearray(chunk_size))
+        total = 0
+        while True:
+            count = _readinto(stream, chunk)
+            if not count:
+                break
+            total += count
+            if total > max_size:
+                raise ValueError("content too large: > {} bytes [{}]".format(
+                    max_size, key_name))
+            written = 0
+            while written < count:
+                written += os.write(fd, chunk[written:count])
+        return total
+    finally:
+        body.close()
+
+
+def download_to_mmap(key_name, bucket=BUCKET_DEFAULT, filename=None,
+                     part_size=RANGE_PART_SIZE, workers=RANGE_WORKERS):
+    """
+    Download a s3 file (key_name) by byte ranges in parallel, writing
+    each range straight into a preallocated memory-mapped file
 
-def get_content(key_name, bucket=BUCKET_DEFAULT):
+    @param key_name: the key name
+    @param bucket: the bucket name (top-level directory in S3)
+    @param filename: the local file to keep the content; or a temporary
+                     file (removed on closing the mmap) if None
+    @param part_size: the size (in bytes) of each byte range
+    @param workers: the number of ranges downloading in parallel
+
+    @return: a mmap.mmap of the content (use memoryview/slices on it for
+             zero-copy access, and close it when done), b'' for an empty
+             object, or None if the key does not exist
+    @raise: ClientError if any range fails, e.g. 412 Precondition Failed
+            if the object is changed during the download
+
+    example:
+        data = download_to_mmap("mined-json/big.json", workers=16)
+        view = memoryview(data)
+    """
+    meta = head_key(key_name, bucket, use_cache=False)
+    if meta is None:
+        return None
+    size = meta['ContentLength']
+    if size <= 0:
+        return b''
+
+    s3_client = get_client()
+    etag = meta.get('ETag')
+    part_size = max(int(part_size), 1)
+    ranges = [(start, min(start + part_size, size) - 1)
+              for start in range(0, size, part_size)]
+
+    file_obj = open(filename, 'w+b') if filename else tempfile.TemporaryFile()
+    try:
+        file_obj.truncate(size)
+        content = mmap.mmap(file_obj.fileno(), size)
+    finally:
+        file_obj.close()  # the mmap keeps its own file descriptor
+
+    def get_range(byte_range):
+        """Download one byte range into the mmap"""
+        start, end = byte_range
+        params = {'Bucket': bucket, 'Key': key_name,
+                  'Range': 'bytes={}-{}'.format(start, end)}
+        if etag:
+            params['IfMatch'] = etag
+        body = _call(s3_client.get_object, **params)['Body']
+        pos = start
+        try:
+            while pos <= end:
+                chunk = body.read(min(READ_CHUNK_SIZE, end + 1 - pos))
+                if not chunk:
+                    break
+                content[pos:pos + len(chunk)] = chunk
+                pos += len(chunk)
+        finally:
+            body.close()
+        if pos != end + 1:
+            raise IOError("incomplete range {}-{} of {} [{}]".format(
+                start, end, key_name, bucket))
+
+    LOGGER.debug("- downloading %s [size=%s, ranges=%s]",
+                 key_name, size, len(ranges))
+    results = _map_concurrent(get_range, ranges, workers)
+    for _, _, error in results:
+        if error is not None:
+            results.close()  # wait for running ranges before unmapping
+            content.close()
+            raise error
+    if filename:
+        content.flush()
+    return content
+
+
+def get_client(**kwargs):
+    """
+    Get a pooled S3 client (shared by all threads in the process)
+
+    @param kwargs: optional configurations, e.g. region_name, profile_name,
+                   aws_access_key_id, aws_secret_access_key,
+                   aws_session_token, endpoint_url, max_pool_connections
+    @return: a cached S3 client per region/credentials
+    """
+    return _CLIENTS.get_client(**kwargs)
+
+
+def get_resource(**kwargs):
+    """
+    Get a pooled S3 resource (cached per thread)
+
+    @param kwargs: optional configurations, the same as get_client()
+    @return: a cached S3 resource per region/credentials
+    """
+    return _CLIENTS.get_resource(**kwargs)
+
+
+def get_content(key_name, bucket=BUCKET_DEFAULT, use_cache=True):
     """
     Get content from a s3 file (key_name) in a bucket
+
+    Note: a compressed object (per its ContentEncoding, e.g. gzip) is
+          decompressed; with a content cache (see set_content_cache), a
+          cached object is revalidated by a conditional GET (IfNoneMatch
+          on its ETag), and read from local disk if not modified.
+
+    @param use_cache: False to bypass the content cache
     """
     s3_client = get_client()
+    cache = _CONTENT_CACHE if use_cache else None
     try:
         LOGGER.debug("- getting object: %s [bucket='%s']", key_name, bucket)
-        response = s3_client.get_object(Bucket=bucket, Key=key_name)
+        if cache is not None:
+            return _get_content_cached(s3_client, cache, key_name, bucket)
+        response = _call(
+            s3_client.get_object, Bucket=bucket, Key=key_name)
         size = response['ContentLength']
         if size > 0:
             LOGGER.debug("- reading object: %s [size=%s]", key_name, size)
-            contents = response['Body'].read()  # .decode('utf-8')
+            contents = _read_body(response)  # .decode('utf-8')
             return contents
         else:
             LOGGER.debug("- content zero: %s", key_name)
             return ""
     except Exception as ex:
-        LOGGER.debug("- content error: %s", key_name)
-        LOGGER.debug(ex)
+        _log_error(ex, "- content error: %s [bucket=%s]", key_name, bucket)
 
     return None
 
 
+def get_content_into(key_name, bucket=BUCKET_DEFAULT, buffer=None,
+                     max_size=CONTENT_MAX_SIZE):
+    """
+    Get content from a s3 file (key_name) into a buffer, reading the body
+    by readinto (no intermediate bytes), without copying the result
+
+    @param key_name: the key name
+    @param bucket: the bucket name (top-level directory in S3)
+    @param buffer: a writable buffer (e.g. a bytearray, or from a
+                   BufferPool) to read into; or None to allocate one of
+                   the content size
+    @param max_size: the max size (in bytes) of the content
+
+    @return: a memoryview of the content in the buffer (slice it, or
+             decode by view.tobytes() only if needed), or None if the key
+             does not exist
+    @raise: ValueError if the content is larger than max_size or the buffer
+
+    Note: a compressed object (per its ContentEncoding) is decompressed;
+          the content cache (see set_content_cache) is not used.
+    """
+    response = _get_object_or_none(key_name, bucket)
+    if response is None:
+        return None
+    body = stream = response['Body']
+    size = response['ContentLength']
+    content_encoding = response.get('ContentEncoding')
+    limit = max_size if buffer is None else min(max_size, len(buffer))
+    try:
+        if compression.is_compressed(content_encoding):
+            stream = compression.DecompressedStream(
+                body, content_encoding, READ_CHUNK_SIZE)
+            if buffer is None:  # the decompressed size is unknown
+                buffer = bytearray()
+                for chunk in _iter_chunks(stream):
+                    buffer += chunk
+                    if len(buffer) > limit:
+                        raise ValueError(
+                            "content too large: > {} bytes [{}]".format(
+                                limit, key_name))
+                return memoryview(buffer)
+        elif size > limit:
+            raise ValueError("content too large: {} > {} bytes [{}]".format(
+                size, limit, key_name))
+        elif buffer is None:
+            buffer = bytearray(size)
+        view = memoryview(buffer)
+        count = _readinto(stream, view[:limit])
+        if count == limit and stream.read(1):
+            raise ValueError("content too large: > {} bytes [{}]".format(
+                limit, key_name))
+        return view[:count]
+    finally:
+        body.close()
+
+
+def get_contents_many(keys, bucket=BUCKET_DEFAULT, workers=FETCH_WORKERS,
+                      max_bytes=FETCH_MAX_BYTES, use_cache=True):
+    """
+    Fetch contents of many s3 files (keys) in a bucket concurrently,
+    yielding results as they complete
+
+    @param keys: an iterable of key names (consumed lazily)
+    @param bucket: the bucket name (top-level directory in S3)
+    @param workers: the number of keys fetching in parallel
+    @param max_bytes: the max total size (in bytes, by ContentLength) of
+                      contents fetched but not yet consumed; a fetch waits
+                      (after its response headers) until its size fits
+    @param use_cache: False to bypass the content cache
+
+    @return: a generator of tuple (key name, contents), where contents is
+             bytes (decompressed, per ContentEncoding), or the exception
+             on error (e.g. ClientError of NoSuchKey)
+
+    example:
+        for key_name, data in get_contents_many(keys, workers=32):
+            if isinstance(data, Exception):
+                continue
+            process_contents(key_name, data)
+    """
+    for key_name, data in _get_many(keys, bucket, workers, max_bytes,
+                                    use_cache):
+        yield key_name, data
+
+
 def get_json_data(key_name, bucket=BUCKET_DEFAULT):
     """
     Get JSON data obejct from a s3 file (key_name) in a bucket
 
-    Note: using `json.loads()` to read from string,
-          comparing to `json.load()` which read from local file directly
+    Note: using `json_codec.loads()` to read from string, comparing to
+          `json.load()` which read from local file directly
           ```
           with open('filename.json') as data_file:
               data = json.load(data_file)
@@ -316,8 +1866,9 @@ def get_json_data(key_name, bucket=BUCKET_DEFAULT):
     if json_content:
         # logger.debug("- Data contents: %s\n", json_content)
         try:
-            data = json.loads(json_content)
-            LOGGER.debug("- JSON object: %s\n", json.dumps(data))
+            data = json_codec.loads(json_content)
+            if LOGGER.isEnabledFor(logging.DEBUG):
+                LOGGER.debug("- JSON object: %s\n", json_codec.dumps(data))
             return data
         except Exception as ex:
             LOGGER.debug(ex)
@@ -348,16 +1899,41 @@ def get_json_files(prefix='', bucket=BUCKET_DEFAULT):
     return files
 
 
+def get_json_many(keys, bucket=BUCKET_DEFAULT, workers=FETCH_WORKERS,
+                  max_bytes=FETCH_MAX_BYTES, use_cache=True):
+    """
+    Fetch JSON data of many s3 files (keys) in a bucket concurrently,
+    yielding results as they complete (see get_contents_many)
+
+    @return: a generator of tuple (key name, data), where data is the JSON
+             object, or the exception on error (including ValueError of
+             invalid JSON)
+    """
+    for key_name, data in _get_many(keys, bucket, workers, max_bytes,
+                                    use_cache, json_codec.loads):
+        yield key_name, data
+
+
 def get_key(key_name, bucket=BUCKET_DEFAULT):
     """
-    Get key object in s3 bucket
+    Get key object (s3.ObjectSummary) in s3 bucket
+
+    Note: the object attributes are loaded from head_key(), rather than
+          listing all objects by the key name as prefix
     """
+    meta = head_key(key_name, bucket)
+    if meta is None:
+        return None
     s3_resource = get_resource()
-    bucket = s3_resource.Bucket(bucket)
-    objects = list(bucket.objects.filter(Prefix=key_name))
-    if len(objects) > 0 and objects[0].key == key_name:
-        return objects[0]
-    return None
+    s3_object = s3_resource.ObjectSummary(bucket, key_name)
+    s3_object.meta.data = {
+        'Key': key_name,
+        'ETag': meta.get('ETag'),
+        'LastModified': meta.get('LastModified'),
+        'Size': meta.get('ContentLength'),
+        'StorageClass': meta.get('StorageClass', 'STANDARD'),
+    }
+    return s3_object
 
 
 def get_keys(prefix='', suffix='/', **kwargs):
@@ -389,19 +1965,270 @@ def get_parquet_data(key_name, bucket=BUCKET_DEFAULT):
 
     Note: For parquet contents, each line is in valid JSON format
           but the file itself is not.
+          The records are decoded from the object body as a stream (see
+          iter_json_lines), without holding the whole content in memory.
+          For columnar Apache Parquet files, see pyapi.utils.s3_parquet.
     """
-    parquet_content = get_content(key_name, bucket)
-    if parquet_content:
-        # logger.debug("- Data contents: %s\n", parquet_content)
-        try:
-            data = convert_parquet_to_json(parquet_content)
-            LOGGER.debug("- JSON object: %s\n", json.dumps(data))
+    try:
+        data = list(iter_json_lines(key_name, bucket))
+        if data:
+            LOGGER.debug("- JSON objects: %s", len(data))
             return data
-        except Exception as ex:
-            LOGGER.debug(ex)
+    except Exception as ex:
+        LOGGER.debug(ex)
     return None
 
 
+def get_stream(key_name, bucket=BUCKET_DEFAULT, decompress=True):
+    """
+    Get the body (a file-like botocore StreamingBody) of a s3 file
+    (key_name) in a bucket, to read the content incrementally
+
+    @param decompress: True to decompress a compressed object (per its
+                       ContentEncoding) while reading, by a file-like
+                       compression.DecompressedStream over the body
+    """
+    s3_client = get_client()
+    LOGGER.debug("- getting stream: %s [bucket='%s']", key_name, bucket)
+    response = _call(s3_client.get_object, Bucket=bucket, Key=key_name)
+    content_encoding = response.get('ContentEncoding')
+    if decompress and compression.is_compressed(content_encoding):
+        return compression.DecompressedStream(
+            response['Body'], content_encoding, READ_CHUNK_SIZE)
+    return response['Body']
+
+
+def head_key(key_name, bucket=BUCKET_DEFAULT, use_cache=True):
+    """
+    Get the metadata of a S3 key by a HEAD request
+
+    @param key_name: the key name
+    @param bucket: the bucket name (top-level directory in S3)
+    @param use_cache: True to look up (and update) the key metadata cache
+
+    @return: a dict of the head_object response (e.g. ContentLength, ETag,
+             LastModified, ContentType, Metadata), or None if not found
+    """
+    cache_key = (bucket, key_name)
+    if use_cache:
+        hit, meta = _KEYS.get(cache_key)
+        if hit:
+            return meta
+
+    s3_client = get_client()
+    try:
+        meta = _call(s3_client.head_object, Bucket=bucket, Key=key_name)
+        meta.pop('ResponseMetadata', None)
+    except botocore.exceptions.ClientError as ex:
+        code = str(ex.response.get('Error', {}).get('Code'))
+        if code not in ERR_CODES_NOT_FOUND:
+            raise
+        LOGGER.debug("- key not found: %s [bucket=%s]", key_name, bucket)
+        meta = None
+
+    _KEYS.set(cache_key, meta)
+    return meta
+
+
+def invalidate_key(key_name=None, bucket=BUCKET_DEFAULT):
+    """
+    Invalidate a key (or all keys, if key_name is None) in metadata cache
+    """
+    if key_name is None:
+        _KEYS.clear()
+    else:
+        _KEYS.invalidate((bucket, key_name))
+
+
+def iter_json_lines(key_name, bucket=BUCKET_DEFAULT, batch_size=0,
+                    encoding='utf-8', chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield JSON records from a line-delimited JSON (parquet) s3 file,
+    decoding the object body incrementally in constant memory
+
+    @param key_name: the key name
+    @param bucket: the bucket name (top-level directory in S3)
+    @param batch_size: yield a list of up to batch_size records at a time,
+                       or each record if 0
+    @param encoding: the character encoding of the content
+    @param chunk_size: the number of bytes read from the body at a time
+
+    @return: a generator of JSON objects (or lists of JSON objects)
+
+    example:
+        for records in iter_json_lines("mined-json/part-0", batch_size=500):
+            process_records(records)
+    """
+    body = get_stream(key_name, bucket)
+    batch = []
+    try:
+        for line in _iter_lines(body, chunk_size):
+            line = line.strip()
+            if not line:
+                continue
+            if encoding not in ('utf-8', 'utf8'):
+                line = line.decode(encoding)
+            record = json_codec.loads(line)
+            if not batch_size:
+                yield record
+                continue
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        body.close()
+
+
+def list_objects_sharded(prefix='', bucket=BUCKET_DEFAULT, delimiter=None,
+                         shards=0, workers=LIST_WORKERS, sort=False):
+    """
+    List all objects with a prefix by listing its shards in parallel,
+    merging the listed objects into one stream
+
+    @param prefix: the prefix (starting under the bucket) of the key name
+    @param bucket: the bucket name (top-level directory in S3)
+    @param delimiter: the delimiter (e.g. '/') to shard by sub-prefixes;
+                      or None to split the key space after prefix
+    @param shards: the max number of shards split from the key space
+                   (default: 4 x workers)
+    @param workers: the number of shards listing in parallel
+    @param sort: True to yield objects in key order (as list_objects does);
+                 otherwise, in the order of listed pages
+
+    @return: a generator of listed objects (dict with 'Key', 'Size', ...)
+
+    Note: a prefix of one page is listed by one request; otherwise a shard
+          is split in half (see _split_key_range) after the last key it
+          listed, only when a worker is idle, so shards follow the actual
+          keys (e.g. all starting with a date) at any depth.
+
+    example:
+        for obj in list_objects_sharded(PREFIX_MINED + "/", workers=16):
+            print(obj['Key'])
+    """
+    s3_client = get_client()
+    workers = max(int(workers), 1)
+    max_shards = max(int(shards or 4 * workers), 1)
+    units = _get_list_shards(s3_client, prefix, bucket, delimiter)
+    for unit in units:
+        if 'prefix' in unit:
+            unit.update(pages=deque(), busy=False, done=False)
+    max_buffered = LIST_QUEUE_PAGES * workers
+    cond = threading.Condition()
+    state = {'idle': 0, 'buffered': 0, 'error': None, 'stop': False,
+             'shards': sum(1 for unit in units if 'prefix' in unit)}
+
+    def is_done():
+        """Check if all shards are listed (or stopped on error)"""
+        return state['stop'] or all(
+            unit['done'] for unit in units if 'prefix' in unit)
+
+    def pick():
+        """Pick the first shard to list, with room for its next page"""
+        if not sort and state['buffered'] >= max_buffered:
+            return None
+        for unit in units:
+            if 'prefix' in unit and not unit['busy'] and not unit['done'] \
+               and (not sort or len(unit['pages']) < LIST_QUEUE_PAGES):
+                return unit
+        return None
+
+    def split(shard):
+        """Split a shard after its listed keys, inserting the upper half"""
+        if state['shards'] >= max_shards:
+            return
+        key_name = _split_key_range(
+            shard['prefix'], shard['start_after'], shard['end'])
+        if key_name is None:
+            return
+        upper = {'prefix': shard['prefix'], 'start_after': key_name,
+                 'end': shard['end'], 'pages': deque(), 'busy': False,
+                 'done': False}
+        shard['end'] = key_name
+        index = next(i for i, unit in enumerate(units) if unit is shard)
+        units.insert(index + 1, upper)
+        state['shards'] += 1
+
+    def work():
+        """List pages of shards until all are done"""
+        while True:
+            with cond:
+                shard = None if state['stop'] else pick()
+                while shard is None:
+                    if is_done():
+                        return
+                    state['idle'] += 1
+                    cond.wait()
+                    state['idle'] -= 1
+                    shard = None if state['stop'] else pick()
+                shard['busy'] = True
+            try:
+                contents, more = _list_shard_page(s3_client, bucket, shard)
+            except Exception as ex:
+                with cond:
+                    state['error'], state['stop'] = ex, True
+                    cond.notify_all()
+                return
+            with cond:
+                shard['busy'] = False
+                if contents:
+                    shard['pages'].append(contents)
+                    state['buffered'] += 1
+                shard['done'] = not more
+                if more and state['idle']:
+                    split(shard)
+                cond.notify_all()
+
+    def pop_page(shard=None):
+        """Pop a listed page (of a shard, if sort), or None when done"""
+        with cond:
+            while True:
+                if state['error'] is not None:
+                    raise state['error']
+                for unit in units if shard is None else [shard]:
+                    if 'prefix' in unit and unit['pages']:
+                        state['buffered'] -= 1
+                        cond.notify_all()
+                        return unit['pages'].popleft()
+                if is_done() if shard is None else shard['done']:
+                    return None
+                cond.wait()
+
+    threads = [threading.Thread(target=work, name='list-{}'.format(i))
+               for i in range(min(workers, max_shards))
+               if state['shards']]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        if not sort:
+            for unit in units:
+                for obj in unit.get('objects', []):
+                    yield obj
+            for page in iter(pop_page, None):
+                for obj in page:
+                    yield obj
+            return
+        index = 0
+        while index < len(units):  # shards are inserted after the current
+            unit = units[index]
+            pages = iter(lambda: pop_page(unit), None) \
+                if 'prefix' in unit else [unit['objects']]
+            for page in pages:
+                for obj in page:
+                    yield obj
+            index += 1
+    finally:
+        with cond:
+            state['stop'] = True
+            cond.notify_all()
+        for thread in threads:
+            thread.join()
+
+
 # pylint: disable=invalid-name
 def mv(old_path, new_path, filename, s_bucket=BUCKET_DEFAULT):
     """
@@ -424,9 +2251,13 @@ def mv(old_path, new_path, filename, s_bucket=BUCKET_DEFAULT):
         client = get_client()
         source = s_bucket + '/' + oldkey  # the source must include bucket name
         LOGGER.debug("moving [" + oldkey + "] to [" + newkey + "]")
-        client.copy_object(Bucket=s_bucket, CopySource=source, Key=newkey)
-        client.delete_object(Bucket=s_bucket, Key=oldkey)
-    except Exception:
+        invalidate_key(oldkey, s_bucket)
+        invalidate_key(newkey, s_bucket)
+        _call(client.copy_object,
+              Bucket=s_bucket, CopySource=source, Key=newkey)
+        _call(client.delete_object, Bucket=s_bucket, Key=oldkey)
+    except Exception as ex:
+        _log_error(ex, "- move error: %s [bucket=%s]", oldkey, s_bucket)
         return False
 
     return True
@@ -446,13 +2277,186 @@ def mv_key(oldkey, newkey, bucket=BUCKET_DEFAULT):
         s3_resource = get_resource()
         source = bucket + '/' + oldkey  # the source must include bucket name
         LOGGER.debug("moving [" + oldkey + "] to [" + newkey + "]")
-        s3_resource.Object(bucket, newkey).copy_from(CopySource=source)
-        s3_resource.Object(bucket, oldkey).delete()
+        invalidate_key(oldkey, bucket)
+        invalidate_key(newkey, bucket)
+        _call(s3_resource.Object(bucket, newkey).copy_from,
+              CopySource=source)
+        _call(s3_resource.Object(bucket, oldkey).delete)
         return True
-    except Exception:
+    except Exception as ex:
+        _log_error(ex, "- move error: %s [bucket=%s]", oldkey, bucket)
         return False
 
 
+def mv_prefix(src_prefix, dst_prefix, bucket=BUCKET_DEFAULT, dst_bucket=None,
+              workers=MOVE_WORKERS, keys=None):
+    """
+    Move all keys with a prefix to another prefix (and/or bucket) by
+    server-side copies in parallel, then delete the sources in batches
+
+    @param src_prefix: the source prefix, must not be empty
+    @param dst_prefix: the destination prefix replacing the source prefix
+    @param bucket: the source bucket name
+    @param dst_bucket: the destination bucket name (default: bucket)
+    @param workers: the number of keys copying in parallel
+    @param keys: an iterable of source key names (with src_prefix) to move
+                 only these keys, or None to move all keys by listing
+
+    @return: a dict of 'moved' (the number of keys moved), 'skipped' (the
+             number of keys already copied), and 'errors' (a list of dict
+             with 'Key', 'Code' and 'Message' per key, by copy or delete)
+
+    Note: the operation is restartable - a key deleted from the source is
+          moved already; and a source key, of which the destination has
+          the same size and ETag (or, if either is a multipart ETag, is
+          not older than the source), is only deleted but not copied.
+          The destination is listed once to compare all keys, except for
+          an explicit key list, of which each key (at source and at
+          destination) is compared by a HEAD request; a key not found at
+          source is moved already.
+
+    example:
+        mv_prefix(PREFIX_MINED + "/20170116/", PREFIX_PROCESSED + "/20170116/")
+        mv_prefix(PREFIX_MINED + "/", PREFIX_PROCESSED + "/",
+                  keys=[PREFIX_MINED + "/20170116/a.json"])
+    """
+    dst_bucket = dst_bucket or bucket
+    if not src_prefix:
+        raise ValueError("param 'src_prefix' must not be empty")
+    if dst_bucket == bucket and (
+            dst_prefix.startswith(src_prefix) or
+            src_prefix.startswith(dst_prefix)):
+        raise ValueError("param 'dst_prefix' must not overlap 'src_prefix'")
+
+    s3_client = get_client()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    dst_objects = None
+    if keys is None:
+        p_iterator = paginator.paginate(Bucket=bucket, Prefix=src_prefix)
+        objects = (obj for obj in p_iterator.search('Contents') if obj)
+        p_iterator = paginator.paginate(Bucket=dst_bucket, Prefix=dst_prefix)
+        dst_objects = dict(
+            (obj['Key'], obj) for obj in p_iterator.search('Contents') if obj)
+    else:
+        objects = ({'Key': key_name} for key_name in keys)
+    result = {'moved': 0, 'skipped': 0, 'errors': []}
+
+    def get_listed(key_name, a_bucket):
+        """Get a key as listed (Size, ETag, LastModified) by HEAD request"""
+        meta = head_key(key_name, a_bucket, use_cache=False)
+        if meta is None:
+            return None
+        return {'Key': key_name, 'Size': meta.get('ContentLength'),
+                'ETag': meta.get('ETag'),
+                'LastModified': meta.get('LastModified')}
+
+    def copy_obj(obj):
+        """Copy an object to destination, unless copied (or moved) already"""
+        key_name = obj['Key']
+        if not key_name.startswith(src_prefix):
+            raise ValueError("key '{}' is not under prefix '{}'".format(
+                key_name, src_prefix))
+        dst_key = dst_prefix + key_name[len(src_prefix):]
+        if dst_objects is None:
+            obj = get_listed(key_name, bucket)
+            if obj is None:
+                return None
+            dst_obj = get_listed(dst_key, dst_bucket)
+        else:
+            dst_obj = dst_objects.get(dst_key)
+        if dst_obj and dst_obj.get('Size') == obj.get('Size'):
+            etags = (dst_obj.get('ETag') or '', obj.get('ETag') or '')
+            if etags[0] and etags[0] == etags[1]:
+                return False
+            modified = (dst_obj.get('LastModified'), obj.get('LastModified'))
+            if '-' in etags[0] + etags[1] and None not in modified and \
+               modified[0] >= modified[1]:
+                return False
+        copy_key(key_name, dst_key, bucket, dst_bucket, size=obj.get('Size'))
+        return True
+
+    def iter_copied():
+        """Yield the source key names copied (or skipped) successfully"""
+        for obj, copied, error in _map_concurrent(copy_obj, objects, workers):
+            if error is not None:
+                LOGGER.error("- failed to copy %s: %s", obj['Key'], error)
+                result['errors'].append({
+                    'Key': obj['Key'], 'Code': _get_error_code(error),
+                    'Message': str(error)})
+                continue
+            if copied is None:
+                LOGGER.debug("- moved already: %s", obj['Key'])
+                continue
+            if not copied:
+                result['skipped'] += 1
+            yield obj['Key']
+
+    deleted = delete_keys(iter_copied(), bucket)
+    result['moved'] = deleted['deleted']
+    result['errors'].extend(deleted['errors'])
+    LOGGER.info("moved %s key(s) from [%s] to [%s]",
+                result['moved'], src_prefix, dst_prefix)
+    return result
+
+
+def prefix_stats(prefix='', bucket=BUCKET_DEFAULT, workers=LIST_WORKERS,
+                 bounds=SIZE_HISTOGRAM_BOUNDS):
+    """
+    Get usage stats of all objects with a prefix from listings only (no
+    object is read), listing shards in parallel (see list_objects_sharded)
+
+    @param prefix: the prefix (starting under the bucket) of the key name
+    @param bucket: the bucket name (top-level directory in S3)
+    @param workers: the number of shards listing in parallel
+    @param bounds: the upper bounds (in bytes) of size histogram bins
+
+    @return: a dict of 'count', 'bytes', 'min_size', 'max_size', 'oldest'
+             and 'newest' (LastModified), 'oldest_key', 'newest_key',
+             'histogram' (a list of dict with 'min', 'max' (exclusive, or
+             None for the last bin), 'count' and 'bytes'), and
+             'storage_classes' (a dict of class => 'count' and 'bytes')
+
+    example:
+        stats = prefix_stats(PREFIX_MINED + "/", workers=16)
+        print(stats['count'], stats['bytes'])
+    """
+    bounds = sorted(bounds)
+    histogram = [{'min': low, 'max': high, 'count': 0, 'bytes': 0}
+                 for low, high in zip([0] + bounds, bounds + [None])]
+    stats = {
+        'prefix': prefix, 'bucket': bucket, 'count': 0, 'bytes': 0,
+        'min_size': None, 'max_size': None,
+        'oldest': None, 'oldest_key': None,
+        'newest': None, 'newest_key': None,
+        'histogram': histogram, 'storage_classes': {},
+    }
+    for obj in list_objects_sharded(prefix, bucket, workers=workers):
+        size = obj.get('Size', 0)
+        stats['count'] += 1
+        stats['bytes'] += size
+        if stats['min_size'] is None or size < stats['min_size']:
+            stats['min_size'] = size
+        if stats['max_size'] is None or size > stats['max_size']:
+            stats['max_size'] = size
+        modified = obj.get('LastModified')
+        if modified is not None:
+            if stats['oldest'] is None or modified < stats['oldest']:
+                stats['oldest'], stats['oldest_key'] = modified, obj['Key']
+            if stats['newest'] is None or modified > stats['newest']:
+                stats['newest'], stats['newest_key'] = modified, obj['Key']
+        entry = histogram[bisect.bisect_right(bounds, size)]
+        entry['count'] += 1
+        entry['bytes'] += size
+        entry = stats['storage_classes'].setdefault(
+            obj.get('StorageClass', 'STANDARD'), {'count': 0, 'bytes': 0})
+        entry['count'] += 1
+        entry['bytes'] += size
+
+    LOGGER.info("- prefix stats: %s [bucket=%s, count=%s, bytes=%s]",
+                prefix, bucket, stats['count'], stats['bytes'])
+    return stats
+
+
 def process_func(key, **kwargs):
     """
     default function that can be passed to process()
@@ -469,12 +2473,26 @@ def process_json(a_func=process_func, prefix='', **kwargs):
     process(a_func, prefix, '.json', **kwargs)
 
 
-def generate_pages(prefix='', **kwargs):
+def generate_pages(prefix='', prefetch_pages=0, prefetch_bodies=0,
+                   prefetch_bytes=PREFETCH_MAX_BYTES, **kwargs):
     """
     This function creates a paginator and yields one page at a time.
 
     :param prefix: the prefix (starting under the bucket) of the key name
+    :param prefetch_pages: the number of listing pages fetched ahead on a
+                           background thread, or 0 to list on demand
+    :param prefetch_bodies: the number of object contents fetched ahead
+                            in parallel (set as 'Contents' of each object),
+                            or 0 to yield listed objects only; a fetching
+                            error is raised when its object is reached
+    :param prefetch_bytes: the max total size (in bytes) of object contents
+                           fetched ahead
     :return: one page of contents
+
+    example:
+        for obj in generate_pages("pyapi/", prefetch_pages=2,
+                                  prefetch_bodies=16):
+            process_contents(obj['Key'], obj['Contents'])
     """
     bucket = kwargs.get('bucket', BUCKET_DEFAULT)
     check_arg_bucket(bucket)
@@ -484,13 +2502,29 @@ def generate_pages(prefix='', **kwargs):
     parameters = {'Bucket': bucket, 'Prefix': prefix, 'Delimiter': ''}
     p_iterator = paginator.paginate(**parameters)
 
-    for obj in p_iterator.search('Contents'):
-        if obj:
-            key_name = obj.get('Key', '')
-            if key_name.endswith("/"):
-                LOGGER.info("- skipping key: %s", key_name)
-                continue
+    def iter_objects():
+        """Yield all objects except folders"""
+        if prefetch_pages:
+            objects = (obj for page in _iter_pages_prefetched(
+                p_iterator, prefetch_pages) for obj in page.get(
+                    'Contents') or [])
+        else:
+            objects = p_iterator.search('Contents')
+        for obj in objects:
+            if obj:
+                key_name = obj.get('Key', '')
+                if key_name.endswith("/"):
+                    LOGGER.info("- skipping key: %s", key_name)
+                    continue
+                yield obj
+
+    if not prefetch_bodies:
+        for obj in iter_objects():
             yield obj
+        return
+    for obj in _iter_bodies_prefetched(
+            iter_objects(), bucket, prefetch_bodies, prefetch_bytes):
+        yield obj
 
 
 # process calls a_func to process all keys in a bucket
@@ -502,35 +2536,44 @@ def process_keys(a_func=process_func, prefix='', **kwargs):
     @param a_func: the process function to take each iterated key name
                    the function signature is `def func(obj, **kwargs)`
     @param prefix: the prefix (starting under the bucket) of the key name
-    @param kwargs: the additional parameters for a_func
-    @return: N/A
+    @param kwargs: the additional parameters for a_func, except options
+                   for concurrent mode (see PROCESS_OPTIONS)
+    @return: the number of keys processed
 
     example:
         process_keys(process_func, "pyapi/mined-json", bucket="cyber-intel")
+        process_keys(process_func, "pyapi/mined-json", workers=16)
+        process_keys(process_func, "pyapi/mined-json", resume=True,
+                     checkpoint="s3://cyber-intel/jobs/mined.checkpoint")
     """
     bucket = kwargs.get('bucket', BUCKET_DEFAULT)
+    options = _pop_process_options(kwargs)
 
     check_arg_as_func(a_func)
     check_arg_bucket(bucket)
+    checkpoint = _open_checkpoint(options, bucket=bucket, prefix=prefix)
 
     s3_client = get_client()
 
     paginator = s3_client.get_paginator('list_objects')
     parameters = {'Bucket': bucket, 'Prefix': prefix, 'Delimiter': ''}
+    if checkpoint is not None and checkpoint.state['marker']:
+        parameters['Marker'] = checkpoint.state['marker']
     p_iterator = paginator.paginate(**parameters)
-    counts = 0
-
-    for obj in p_iterator.search('Contents'):
-        if obj:
-            key_name = obj.get('Key', '')
-            if key_name.endswith("/"):
-                LOGGER.info("- skipping key: %s", key_name)
-                delete_empty_folder(key_name, bucket)
-                continue
-            a_func(obj, **kwargs)
-            counts += 1
 
-    return counts
+    def iter_objects():
+        """Yield all objects except folders"""
+        for obj in p_iterator.search('Contents'):
+            if obj:
+                key_name = obj.get('Key', '')
+                if key_name.endswith("/"):
+                    LOGGER.info("- skipping key: %s", key_name)
+                    delete_empty_folder(key_name, bucket)
+                    continue
+                yield obj
+
+    return _process_items(
+        a_func, iter_objects(), options, checkpoint=checkpoint, **kwargs)
 
 
 # process calls a_func to process all keys by prefix and suffix in a bucket
@@ -543,11 +2586,13 @@ def process(a_func=process_func, prefix='', suffix='/', **kwargs):
                    the function signature is `def func(key_name, **kwargs)`
     @param prefix: the prefix (starting under the bucket) of the key name
     @param suffix: the suffix (ending) of the key name
-    @param kwargs: the additional parameters for a_func
-    @return: N/A
+    @param kwargs: the additional parameters for a_func, except options
+                   for concurrent mode (see PROCESS_OPTIONS)
+    @return: the number of keys processed
 
     example:
         process(process_func, "pyapi/", ".json", bucket="cyber-intel")
+        process(process_func, "pyapi/", ".json", workers=8, ordered=True)
 
     caution:
         the patterns of prefix and suffix match all keys in the bucket, e.g.
@@ -559,36 +2604,149 @@ def process(a_func=process_func, prefix='', suffix='/', **kwargs):
         since s3 has no hierarchical directory
     """
     bucket = kwargs.get('bucket', BUCKET_DEFAULT)
+    options = _pop_process_options(kwargs)
 
     if not kwargs.get('chck_bypass', False):
         check_arg_as_func(a_func)
         check_arg_bucket(bucket)
+    checkpoint = _open_checkpoint(
+        options, bucket=bucket, prefix=prefix, suffix=suffix)
 
     s3_client = get_client()
 
     paginator = s3_client.get_paginator('list_objects')
     parameters = {'Bucket': bucket, 'Prefix': prefix, 'Delimiter': suffix}
+    if checkpoint is not None and checkpoint.state['marker']:
+        parameters['Marker'] = checkpoint.state['marker']
     iterator = paginator.paginate(**parameters)
-    counts = 0
 
-    # logger.info("-- searching: %s", str(parameters))
-    if suffix:
-        for path in iterator.search('CommonPrefixes'):
-            if path is not None:
-                # logger.debug("-- path: %s", str(path))
-                key = path.get('Prefix', None)
-                if key:
-                    a_func(key, **kwargs)
-                    counts += 1
-    else:
-        for path in iterator.search('Contents'):
+    def iter_keys():
+        """Yield all key names (or common prefixes, if suffix)"""
+        # logger.info("-- searching: %s", str(parameters))
+        search, name = ('CommonPrefixes', 'Prefix') if suffix else (
+            'Contents', 'Key')
+        for path in iterator.search(search):
             if path is not None:
                 # logger.debug("-- path: %s", str(path))
-                key = path.get('Key', None)
+                key = path.get(name, None)
                 if key:
-                    a_func(key, **kwargs)
-                    counts += 1
-    return counts
+                    yield key
+
+    return _process_items(
+        a_func, iter_keys(), options, checkpoint=checkpoint, **kwargs)
+
+
+def reset_clients():
+    """
+    Drop all pooled S3 clients and resources, e.g. after credentials rotated
+    """
+    _CLIENTS.reset()
+
+
+def set_content_cache(cache):
+    """
+    Set (or unset, by None) an on-disk content cache for get_content,
+    get_json_data and S3Storage reads
+
+    @param cache: a pyapi.utils.s3_cache.S3ContentCache instance, or None
+
+    @return: the previous content cache
+    """
+    global _CONTENT_CACHE  # pylint: disable=global-statement
+    previous, _CONTENT_CACHE = _CONTENT_CACHE, cache
+    return previous
+
+
+def set_retry_policy(policy):
+    """
+    Set the retry policy (with its concurrency limiter, if any) of s3
+    requests on throttling and transient errors
+
+    @param policy: a pyapi.utils.s3_retry.RetryPolicy instance, e.g.
+                   RetryPolicy(max_attempts=1) to disable retries
+
+    @return: the previous retry policy
+
+    Note: the policy covers the requests made by functions in this module,
+          on top of botocore retries; paginated listings are retried by
+          botocore only.
+    """
+    global _RETRY  # pylint: disable=global-statement
+    previous, _RETRY = _RETRY, policy
+    return previous
+
+
+def upload(source, key_name, bucket=BUCKET_DEFAULT,
+           part_size=MULTIPART_PART_SIZE, workers=MULTIPART_WORKERS,
+           content_encoding=None, **kwargs):
+    """
+    Upload a source to a s3 key (overwriting any existing key)
+
+    @param source: bytes/string, an iterable (e.g. generator) of bytes or
+                   strings, or a file-like object to read from
+    @param key_name: the key name
+    @param bucket: the bucket name (top-level directory in S3)
+    @param part_size: the size (in bytes, min 5 MiB) of a multipart upload
+                      part; a source no larger than this is uploaded by a
+                      single PUT request
+    @param workers: the number of parts uploading in parallel
+    @param content_encoding: a compression encoding (e.g. 'gzip', 'zstd'
+                             or 'lz4', see pyapi.utils.compression) to
+                             compress the source as a stream, and to set
+                             as the ContentEncoding of the key
+    @param kwargs: additional put_object/create_multipart_upload
+                   parameters, e.g. ContentType, Metadata
+
+    @return: the put_object or complete_multipart_upload response
+    @raise: any client error (the multipart upload is aborted)
+
+    Note: parts are read from the source lazily, so at most 2 x workers
+          parts are held in memory for any size of source.
+    """
+    part_size = max(int(part_size), MULTIPART_PART_SIZE_MIN)
+    if content_encoding:
+        content_encoding = compression.get_encoding(content_encoding)
+        source = compression.iter_compress(
+            _iter_source(source), content_encoding)
+        kwargs['ContentEncoding'] = content_encoding
+    s3_client = get_client()
+    try:
+        if isinstance(source, (bytes, type(u''))):
+            size = len(source.encode('utf-8') if isinstance(
+                source, type(u'')) else source)
+            if size <= part_size:
+                return _call(
+                    s3_client.put_object,
+                    Body=source, Bucket=bucket, Key=key_name, **kwargs)
+
+        parts = _iter_parts(source, part_size)
+        first = next(parts, b'')
+        second = next(parts, None)
+        if second is None:
+            return _call(
+                s3_client.put_object,
+                Body=first, Bucket=bucket, Key=key_name, **kwargs)
+
+        def iter_numbered_parts():
+            """Yield tuple (part number, data) of all parts"""
+            yield (1, first)
+            yield (2, second)
+            for number, data in enumerate(parts, 3):
+                yield (number, data)
+
+        def upload_part(upload_id, part):
+            """Upload one part, and return its ETag"""
+            number, data = part
+            response = _call(
+                s3_client.upload_part, Body=data, Bucket=bucket, Key=key_name,
+                PartNumber=number, UploadId=upload_id)
+            return response['ETag']
+
+        return _run_multipart(
+            s3_client, upload_part, iter_numbered_parts(), key_name, bucket,
+            workers, **kwargs)
+    finally:
+        invalidate_key(key_name, bucket)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,199 @@
+"""
+# s3_cache module includes an on-disk cache of s3 object contents
+
+The cache keeps contents of s3 objects in local files, by bucket and key,
+along with the ETag of each object; a cached object is revalidated by a
+conditional GET (IfNoneMatch on the ETag), so an unchanged object costs
+one request without any body transfer. The cache is bounded by total size
+(in bytes), evicting the least recently used objects.
+
+example:
+    s3.set_content_cache(S3ContentCache('/tmp/s3-cache', 512 * 1024 * 1024))
+    data = s3.get_json_data('reference/blocklist.json')  # cached
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from pyapi.utils import json_codec
+from pyapi.utils.logger import get_logger
+LOGGER = get_logger(__name__, logging.WARN)
+
+# the default max total size (in bytes) of cached contents
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# the file extensions of cached contents and of its metadata (bucket, key
+# and ETag)
+CACHE_DATA_EXT = '.data'
+CACHE_META_EXT = '.meta'
+
+
+class S3ContentCache(object):
+    """
+    class S3ContentCache implements a size-bounded LRU cache of s3 object
+    contents on local disk, validated by ETag
+
+    Note: entries found in the directory (e.g. from a previous process) are
+          loaded in the order of last access (file mtime); an entry is only
+          a hint, since s3.get_content always revalidates it by ETag.
+    """
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        """
+        Initializes a cache in @directory of max total size @max_bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # name => size, in LRU order
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def _get_name(self, bucket, key_name):
+        """
+        Get the file name (without extension) of a cached object
+        """
+        path = u'{}/{}'.format(bucket, key_name).encode('utf-8')
+        return hashlib.sha256(path).hexdigest()
+
+    def _get_path(self, name, ext=CACHE_DATA_EXT):
+        """
+        Get the file path of a cached object
+        """
+        return os.path.join(self.directory, name + ext)
+
+    def _load(self):
+        """
+        Load existing entries in the cache directory, by last access
+        """
+        found = []
+        for filename in os.listdir(self.directory):
+            name, ext = os.path.splitext(filename)
+            meta_path = self._get_path(name, CACHE_META_EXT)
+            if ext != CACHE_DATA_EXT or not os.path.isfile(meta_path):
+                continue
+            stat = os.stat(self._get_path(name))
+            found.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self.size += size
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove least recently used entries until within max bytes
+        (the caller must hold the lock)
+        """
+        while self._entries and self.size > self.max_bytes:
+            name, size = self._entries.popitem(last=False)
+            self.size -= size
+            self._remove_files(name)
+
+    def _remove_files(self, name):
+        """
+        Remove the files of a cached object
+        """
+        for ext in (CACHE_META_EXT, CACHE_DATA_EXT):
+            try:
+                os.remove(self._get_path(name, ext))
+            except OSError:
+                pass
+
+    def _write_file(self, path, contents):
+        """
+        Write a file atomically (by renaming a temporary file)
+        """
+        handle, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                temp_file.write(contents)
+            os.rename(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def clear(self):
+        """
+        Remove all cached objects
+        """
+        with self._lock:
+            for name in self._entries:
+                self._remove_files(name)
+            self._entries.clear()
+            self.size = 0
+
+    def get(self, bucket, key_name):
+        """
+        Get a cached object
+
+        @return: a tuple of (etag, contents), or None if not cached
+        """
+        name = self._get_name(bucket, key_name)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries[name] = self._entries.pop(name)
+        try:
+            with open(self._get_path(name, CACHE_META_EXT), 'rb') as meta_file:
+                meta = json_codec.loads(meta_file.read())
+            with open(self._get_path(name), 'rb') as data_file:
+                contents = data_file.read()
+            os.utime(self._get_path(name), None)
+        except (IOError, OSError, ValueError) as ex:
+            LOGGER.debug("- cache read error: %s [%s]", key_name, ex)
+            self.invalidate(bucket, key_name)
+            return None
+        return meta.get('etag'), contents
+
+    def get_etag(self, bucket, key_name):
+        """
+        Get the ETag of a cached object, or None if not cached
+        """
+        name = self._get_name(bucket, key_name)
+        with self._lock:
+            if name not in self._entries:
+                return None
+        try:
+            with open(self._get_path(name, CACHE_META_EXT), 'rb') as meta_file:
+                return json_codec.loads(meta_file.read()).get('etag')
+        except (IOError, OSError, ValueError):
+            return None
+
+    def invalidate(self, bucket, key_name):
+        """
+        Remove a cached object
+        """
+        name = self._get_name(bucket, key_name)
+        with self._lock:
+            size = self._entries.pop(name, None)
+            if size is not None:
+                self.size -= size
+            self._remove_files(name)
+
+    def put(self, bucket, key_name, etag, contents):
+        """
+        Cache the contents of an object with its ETag
+
+        @return: True if cached; False if larger than max bytes (or no ETag)
+        """
+        if not etag or len(contents) > self.max_bytes:
+            return False
+        name = self._get_name(bucket, key_name)
+        meta = {'bucket': bucket, 'key': key_name, 'etag': etag}
+        with self._lock:
+            size = self._entries.pop(name, None)
+            if size is not None:
+                self.size -= size
+            self._write_file(self._get_path(name), contents)
+            self._write_file(
+                self._get_path(name, CACHE_META_EXT),
+                json_codec.dumps(meta).encode('utf-8'))
+            self._entries[name] = len(contents)
+            self.size += len(contents)
+            self._evict()
+        return True
@@ -0,0 +1,261 @@
+"""
+# s3_index module includes a persistent local (SQLite) index of s3 keys
+
+The index keeps key, size, ETag and LastModified of all keys under a
+prefix in a bucket, so repeated scans (by prefix, suffix or date range)
+are answered locally instead of listing s3 again.
+
+example:
+    with S3KeyIndex('/tmp/mined.db', PREFIX_MINED + '/') as index:
+        index.refresh()  # full listing at first, then incremental
+        index.refresh(full_interval=86400)  # also full listing once a day
+        keys = index.keys(suffix='.json', since='2017-01-16')
+"""
+import datetime
+import logging
+import sqlite3
+import threading
+
+from pyapi.utils import s3
+from pyapi.utils.logger import get_logger
+LOGGER = get_logger(__name__, logging.WARN)
+
+# the number of rows per batch of inserting into the index
+INDEX_BATCH_SIZE = 1000
+
+# the format of time metadata (e.g. 'refreshed'), ISO 8601 in UTC
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+SQL_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS s3_keys ('
+    ' key TEXT PRIMARY KEY, size INTEGER, etag TEXT,'
+    ' last_modified TEXT, generation INTEGER)',
+    'CREATE INDEX IF NOT EXISTS s3_keys_last_modified'
+    ' ON s3_keys (last_modified)',
+    'CREATE TABLE IF NOT EXISTS s3_index_meta ('
+    ' name TEXT PRIMARY KEY, value TEXT)',
+]
+SQL_UPSERT = (
+    'INSERT OR REPLACE INTO s3_keys'
+    ' (key, size, etag, last_modified, generation) VALUES (?, ?, ?, ?, ?)')
+
+
+def _to_utc_text(value):
+    """
+    Convert a datetime (offset-aware, or naive in UTC) to ISO 8601 text in
+    UTC, e.g. '2017-01-16T08:30:00'; or return a string as is
+    """
+    if value is None or not hasattr(value, 'strftime'):
+        return value
+    offset = value.utcoffset() if value.tzinfo else None
+    if offset:
+        value = value - offset
+    return value.replace(tzinfo=None).strftime(TIME_FORMAT)
+
+
+class S3KeyIndex(object):
+    """
+    class S3KeyIndex implements a local on-disk (SQLite) index of s3 keys
+    under a prefix in a bucket, refreshed incrementally
+
+    Note: an incremental refresh lists only keys after the last indexed key
+          (the key watermark, by StartAfter), so it suits append-only keys
+          named in creation order, e.g. date/time partitioned keys; a key
+          created before the watermark (in key order), a rewritten key or
+          a deleted key is only seen by a full refresh, which lists all
+          keys again (see full and full_interval of refresh).
+    """
+    def __init__(self, db_path, prefix='', bucket=s3.BUCKET_DEFAULT):
+        """
+        Initializes (or opens) an index per @db_path for @prefix in @bucket
+        """
+        self.db_path = db_path
+        self.prefix = prefix
+        self.bucket = bucket
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            for sql in SQL_SCHEMA:
+                self._conn.execute(sql)
+        scope = (self.get_meta('bucket'), self.get_meta('prefix'))
+        if scope == (None, None):
+            self.set_meta(bucket=bucket, prefix=prefix)
+        elif scope != (bucket, prefix):
+            raise ValueError(
+                "index {} is for prefix '{}' in bucket '{}'".format(
+                    db_path, scope[1], scope[0]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_where(self, prefix=None, suffix=None, since=None, until=None):
+        """
+        Get a tuple of (SQL where clause, parameters) per filters
+        """
+        clauses, params = [], []
+        if prefix:
+            clauses.append('key >= ? AND substr(key, 1, ?) = ?')
+            params.extend([prefix, len(prefix), prefix])
+        if suffix:
+            clauses.append('substr(key, ?) = ?')
+            params.extend([-len(suffix), suffix])
+        if since is not None:
+            clauses.append('last_modified >= ?')
+            params.append(_to_utc_text(since))
+        if until is not None:
+            clauses.append('last_modified < ?')
+            params.append(_to_utc_text(until))
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        return where, params
+
+    def _is_full_due(self, full_interval):
+        """
+        Check if the last full refresh is older than @full_interval seconds
+        """
+        if not full_interval:
+            return False
+        full_refreshed = self.get_meta('full_refreshed')
+        if not full_refreshed:
+            return True
+        elapsed = datetime.datetime.utcnow() - \
+            datetime.datetime.strptime(full_refreshed, TIME_FORMAT)
+        return elapsed.total_seconds() >= full_interval
+
+    def _upsert(self, objects, generation):
+        """
+        Insert or replace listed objects in batches
+
+        @return: a tuple of (count, max key)
+        """
+        count, last_key = 0, None
+        batch = []
+        for obj in objects:
+            row = (obj['Key'], obj.get('Size'), obj.get('ETag'),
+                   _to_utc_text(obj.get('LastModified')), generation)
+            batch.append(row)
+            last_key = max(last_key or row[0], row[0])
+            if len(batch) >= INDEX_BATCH_SIZE:
+                count += self._write_rows(batch)
+                batch = []
+        if batch:
+            count += self._write_rows(batch)
+        return count, last_key
+
+    def _write_rows(self, rows):
+        """
+        Write a batch of rows in one transaction
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(SQL_UPSERT, rows)
+        return len(rows)
+
+    def close(self):
+        """
+        Close the index database
+        """
+        with self._lock:
+            self._conn.close()
+
+    def count(self, prefix=None, suffix=None, since=None, until=None):
+        """
+        Count indexed keys per filters (see query)
+        """
+        where, params = self._get_where(prefix, suffix, since, until)
+        with self._lock:
+            cursor = self._conn.execute(
+                'SELECT COUNT(*) FROM s3_keys' + where, params)
+            return cursor.fetchone()[0]
+
+    def get_meta(self, name, default=None):
+        """
+        Get a metadata value (e.g. 'last_key', 'refreshed') by name
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value FROM s3_index_meta WHERE name = ?',
+                (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def keys(self, prefix=None, suffix=None, since=None, until=None):
+        """
+        Get a list of indexed key names per filters (see query)
+        """
+        return [obj['Key'] for obj in self.query(prefix, suffix, since, until)]
+
+    def query(self, prefix=None, suffix=None, since=None, until=None):
+        """
+        Query indexed keys in key order
+
+        @param prefix: the prefix of key name
+        @param suffix: the suffix (ending) of key name
+        @param since: the min LastModified (inclusive), a datetime or text
+        @param until: the max LastModified (exclusive), a datetime or text
+
+        @return: a list of dict with 'Key', 'Size', 'ETag' and
+                 'LastModified' (ISO 8601 text in UTC)
+        """
+        where, params = self._get_where(prefix, suffix, since, until)
+        sql = 'SELECT key, size, etag, last_modified FROM s3_keys{} ' \
+              'ORDER BY key'.format(where)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [{'Key': row[0], 'Size': row[1], 'ETag': row[2],
+                 'LastModified': row[3]} for row in rows]
+
+    def refresh(self, full=False, workers=s3.LIST_WORKERS, full_interval=0):
+        """
+        Refresh the index from s3 listing
+
+        @param full: True to list all keys (and remove keys not found);
+                     otherwise, only list keys after the last indexed key
+                     (a full listing if the index is empty)
+        @param workers: the number of shards listing in parallel (full)
+        @param full_interval: the max age (in seconds) of the last full
+                              refresh, to list all keys again, or 0 for
+                              no limit
+
+        @return: the number of keys listed
+        """
+        last_key = self.get_meta('last_key')
+        generation = int(self.get_meta('generation', 0)) + 1
+        full = full or not last_key or self._is_full_due(full_interval)
+        if full:
+            objects = s3.list_objects_sharded(
+                self.prefix, self.bucket, workers=workers)
+        else:
+            paginator = s3.get_client().get_paginator('list_objects_v2')
+            p_iterator = paginator.paginate(
+                Bucket=self.bucket, Prefix=self.prefix, StartAfter=last_key)
+            objects = (obj for obj in p_iterator.search('Contents') if obj)
+
+        count, max_key = self._upsert(objects, generation)
+        refreshed = _to_utc_text(datetime.datetime.utcnow())
+        if full:
+            with self._lock, self._conn:
+                removed = self._conn.execute(
+                    'DELETE FROM s3_keys WHERE generation < ?',
+                    (generation,)).rowcount
+            LOGGER.info("- removed %s key(s) from index", removed)
+            self.set_meta(full_refreshed=refreshed)
+        else:
+            max_key = max(max_key or last_key, last_key)
+
+        self.set_meta(
+            generation=generation, last_key=max_key, refreshed=refreshed)
+        LOGGER.info("- indexed %s key(s) [bucket=%s, prefix=%s]",
+                    count, self.bucket, self.prefix)
+        return count
+
+    def set_meta(self, **kwargs):
+        """
+        Set metadata values by names
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO s3_index_meta (name, value) '
+                'VALUES (?, ?)',
+                [(k, None if v is None else str(v))
+                 for k, v in kwargs.items()])
@@ -0,0 +1,429 @@
+"""
+# s3_metrics module includes instrumentation of s3 requests
+
+The instrumentation is fed by botocore event hooks on every S3 client (and
+resource) of pyapi.utils.s3, recording per-call latency, bytes in (by the
+response Content-Length) and out (by the request body), HTTP status and
+errors, and retries (by botocore and by the s3 retry policy), grouped by
+operation category (see OPERATION_CATEGORIES), into a pluggable sink:
+
+  * MemorySink, aggregating counters and latency histograms in memory
+  * LogSink, logging the aggregated metrics per interval (as one line per
+    category)
+  * StatsdSink, sending StatsD metrics (by UDP) per call
+
+Note: the instrumentation is disabled (the default) with no sink, where
+      each hook returns at once, so the overhead is near zero.
+
+example:
+    sink = MemorySink()
+    s3_metrics.set_sink(sink)
+    s3.get_content('pyapi/mined-json/part-0')
+    print(sink.snapshot()['GET']['latency_ms']['p50'])
+"""
+import bisect
+import logging
+import socket
+import threading
+import time
+
+from pyapi.utils.logger import get_logger
+LOGGER = get_logger(__name__, logging.WARN)
+
+# the operation categories of S3 API operations; others are 'OTHER'
+OPERATION_CATEGORIES = {
+    'GetObject': 'GET',
+    'PutObject': 'PUT', 'CreateMultipartUpload': 'PUT', 'UploadPart': 'PUT',
+    'CompleteMultipartUpload': 'PUT', 'AbortMultipartUpload': 'PUT',
+    'ListObjects': 'LIST', 'ListObjectsV2': 'LIST', 'ListBuckets': 'LIST',
+    'ListMultipartUploads': 'LIST', 'ListParts': 'LIST',
+    'HeadObject': 'HEAD', 'HeadBucket': 'HEAD',
+    'CopyObject': 'COPY', 'UploadPartCopy': 'COPY',
+    'DeleteObject': 'DELETE', 'DeleteObjects': 'DELETE',
+}
+
+# the upper bounds (in milliseconds, inclusive) of latency histogram bins,
+# where the last bin counts any longer calls
+LATENCY_BOUNDS_MS = (
+    1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# the default interval (in seconds) of LogSink logging
+LOG_INTERVAL = 60
+
+# the default StatsD address and metric prefix
+STATSD_HOST = '127.0.0.1'
+STATSD_PORT = 8125
+STATSD_PREFIX = 'pyapi.s3'
+
+# the key of (start time, bytes out, category) in a botocore request context
+_CONTEXT_KEY = 'pyapi_metrics_started'
+
+# the sink in use, or None as disabled, see set_sink()
+_SINK = None
+
+
+class MemorySink(object):
+    """
+    class MemorySink implements a sink aggregating metrics per operation
+    category in memory, with latency histograms (see LATENCY_BOUNDS_MS)
+    """
+    def __init__(self, bounds=LATENCY_BOUNDS_MS):
+        """
+        Initializes a sink of latency histogram @bounds (in milliseconds)
+        """
+        self.bounds = tuple(bounds)
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def _get_category(self, category):
+        """
+        Get the metrics of a category (the caller must hold the lock)
+        """
+        data = self._data.get(category)
+        if data is None:
+            data = self._data[category] = {
+                'requests': 0, 'errors': 0, 'retries': 0,
+                'bytes_in': 0, 'bytes_out': 0, 'status': {},
+                'latency_sum': 0.0, 'latency_min': None, 'latency_max': 0.0,
+                'histogram': [0] * (len(self.bounds) + 1),
+            }
+        return data
+
+    def _get_percentile(self, histogram, count, percent):
+        """
+        Get the upper bound of the histogram bin at a percentile, or None
+        for the last (unbounded) bin
+        """
+        rank = count * percent / 100.0
+        total = 0
+        for index, counts in enumerate(histogram):
+            total += counts
+            if total >= rank and counts:
+                return self.bounds[index] if index < len(self.bounds) else None
+        return None
+
+    def record(self, category, latency, bytes_in=0, bytes_out=0, status=None,
+               error=False):
+        """
+        Record a call of @latency (in seconds)
+
+        @param status: the HTTP status code, or None on connection errors
+        @param error: True if the call failed (including status >= 400)
+        """
+        latency_ms = latency * 1000.0
+        with self._lock:
+            data = self._get_category(category)
+            data['requests'] += 1
+            data['bytes_in'] += bytes_in
+            data['bytes_out'] += bytes_out
+            if error:
+                data['errors'] += 1
+            status = str(status or 'error')
+            data['status'][status] = data['status'].get(status, 0) + 1
+            data['latency_sum'] += latency_ms
+            data['latency_max'] = max(data['latency_max'], latency_ms)
+            if data['latency_min'] is None or latency_ms < data['latency_min']:
+                data['latency_min'] = latency_ms
+            data['histogram'][bisect.bisect_left(self.bounds, latency_ms)] += 1
+
+    def record_retry(self, category):
+        """
+        Record a retry of a call
+        """
+        with self._lock:
+            self._get_category(category)['retries'] += 1
+
+    def reset(self):
+        """
+        Reset all metrics
+        """
+        with self._lock:
+            self._data = {}
+
+    def snapshot(self, reset=False):
+        """
+        Get a dict of operation category => metrics: 'requests', 'errors',
+        'retries', 'bytes_in', 'bytes_out', 'status' (counts per HTTP
+        status), and 'latency_ms' ('avg', 'min', 'max', 'p50', 'p90',
+        'p99', and 'histogram': a list of {'le': bound, 'count': n},
+        where the last bound is None)
+
+        @param reset: True to reset all metrics after the snapshot
+        """
+        with self._lock:
+            data = dict(
+                (category, dict(metrics, status=dict(metrics['status']),
+                                histogram=list(metrics['histogram'])))
+                for category, metrics in self._data.items())
+            if reset:
+                self._data = {}
+        categories = {}
+        for category, metrics in data.items():
+            histogram = metrics['histogram']
+            count = metrics['requests']
+            latency = {
+                'avg': round(metrics['latency_sum'] / count, 3)
+                       if count else 0.0,
+                'min': round(metrics['latency_min'] or 0.0, 3),
+                'max': round(metrics['latency_max'], 3),
+                'histogram': [
+                    {'le': self.bounds[i] if i < len(self.bounds) else None,
+                     'count': n} for i, n in enumerate(histogram)],
+            }
+            for percent in (50, 90, 99):
+                latency['p{}'.format(percent)] = self._get_percentile(
+                    histogram, count, percent)
+            categories[category] = dict(
+                (name, metrics[name]) for name in (
+                    'requests', 'errors', 'retries', 'bytes_in', 'bytes_out'))
+            categories[category]['status'] = metrics['status']
+            categories[category]['latency_ms'] = latency
+        return categories
+
+
+class LogSink(MemorySink):
+    """
+    class LogSink implements a sink logging the aggregated metrics (one
+    line per operation category) per interval, and on flush()
+    """
+    def __init__(self, interval=LOG_INTERVAL, logger=LOGGER,
+                 level=logging.INFO, bounds=LATENCY_BOUNDS_MS):
+        """
+        Initializes a sink logging to @logger at @level per @interval
+        (in seconds)
+        """
+        super(LogSink, self).__init__(bounds)
+        self.interval = interval
+        self.logger = logger
+        self.level = level
+        self._flushed = time.time()
+
+    def _check_interval(self):
+        """
+        Flush if the interval elapsed
+        """
+        if time.time() - self._flushed >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Log the aggregated metrics, and reset them
+        """
+        self._flushed = time.time()
+        for category, metrics in sorted(self.snapshot(reset=True).items()):
+            latency = metrics['latency_ms']
+            self.logger.log(
+                self.level,
+                "s3 %s: requests=%s errors=%s retries=%s bytes_in=%s "
+                "bytes_out=%s latency_ms(avg=%s p50=%s p90=%s p99=%s max=%s)",
+                category, metrics['requests'], metrics['errors'],
+                metrics['retries'], metrics['bytes_in'],
+                metrics['bytes_out'], latency['avg'], latency['p50'],
+                latency['p90'], latency['p99'], latency['max'])
+
+    def record(self, category, latency, bytes_in=0, bytes_out=0, status=None,
+               error=False):
+        """
+        Record a call (see MemorySink.record), logging per interval
+        """
+        super(LogSink, self).record(
+            category, latency, bytes_in, bytes_out, status, error)
+        self._check_interval()
+
+    def record_retry(self, category):
+        """
+        Record a retry of a call, logging per interval
+        """
+        super(LogSink, self).record_retry(category)
+        self._check_interval()
+
+
+class StatsdSink(object):
+    """
+    class StatsdSink implements a sink sending StatsD metrics by UDP per
+    call: '<prefix>.<category>.latency' (timer, in ms), '.requests',
+    '.errors', '.retries', '.bytes_in' and '.bytes_out' (counters)
+
+    Note: sending is best effort; a socket error is logged (at debug level)
+          and ignored, so it never fails a s3 call.
+    """
+    def __init__(self, host=STATSD_HOST, port=STATSD_PORT,
+                 prefix=STATSD_PREFIX):
+        """
+        Initializes a sink sending to a StatsD server at @host:@port
+        """
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send(self, lines):
+        """
+        Send metric lines in one packet
+        """
+        try:
+            self._socket.sendto('\n'.join(lines).encode('utf-8'), self.address)
+        except (IOError, OSError, socket.error) as ex:
+            LOGGER.debug("- failed to send metrics: %s", ex)
+
+    def close(self):
+        """
+        Close the socket
+        """
+        self._socket.close()
+
+    def record(self, category, latency, bytes_in=0, bytes_out=0, status=None,
+               error=False):
+        """
+        Send the metrics of a call (see MemorySink.record)
+        """
+        name = '{}.{}'.format(self.prefix, category.lower())
+        lines = [
+            '{}.latency:{:.3f}|ms'.format(name, latency * 1000.0),
+            '{}.requests:1|c'.format(name)]
+        if bytes_in:
+            lines.append('{}.bytes_in:{}|c'.format(name, bytes_in))
+        if bytes_out:
+            lines.append('{}.bytes_out:{}|c'.format(name, bytes_out))
+        if error:
+            lines.append('{}.errors:1|c'.format(name))
+        self._send(lines)
+
+    def record_retry(self, category):
+        """
+        Send a retry of a call
+        """
+        self._send(['{}.{}.retries:1|c'.format(self.prefix, category.lower())])
+
+
+def _get_body_size(body):
+    """
+    Get the size of a request body (bytes, a string, or the remains of a
+    seekable file-like object), or 0 if unknown
+    """
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    if isinstance(body, type(u'')):
+        return len(body.encode('utf-8'))
+    try:
+        position = body.tell()
+        body.seek(0, 2)
+        size = body.tell() - position
+        body.seek(position)
+        return size
+    except (AttributeError, IOError, OSError, ValueError):
+        return 0
+
+
+def _get_category(model):
+    """
+    Get the operation category of a botocore operation model
+    """
+    return OPERATION_CATEGORIES.get(getattr(model, 'name', None), 'OTHER')
+
+
+def _on_after_call(http_response=None, parsed=None, context=None, **kwargs):
+    """
+    Record a call on its response (botocore 'after-call' event)
+    """
+    sink = _SINK
+    if sink is None or context is None or _CONTEXT_KEY not in context:
+        return
+    started, bytes_out, category = context.pop(_CONTEXT_KEY)
+    status = getattr(http_response, 'status_code', None)
+    headers = getattr(http_response, 'headers', None) or {}
+    try:
+        bytes_in = int(headers.get('content-length') or 0)
+    except ValueError:
+        bytes_in = 0
+    retries = ((parsed or {}).get('ResponseMetadata') or {}).get(
+        'RetryAttempts') or 0
+    for _ in range(retries):
+        sink.record_retry(category)
+    sink.record(category, time.time() - started, bytes_in, bytes_out, status,
+                error=status is None or status >= 400)
+
+
+def _on_after_call_error(exception=None, context=None, **kwargs):
+    """
+    Record a call failed without response, e.g. on connection errors
+    (botocore 'after-call-error' event)
+    """
+    sink = _SINK
+    if sink is None or context is None or _CONTEXT_KEY not in context:
+        return
+    started, bytes_out, category = context.pop(_CONTEXT_KEY)
+    sink.record(category, time.time() - started, 0, bytes_out, None,
+                error=True)
+
+
+def _on_before_call(model=None, params=None, context=None, **kwargs):
+    """
+    Start timing a call (botocore 'before-call' event)
+    """
+    if _SINK is None or context is None:
+        return
+    bytes_out = _get_body_size((params or {}).get('body'))
+    context[_CONTEXT_KEY] = (time.time(), bytes_out, _get_category(model))
+
+
+def count_retries(a_func, operation=None):
+    """
+    Wrap a request function (e.g. a client method) to record each call
+    after the first one as a retry, e.g. by a retry policy
+
+    @param operation: the operation name (default: by the method name,
+                      e.g. 'get_object' as 'GetObject')
+    """
+    if operation is None:
+        operation = ''.join(
+            part.capitalize() for part in getattr(
+                a_func, '__name__', '').split('_'))
+    category = OPERATION_CATEGORIES.get(operation, 'OTHER')
+    calls = [0]
+
+    def call(*args, **kwargs):
+        """Call a_func, recording a retry"""
+        calls[0] += 1
+        sink = _SINK
+        if calls[0] > 1 and sink is not None:
+            sink.record_retry(category)
+        return a_func(*args, **kwargs)
+    return call
+
+
+def get_sink():
+    """
+    Get the sink in use, or None if disabled
+    """
+    return _SINK
+
+
+def is_enabled():
+    """
+    Check if the instrumentation is enabled (by a sink)
+    """
+    return _SINK is not None
+
+
+def register(client):
+    """
+    Register the event hooks on a boto3 client (or a resource's client)
+    """
+    events = client.meta.events
+    events.register('before-call.s3', _on_before_call)
+    events.register('after-call.s3', _on_after_call)
+    events.register('after-call-error.s3', _on_after_call_error)
+
+
+def set_sink(sink):
+    """
+    Set (or unset, by None to disable) the sink of s3 metrics
+
+    @param sink: a MemorySink, LogSink or StatsdSink instance, or any
+                 object with record() and record_retry() methods
+
+    @return: the previous sink
+    """
+    global _SINK  # pylint: disable=global-statement
+    previous, _SINK = _SINK, sink
+    return previous
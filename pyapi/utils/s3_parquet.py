@@ -0,0 +1,328 @@
+"""
+# s3_parquet module includes a columnar Parquet reader for s3 objects
+
+The reader fetches only the bytes it needs by ranged GETs: the footer
+(file metadata), and the column chunks of projected columns in the row
+groups whose statistics (min/max) may match the filters.
+
+Note: this module requires the `pyarrow` package; for line-delimited JSON
+      ("parquet" JSON) contents, see s3.iter_json_lines.
+
+example:
+    for record in iter_records('warehouse/events.parquet',
+                               columns=['id', 'domain'],
+                               filters=[('day', '>=', '2017-01-16')]):
+        process_record(record)
+"""
+import logging
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # optional
+    pyarrow, pq = None, None
+
+from pyapi.utils import s3
+from pyapi.utils.logger import get_logger
+LOGGER = get_logger(__name__, logging.WARN)
+
+# the min size (in bytes) of each ranged GET, to read ahead small reads,
+# e.g. the footer length and the footer
+READ_BLOCK_SIZE = 64 * 1024
+
+# the filter operators, e.g. ('day', '>=', '2017-01-16')
+FILTER_OPS = ('==', '!=', '<', '<=', '>', '>=', 'in')
+
+# the pyarrow.compute functions per filter operator
+FILTER_COMPUTE = {
+    '==': 'equal', '!=': 'not_equal', '<': 'less', '<=': 'less_equal',
+    '>': 'greater', '>=': 'greater_equal',
+}
+
+
+class S3RangeFile(object):
+    """
+    class S3RangeFile implements a read-only, seekable file-like object
+    over a s3 object, reading by ranged GETs (IfMatch on the ETag, so a
+    changed object fails the read rather than mixing two versions)
+    """
+    def __init__(self, key_name, bucket=s3.BUCKET_DEFAULT, size=None,
+                 etag=None, block_size=READ_BLOCK_SIZE):
+        """
+        Initializes a file of s3 @key_name in @bucket; the @size and @etag
+        are got by a HEAD request if size is None
+        """
+        if size is None:
+            meta = s3.head_key(key_name, bucket, use_cache=False)
+            if meta is None:
+                raise IOError("key not found: {} [bucket={}]".format(
+                    key_name, bucket))
+            size, etag = meta['ContentLength'], meta.get('ETag')
+        self.key_name = key_name
+        self.bucket = bucket
+        self.size = size
+        self.etag = etag
+        self.block_size = block_size
+        self.closed = False
+        self.bytes_read = 0  # the number of bytes transferred
+        self.requests = 0  # the number of ranged GETs
+        self._pos = 0
+        self._buffer = (0, b'')  # (offset, data) of the last range
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_range(self, start, end):
+        """
+        Get the bytes in [start, end) of the object
+        """
+        params = {
+            'Bucket': self.bucket, 'Key': self.key_name,
+            'Range': 'bytes={}-{}'.format(start, end - 1)}
+        if self.etag:
+            params['IfMatch'] = self.etag
+        LOGGER.debug("- getting range: %s [%s]", self.key_name, params['Range'])
+        response = s3.call_with_retry(s3.get_client().get_object, **params)
+        data = response['Body'].read()
+        if len(data) != end - start:
+            raise IOError("short read of {}: {} of {} bytes".format(
+                self.key_name, len(data), end - start))
+        self.requests += 1
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        """
+        Close the file
+        """
+        self.closed = True
+        self._buffer = (0, b'')
+
+    def read(self, size=-1):
+        """
+        Read up to @size bytes (to the end, if size < 0) from the position
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        end = self.size if size is None or size < 0 else \
+            min(self.size, self._pos + size)
+        if end <= self._pos:
+            return b''
+        offset, data = self._buffer
+        if not (offset <= self._pos and end <= offset + len(data)):
+            fetch_end = max(end, min(self.size, self._pos + self.block_size))
+            offset, data = self._pos, self._get_range(self._pos, fetch_end)
+            self._buffer = (offset, data)
+        result = data[self._pos - offset:end - offset]
+        self._pos = end
+        return result
+
+    def readable(self):
+        """The file is readable"""
+        return True
+
+    def seek(self, offset, whence=0):
+        """
+        Set the position (whence: 0 - from start, 1 - current, 2 - end)
+        """
+        base = {0: 0, 1: self._pos, 2: self.size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def seekable(self):
+        """The file is seekable"""
+        return True
+
+    def tell(self):
+        """
+        Get the position
+        """
+        return self._pos
+
+    def writable(self):
+        """The file is read-only"""
+        return False
+
+
+def _check_filters(filters):
+    """
+    Check filters, a list of (column, operator, value) tuples
+    """
+    for column, op, value in filters or []:
+        if op not in FILTER_OPS:
+            raise ValueError("unknown filter operator '{}' on '{}'".format(
+                op, column))
+        if op == 'in' and not isinstance(value, (list, set, tuple)):
+            raise ValueError("filter 'in' on '{}' needs a list".format(
+                column))
+
+
+def _check_pyarrow():
+    """
+    Check if the pyarrow package is installed
+    """
+    if pq is None:
+        raise ImportError("s3_parquet requires package 'pyarrow'")
+
+
+def _filter_batch(batch, filters):
+    """
+    Filter rows of a pyarrow.RecordBatch per filters (by pyarrow.compute)
+    """
+    import pyarrow.compute as pc
+    mask = None
+    names = batch.schema.names
+    for column, op, value in filters:
+        array = batch.column(names.index(column))
+        if op == 'in':
+            match = pc.is_in(array, value_set=pyarrow.array(list(value)))
+        else:
+            match = getattr(pc, FILTER_COMPUTE[op])(array, value)
+        match = pc.fill_null(match, False)
+        mask = match if mask is None else pc.and_(mask, match)
+    return batch if mask is None else batch.filter(mask)
+
+
+def _get_row_group_stats(row_group):
+    """
+    Get a dict of column name => (min, max) from row group metadata, for
+    top-level columns with min/max statistics
+    """
+    stats = {}
+    for index in range(row_group.num_columns):
+        column = row_group.column(index)
+        statistics = column.statistics
+        if statistics is not None and statistics.has_min_max:
+            stats[column.path_in_schema] = (statistics.min, statistics.max)
+    return stats
+
+
+def _match_stats(stats, filters):
+    """
+    Check if a row group (per its column min/max stats) may have rows
+    matching all filters; a column without stats always may match
+    """
+    for column, op, value in filters or []:
+        if column not in stats:
+            continue
+        low, high = stats[column]
+        try:
+            if op == '==':
+                match = low <= value <= high
+            elif op == '!=':
+                match = not low == high == value
+            elif op == '<':
+                match = low < value
+            elif op == '<=':
+                match = low <= value
+            elif op == '>':
+                match = high > value
+            elif op == '>=':
+                match = high >= value
+            else:  # in
+                match = any(low <= item <= high for item in value)
+        except TypeError:  # not comparable, e.g. text vs. bytes
+            match = True
+        if not match:
+            return False
+    return True
+
+
+def get_row_groups(parquet_file, filters=None):
+    """
+    Get a list of row group indexes which may match filters, per the
+    min/max statistics in the file metadata (footer)
+
+    @param parquet_file: a pyarrow.parquet.ParquetFile
+    @param filters: a list of (column, operator, value) tuples
+    """
+    _check_filters(filters)
+    metadata = parquet_file.metadata
+    groups = []
+    for index in range(metadata.num_row_groups):
+        stats = _get_row_group_stats(metadata.row_group(index))
+        if _match_stats(stats, filters):
+            groups.append(index)
+    LOGGER.debug("- row groups: %s of %s", len(groups), metadata.num_row_groups)
+    return groups
+
+
+def iter_batches(key_name, bucket=s3.BUCKET_DEFAULT, columns=None,
+                 filters=None, batch_size=65536, block_size=READ_BLOCK_SIZE):
+    """
+    Yield record batches from a Parquet s3 file, reading only the footer
+    and the projected column chunks of matching row groups
+
+    @param key_name: the key name
+    @param bucket: the bucket name (top-level directory in S3)
+    @param columns: a list of column names to read, or None for all
+    @param filters: a list of (column, operator, value) tuples, all to
+                    match, where operator is one of FILTER_OPS; row groups
+                    are skipped by statistics, and rows are filtered
+    @param batch_size: the max number of rows per batch
+    @param block_size: the min size (in bytes) of each ranged GET
+
+    @return: a generator of pyarrow.RecordBatch (see its to_pandas,
+             to_pydict, or column(i).to_numpy for NumPy arrays)
+    @raise: ImportError if pyarrow is not installed
+
+    example:
+        for batch in iter_batches('warehouse/events.parquet', ['id']):
+            ids = batch.column(0).to_numpy()
+    """
+    _check_pyarrow()
+    _check_filters(filters)
+    read_columns = columns
+    if columns is not None and filters:
+        read_columns = list(columns) + [
+            f[0] for f in filters if f[0] not in columns]
+    with S3RangeFile(key_name, bucket, block_size=block_size) as s3_file:
+        parquet_file = pq.ParquetFile(s3_file)
+        for index in get_row_groups(parquet_file, filters):
+            table = parquet_file.read_row_group(index, columns=read_columns)
+            for batch in table.to_batches(batch_size):
+                if filters:
+                    batch = _filter_batch(batch, filters)
+                if read_columns != columns:
+                    names = batch.schema.names
+                    batch = pyarrow.RecordBatch.from_arrays(
+                        [batch.column(names.index(c)) for c in columns],
+                        columns)
+                if batch.num_rows:
+                    yield batch
+        LOGGER.info("- read %s bytes in %s requests of %s bytes: %s",
+                    s3_file.bytes_read, s3_file.requests, s3_file.size,
+                    key_name)
+
+
+def iter_records(key_name, bucket=s3.BUCKET_DEFAULT, columns=None,
+                 filters=None, batch_size=65536):
+    """
+    Yield records (dict of column name => value) from a Parquet s3 file
+    (see iter_batches for arguments)
+    """
+    for batch in iter_batches(key_name, bucket, columns, filters, batch_size):
+        data = batch.to_pydict()
+        names = batch.schema.names
+        for row in range(batch.num_rows):
+            yield dict((name, data[name][row]) for name in names)
+
+
+def read_table(key_name, bucket=s3.BUCKET_DEFAULT, columns=None,
+               filters=None):
+    """
+    Read a Parquet s3 file into a pyarrow.Table (see iter_batches for
+    arguments); an empty table if no row matches
+    """
+    _check_pyarrow()
+    batches = list(iter_batches(key_name, bucket, columns, filters))
+    if batches:
+        return pyarrow.Table.from_batches(batches)
+    with S3RangeFile(key_name, bucket) as s3_file:
+        schema = pq.ParquetFile(s3_file).schema_arrow
+    if columns is not None:
+        schema = pyarrow.schema([schema.field(c) for c in columns])
+    return schema.empty_table()
@@ -0,0 +1,391 @@
+"""
+# s3_pipeline module includes a multi-stage pipeline for s3 processing
+
+A pipeline runs items (e.g. listed key names) through stages, e.g. fetch
+-> parse -> transform -> write, where each stage has its own worker pool
+(threads) and a bounded queue in front of it; so network I/O (fetch and
+write) and CPU work (parse and transform) overlap, and a slow stage blocks
+its upstream stages (backpressure) rather than piling up items in memory.
+
+Each stage function takes an item and returns the item for the next
+stage, or None to drop it; an error fails the item only (counted in the
+stage metrics). A pipeline stops gracefully by stop(), which stops taking
+source items and drains the items in flight through all stages.
+
+example:
+    def transform(key_name, data):
+        return key_name.replace('raw/', 'clean/'), clean_json(data)
+
+    metrics = run_pipeline(transform, 'raw/', suffix='.json')
+"""
+import logging
+import threading
+import time
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+from pyapi.utils import json_codec
+from pyapi.utils import s3
+from pyapi.utils.logger import get_logger
+LOGGER = get_logger(__name__, logging.WARN)
+
+# the default number of workers per stage
+FETCH_WORKERS = 16
+PARSE_WORKERS = 2
+TRANSFORM_WORKERS = 2
+WRITE_WORKERS = 8
+
+# the max number of items queued per worker in front of a stage
+STAGE_QUEUE_ITEMS = 2
+
+# the max number of failed items kept (with errors) in pipeline metrics
+PIPELINE_MAX_ERRORS = 100
+
+# the end-of-items marker passed down through stage queues
+_END = object()
+
+
+class Stage(object):
+    """
+    class Stage implements a pipeline stage: a function run by a pool of
+    workers on items from a bounded queue
+    """
+    def __init__(self, name, a_func, workers=1, queue_size=0, fan_out=False):
+        """
+        Initializes a stage of @a_func (taking one item, returning the
+        item for the next stage or None), run by @workers threads
+
+        @param queue_size: the max number of items queued in front of the
+                           stage (default: STAGE_QUEUE_ITEMS x workers)
+        @param fan_out: True if a_func returns an iterable of items (each
+                        one for the next stage), e.g. records of a file
+        """
+        s3.check_arg_as_func(a_func)
+        self.name = name
+        self.a_func = a_func
+        self.workers = max(int(workers), 1)
+        self.fan_out = fan_out
+        self.queue = queue.Queue(
+            maxsize=queue_size or STAGE_QUEUE_ITEMS * self.workers)
+        self.processed = 0  # the number of items taken
+        self.emitted = 0  # the number of items passed to the next stage
+        self.dropped = 0  # the number of items returning None
+        self.errors = 0  # the number of items failed
+        self.busy_seconds = 0.0  # the time spent in a_func, all workers
+        self.blocked_seconds = 0.0  # the time blocked by the next stage
+        self.max_queued = 0  # the max number of items in queue
+        self._running = self.workers
+        self._lock = threading.Lock()
+
+    def get_metrics(self):
+        """
+        Get a dict of the stage metrics
+        """
+        with self._lock:
+            return {
+                'workers': self.workers, 'queued': self.queue.qsize(),
+                'max_queued': self.max_queued, 'processed': self.processed,
+                'emitted': self.emitted, 'dropped': self.dropped,
+                'errors': self.errors,
+                'busy_seconds': round(self.busy_seconds, 3),
+                'blocked_seconds': round(self.blocked_seconds, 3),
+            }
+
+
+class Pipeline(object):
+    """
+    class Pipeline implements a chain of stages connected by bounded
+    queues, running source items through all stages
+
+    example:
+        pipeline = Pipeline([
+            fetch_stage(bucket), parse_stage(),
+            Stage('transform', my_transform, workers=4),
+            write_stage(dst_bucket)])
+        metrics = pipeline.run(s3.get_keys(prefix, suffix=''))
+    """
+    def __init__(self, stages, max_errors=PIPELINE_MAX_ERRORS):
+        """
+        Initializes a pipeline of @stages (a list of Stage), keeping up to
+        @max_errors failed items in metrics
+        """
+        if not stages:
+            raise ValueError("param 'stages' must not be empty")
+        self.stages = list(stages)
+        self.max_errors = max_errors
+        self.source_items = 0  # the number of items taken from source
+        self.failed = []  # dicts of 'Stage', 'Item' and 'Message'
+        self.elapsed = 0.0
+        self._draining = threading.Event()
+        self._aborted = threading.Event()
+        self._lock = threading.Lock()
+
+    def _feed(self, items):
+        """
+        Put source items into the first stage until drained, then ends it
+        """
+        stage = self.stages[0]
+        try:
+            for item in items:
+                if self._draining.is_set():
+                    break
+                self._put(None, stage, item)
+                self.source_items += 1
+        except Exception as ex:
+            LOGGER.error("- pipeline source failed: %s", ex)
+            self._record_error('source', None, ex)
+        for _ in range(stage.workers):
+            stage.queue.put(_END)
+
+    def _put(self, stage, next_stage, item):
+        """
+        Put an item into the queue of next_stage, timing the block
+        """
+        if stage is None:
+            next_stage.queue.put(item)
+        else:
+            started = time.time()
+            next_stage.queue.put(item)
+            blocked = time.time() - started
+            with stage._lock:
+                stage.blocked_seconds += blocked
+                stage.emitted += 1
+        queued = next_stage.queue.qsize()
+        if queued > next_stage.max_queued:
+            next_stage.max_queued = queued
+
+    def _record_error(self, name, item, error):
+        """
+        Record a failed item
+        """
+        with self._lock:
+            if len(self.failed) < self.max_errors:
+                self.failed.append({
+                    'Stage': name, 'Item': repr(item)[:200],
+                    'Message': str(error)})
+
+    def _work(self, index):
+        """
+        Run a worker of the stage at index, until its end marker
+        """
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] \
+            if index + 1 < len(self.stages) else None
+        while True:
+            item = stage.queue.get()
+            if item is _END:
+                break
+            if self._aborted.is_set():
+                continue  # discard, but keep upstream unblocked
+            started = time.time()
+            try:
+                result = stage.a_func(item)
+                if stage.fan_out and result is not None:
+                    result = list(result)
+            except Exception as ex:
+                LOGGER.debug("- stage %s failed: %s", stage.name, ex)
+                with stage._lock:
+                    stage.processed += 1
+                    stage.errors += 1
+                    stage.busy_seconds += time.time() - started
+                self._record_error(stage.name, item, ex)
+                continue
+            with stage._lock:
+                stage.processed += 1
+                stage.busy_seconds += time.time() - started
+                if result is None:
+                    stage.dropped += 1
+            if result is None:
+                continue
+            results = result if stage.fan_out else [result]
+            for output in results:
+                if next_stage is None:
+                    with stage._lock:
+                        stage.emitted += 1
+                else:
+                    self._put(stage, next_stage, output)
+        with stage._lock:
+            stage._running -= 1
+            last = stage._running == 0
+        if last and next_stage is not None:
+            for _ in range(next_stage.workers):
+                next_stage.queue.put(_END)
+
+    def abort(self):
+        """
+        Stop taking source items, and discard the items in flight
+        """
+        self._aborted.set()
+        self._draining.set()
+
+    def get_metrics(self):
+        """
+        Get a dict of pipeline metrics: 'source_items', 'elapsed',
+        'errors' (failed items) and 'stages' (a list of stage metrics)
+        """
+        stages = []
+        for stage in self.stages:
+            metrics = stage.get_metrics()
+            metrics['name'] = stage.name
+            stages.append(metrics)
+        with self._lock:
+            failed = list(self.failed)
+        return {
+            'source_items': self.source_items,
+            'elapsed': round(self.elapsed, 3),
+            'errors': failed, 'stages': stages,
+        }
+
+    def run(self, items):
+        """
+        Run items (an iterable, e.g. a generator of key names) through all
+        stages, until all are done or the pipeline is stopped
+
+        @return: the pipeline metrics (see get_metrics)
+
+        Note: on KeyboardInterrupt, the pipeline is stopped and drained
+              before the interrupt is raised again.
+        """
+        started = time.time()
+        threads = [threading.Thread(target=self._feed, args=(items,))]
+        for index, stage in enumerate(self.stages):
+            stage._running = stage.workers
+            threads.extend(
+                threading.Thread(target=self._work, args=(index,))
+                for _ in range(stage.workers))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        interrupted = False
+        for thread in threads:
+            while thread.is_alive():
+                try:
+                    thread.join(0.1)
+                except KeyboardInterrupt:
+                    LOGGER.warning("- pipeline interrupted, draining ...")
+                    interrupted = True
+                    self.stop()
+        self.elapsed = time.time() - started
+        metrics = self.get_metrics()
+        LOGGER.info("pipeline done: %s", metrics)
+        if interrupted:
+            raise KeyboardInterrupt()
+        return metrics
+
+    def stop(self):
+        """
+        Stop taking source items, and drain the items in flight through
+        all stages (graceful shutdown)
+        """
+        self._draining.set()
+
+
+def fetch_stage(bucket=s3.BUCKET_DEFAULT, workers=FETCH_WORKERS):
+    """
+    Get a stage to fetch key contents (by s3.get_stream, decompressed),
+    mapping a key name to a tuple of (key name, contents); a failed fetch
+    (e.g. NoSuchKey, after retries) is an error of this stage
+    """
+    def fetch(key_name):
+        """Fetch the contents of a key"""
+        body = s3.get_stream(key_name, bucket)
+        try:
+            return key_name, body.read()
+        finally:
+            body.close()
+    return Stage('fetch', fetch, workers)
+
+
+def parse_stage(json_lines=False, workers=PARSE_WORKERS):
+    """
+    Get a stage to parse fetched contents as JSON, mapping a tuple of (key
+    name, contents) to (key name, data)
+
+    @param json_lines: True to parse line-delimited JSON (parquet) into a
+                       list of records
+    """
+    def parse(item):
+        """Parse the contents of a key"""
+        key_name, contents = item
+        if not json_lines:
+            return key_name, json_codec.loads(contents)
+        records = [json_codec.loads(line) for line in contents.splitlines()
+                   if line.strip()]
+        return key_name, records
+    return Stage('parse', parse, workers)
+
+
+def transform_stage(a_func, workers=TRANSFORM_WORKERS):
+    """
+    Get a stage to call a_func(key_name, data) on a tuple of (key name,
+    data), which returns a tuple of (destination key name, data) or None
+    """
+    s3.check_arg_as_func(a_func)
+
+    def transform(item):
+        """Transform the data of a key"""
+        return a_func(*item)
+    return Stage('transform', transform, workers)
+
+
+def write_stage(bucket=s3.BUCKET_DEFAULT, workers=WRITE_WORKERS,
+                json_lines=False, **kwargs):
+    """
+    Get a stage to write (by s3.upload) a tuple of (key name, data), where
+    data is bytes, a string, or an object to dump as JSON
+
+    @param json_lines: True to dump a list of records as line-delimited
+                       JSON (parquet)
+    @param kwargs: additional s3.upload parameters, e.g. content_encoding
+    """
+    def write(item):
+        """Write the data to a key"""
+        key_name, data = item
+        if not isinstance(data, (bytes, type(u''))):
+            if json_lines:
+                data = u''.join(
+                    json_codec.dumps(record) + u'\n' for record in data)
+            else:
+                data = json_codec.dumps(data)
+        s3.upload(data, key_name, bucket, **kwargs)
+        return key_name
+    return Stage('write', write, workers)
+
+
+def run_pipeline(a_func, prefix='', bucket=s3.BUCKET_DEFAULT, suffix='',
+                 dst_bucket=None, json_lines=False, **kwargs):
+    """
+    Run a list -> fetch -> parse -> transform -> write pipeline on all
+    keys with the prefix (and suffix) in a bucket
+
+    @param a_func: the transform function `def func(key_name, data)`,
+                   returning a tuple of (destination key name, data), or
+                   None to skip the key
+    @param prefix: the prefix (starting under the bucket) of the key name
+    @param bucket: the bucket name (top-level directory in S3)
+    @param suffix: the suffix (ending) of key names to process
+    @param dst_bucket: the bucket to write to (default: the same bucket)
+    @param json_lines: True to read and write line-delimited JSON
+    @param kwargs: the number of workers per stage ('fetch_workers',
+                   'parse_workers', 'transform_workers', 'write_workers'),
+                   and additional s3.upload parameters
+
+    @return: the pipeline metrics (see Pipeline.get_metrics)
+    """
+    workers = dict((name, kwargs.pop(name + '_workers', default))
+                   for name, default in (('fetch', FETCH_WORKERS),
+                                         ('parse', PARSE_WORKERS),
+                                         ('transform', TRANSFORM_WORKERS),
+                                         ('write', WRITE_WORKERS)))
+    pipeline = Pipeline([
+        fetch_stage(bucket, workers['fetch']),
+        parse_stage(json_lines, workers['parse']),
+        transform_stage(a_func, workers['transform']),
+        write_stage(dst_bucket or bucket, workers['write'], json_lines,
+                    **kwargs),
+    ])
+    keys = (obj['Key'] for obj in s3.list_objects_sharded(prefix, bucket)
+            if obj['Key'].endswith(suffix) and not obj['Key'].endswith('/'))
+    return pipeline.run(keys)
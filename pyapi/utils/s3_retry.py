@@ -0,0 +1,205 @@
+"""
+# s3_retry module includes retry policy and concurrency limiter for s3
+
+The retry policy (jittered exponential backoff) and the adaptive (AIMD)
+concurrency limiter are shared by all s3 requests in a process.
+
+Throttling errors (e.g. SlowDown, 503) and transient errors (e.g. 500,
+request timeout, connection errors) are retried after a random delay of
+"full jitter" exponential backoff. A throttling error also cuts the limit
+of requests in flight of a shared limiter by half (multiplicative
+decrease), which grows back by one per limit of successful requests
+(additive increase), so all concurrent callers back off together.
+
+example:
+    limiter = AdaptiveLimiter(64)
+    policy = RetryPolicy(max_attempts=5, limiter=limiter)
+    response = policy.call(s3_client.get_object, Bucket=bucket, Key=key)
+"""
+import logging
+import random
+import threading
+import time
+
+import botocore.exceptions
+
+from pyapi.utils.logger import get_logger
+LOGGER = get_logger(__name__, logging.WARN)
+
+# the error codes (or HTTP status) of throttling
+THROTTLE_CODES = (
+    '503', 'SlowDown', 'Throttling', 'ThrottlingException', 'Throttled',
+    'RequestThrottled', 'RequestLimitExceeded', 'TooManyRequests',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException',
+)
+
+# the error codes (or HTTP status) of transient errors
+TRANSIENT_CODES = (
+    '500', '502', '504', 'InternalError', 'ServiceUnavailable',
+    'RequestTimeout', 'RequestTimeoutException', 'PriorRequestNotComplete',
+)
+
+# the kinds of retryable errors, see classify_error()
+ERROR_THROTTLE = 'throttle'
+ERROR_TRANSIENT = 'transient'
+
+
+class AdaptiveLimiter(object):
+    """
+    class AdaptiveLimiter implements a concurrency limiter (a semaphore of
+    a varying limit) by additive increase and multiplicative decrease
+
+    Note: the limit is cut at most once per cooldown (in seconds), since
+          a burst of requests in flight is throttled at about the same
+          time, as one signal of congestion.
+    """
+    def __init__(self, max_limit, min_limit=1, increase=1.0, decrease=0.5,
+                 cooldown=1.0):
+        """
+        Initializes a limiter of @max_limit requests in flight
+        """
+        self.max_limit = max(int(max_limit), 1)
+        self.min_limit = max(min(int(min_limit), self.max_limit), 1)
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.throttles = 0  # the number of throttling errors
+        self._decreased = 0  # the time of the last decrease
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def acquire(self):
+        """
+        Wait until a request is allowed in flight
+        """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def on_success(self):
+        """
+        Increase the limit additively (by increase per limit of requests)
+        """
+        with self._cond:
+            if self.limit < self.max_limit:
+                self.limit = min(
+                    float(self.max_limit),
+                    self.limit + self.increase / self.limit)
+                self._cond.notify()
+
+    def on_throttle(self):
+        """
+        Decrease the limit multiplicatively (once per cooldown)
+        """
+        with self._cond:
+            self.throttles += 1
+            now = time.time()
+            if now - self._decreased < self.cooldown:
+                return
+            self._decreased = now
+            self.limit = max(float(self.min_limit), self.limit * self.decrease)
+            LOGGER.info("- throttled, limit of requests in flight: %s",
+                        int(self.limit))
+
+    def release(self):
+        """
+        Release a request in flight
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+
+class RetryPolicy(object):
+    """
+    class RetryPolicy implements retries of throttling and transient
+    errors by jittered exponential backoff, optionally limiting requests
+    in flight by a shared AdaptiveLimiter
+    """
+    def __init__(self, max_attempts=5, base_delay=0.1, max_delay=20.0,
+                 limiter=None):
+        """
+        Initializes a policy of @max_attempts (including the first one),
+        with delays from @base_delay doubling up to @max_delay (seconds)
+        """
+        self.max_attempts = max(int(max_attempts), 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = limiter
+
+    def call(self, a_func, *args, **kwargs):
+        """
+        Call a_func with args and kwargs, retrying retryable errors
+
+        @return: the result of a_func
+        @raise: the last error, or any error not retryable
+        """
+        attempt = 1
+        while True:
+            try:
+                if self.limiter is None:
+                    result = a_func(*args, **kwargs)
+                else:
+                    with self.limiter:
+                        result = a_func(*args, **kwargs)
+            except Exception as ex:
+                kind = classify_error(ex)
+                if kind == ERROR_THROTTLE and self.limiter is not None:
+                    self.limiter.on_throttle()
+                if kind is None or attempt >= self.max_attempts:
+                    raise
+                delay = self.get_delay(attempt)
+                LOGGER.info("- retrying in %.2fs (attempt %s), %s error: %s",
+                            delay, attempt, kind, ex)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if self.limiter is not None:
+                self.limiter.on_success()
+            return result
+
+    def get_delay(self, attempt):
+        """
+        Get a random delay (full jitter) before retrying an attempt
+        """
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+
+def classify_error(error):
+    """
+    Classify an error as ERROR_THROTTLE, ERROR_TRANSIENT, or None (not
+    retryable)
+    """
+    exceptions = botocore.exceptions
+    if isinstance(error, exceptions.ClientError):
+        response = getattr(error, 'response', None) or {}
+        code = str(response.get('Error', {}).get('Code'))
+        status = str(response.get('ResponseMetadata', {}).get(
+            'HTTPStatusCode'))
+        return classify_error_code(code) or classify_error_code(status)
+    if isinstance(error, (exceptions.ConnectionError,
+                          exceptions.HTTPClientError)):
+        return ERROR_TRANSIENT
+    return None
+
+
+def classify_error_code(code):
+    """
+    Classify an error code (e.g. per key in a DeleteObjects response) as
+    ERROR_THROTTLE, ERROR_TRANSIENT, or None
+    """
+    if code in THROTTLE_CODES:
+        return ERROR_THROTTLE
+    if code in TRANSIENT_CODES:
+        return ERROR_TRANSIENT
+    return None
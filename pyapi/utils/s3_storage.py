@@ -5,6 +5,7 @@
 @created: 2017-09-01
 """
 from pyapi.utils import s3
+from pyapi.utils import s3_parquet
 
 
 class S3Storage(object):
@@ -18,12 +19,15 @@ class S3Storage(object):
         self.bucket = bucket
         pass
 
-    def create(self, key_path, content=''):
+    def create(self, key_path, content='', content_encoding=None):
         """
-        Create an s3 key per @key_path with specified @content.
+        Create an s3 key per @key_path with specified @content,
+        compressed per @content_encoding (e.g. 'gzip') if specified.
         Note: any existing key_path will be overwritten.
         """
-        return s3.create_key(content, key_path, bucket=self.bucket)
+        return s3.create_key(
+            content, key_path, bucket=self.bucket,
+            content_encoding=content_encoding)
 
     def delete(self, key_path):
         """
@@ -53,8 +57,8 @@ class S3Storage(object):
         """
         Get the last modified (offset-aware datetime) per specified s3 @key_path
         """
-        s3_obj = s3.get_key(key_path, bucket=self.bucket)
-        return None if s3_obj is None else s3_obj.last_modified
+        meta = s3.head_key(key_path, bucket=self.bucket)
+        return None if meta is None else meta.get('LastModified')
 
     def get_parquet_content(self, key_path):
         """
@@ -62,6 +66,23 @@ class S3Storage(object):
         """
         return s3.get_parquet_data(key_path, bucket=self.bucket)
 
+    def iter_json_lines(self, key_path, batch_size=0):
+        """
+        Iterate JSON records (or batches of records) in a line-delimited
+        JSON (parquet) content from specified s3 @key_path
+        """
+        return s3.iter_json_lines(
+            key_path, bucket=self.bucket, batch_size=batch_size)
+
+    def iter_parquet_records(self, key_path, columns=None, filters=None):
+        """
+        Iterate records (dict) from a columnar Parquet file at specified s3
+        @key_path, reading only @columns of row groups matching @filters
+        (see pyapi.utils.s3_parquet.iter_batches)
+        """
+        return s3_parquet.iter_records(
+            key_path, bucket=self.bucket, columns=columns, filters=filters)
+
     def move(self, source_name, target_name):
         """
         Move an s3 key from @source_name to @target_name
@@ -74,9 +95,12 @@ class S3Storage(object):
         """
         return s3.process_keys(a_func, prefix=prefix, **kwargs)
 
-    def save(self, key_path, content=''):
+    def save(self, key_path, content='', content_encoding=None):
         """
-        Save @content (string) to an s3 @key_path.
+        Save @content (string) to an s3 @key_path, compressed per
+        @content_encoding (e.g. 'gzip') if specified.
         Note: any existing key_path will be overwritten.
         """
-        return s3.copy_contents_to_bucket(content, key_path, bucket=self.bucket)
+        return s3.copy_contents_to_bucket(
+            content, key_path, bucket=self.bucket,
+            content_encoding=content_encoding)
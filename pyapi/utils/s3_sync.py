@@ -0,0 +1,280 @@
+"""
+# s3_sync module includes sync between a local directory and a s3 prefix
+
+A sync compares each file to its key by size, and by modified time (the
+newer one wins) or by content checksum (MD5, or the multipart ETag), then
+transfers only the files which differ, in parallel; and optionally
+deletes the files (or keys) not found in the source.
+
+example:
+    result = sync_to_s3('/data/mined', PREFIX_MINED + '/', delete=True)
+    result = sync_from_s3(PREFIX_MINED + '/', '/data/mined')
+"""
+import calendar
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent import futures
+
+from pyapi.utils import s3
+from pyapi.utils.logger import get_logger
+LOGGER = get_logger(__name__, logging.WARN)
+
+# the number of files transferring in parallel
+SYNC_WORKERS = 8
+
+# the chunk size (in bytes) of reading a local file for checksum
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _get_file_etag(path, size, etag):
+    """
+    Get the ETag of a local file in the form of a s3 ETag (the MD5, or the
+    MD5 of part MD5s with '-N' of a multipart upload by s3.upload), or
+    None if the part size of a multipart ETag is unknown
+    """
+    parts = 1
+    if '-' in etag:
+        parts = int(etag.rsplit('-', 1)[1])
+        part_size = max(s3.MULTIPART_PART_SIZE, s3.MULTIPART_PART_SIZE_MIN)
+        if parts != max((size + part_size - 1) // part_size, 1):
+            return None
+    else:
+        part_size = max(size, 1)
+
+    digests = []
+    with open(path, 'rb') as file_obj:
+        for _ in range(parts):
+            md5 = hashlib.md5()
+            remains = part_size
+            while remains > 0:
+                chunk = file_obj.read(min(HASH_CHUNK_SIZE, remains))
+                if not chunk:
+                    break
+                md5.update(chunk)
+                remains -= len(chunk)
+            digests.append(md5)
+    if '-' not in etag:
+        return digests[0].hexdigest()
+    md5 = hashlib.md5(b''.join(d.digest() for d in digests))
+    return '{}-{}'.format(md5.hexdigest(), parts)
+
+
+def _get_timestamp(value):
+    """
+    Get a timestamp (seconds since epoch) of a datetime (offset-aware, or
+    naive in UTC) or a number
+    """
+    if hasattr(value, 'utctimetuple'):
+        return calendar.timegm(value.utctimetuple())
+    return float(value or 0)
+
+
+def _is_changed(path, obj, newer, checksum=False):
+    """
+    Check if a local file (path) differs from a listed s3 object
+
+    @param newer: 'local' or 's3', the side of the source whose newer
+                  modified time means changed
+    @param checksum: True to compare contents by ETag (and modified time
+                     is ignored), falling back to modified time if the
+                     ETag is not comparable
+    """
+    stat = os.stat(path)
+    if stat.st_size != obj.get('Size'):
+        return True
+    etag = str(obj.get('ETag', '')).strip('"')
+    if checksum and etag:
+        file_etag = _get_file_etag(path, stat.st_size, etag)
+        if file_etag is not None:
+            return file_etag != etag
+    local_time = int(stat.st_mtime)
+    s3_time = _get_timestamp(obj.get('LastModified'))
+    return local_time > s3_time if newer == 'local' else s3_time > local_time
+
+
+def _list_local(local_dir):
+    """
+    Get a dict of relative path (by '/') => full path of all local files
+    """
+    files = {}
+    for root, _, filenames in os.walk(local_dir):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            rel_path = os.path.relpath(path, local_dir).replace(os.sep, '/')
+            files[rel_path] = path
+    return files
+
+
+def _list_s3(prefix, bucket, workers):
+    """
+    Get a dict of relative path (after prefix) => listed object of all
+    keys with the prefix, except "folder" keys (ending with '/')
+    """
+    objects = {}
+    for obj in s3.list_objects_sharded(prefix, bucket, workers=workers):
+        key_name = obj['Key']
+        if not key_name.endswith('/'):
+            objects[key_name[len(prefix):]] = obj
+    return objects
+
+
+def _normalize_prefix(prefix):
+    """
+    Get a prefix ending with '/', or '' for the whole bucket
+    """
+    prefix = (prefix or '').lstrip('/')
+    return prefix if not prefix or prefix.endswith('/') else prefix + '/'
+
+
+def _run_tasks(a_func, items, workers, result):
+    """
+    Call a_func on each of the items in parallel, counting results
+    ('transferred' or 'skipped', with bytes) into the result dict
+    """
+    if not items:
+        return
+    executor = futures.ThreadPoolExecutor(max_workers=max(int(workers), 1))
+    try:
+        tasks = dict((executor.submit(a_func, item), item) for item in items)
+        for future in futures.as_completed(tasks):
+            error = future.exception()
+            if error is not None:
+                LOGGER.error("- failed to sync %s: %s", tasks[future], error)
+                result['errors'].append({'Path': tasks[future],
+                                         'Message': str(error)})
+                continue
+            status, size = future.result()
+            result[status] += 1
+            if status == 'transferred':
+                result['bytes'] += size
+    finally:
+        executor.shutdown(wait=True)
+
+
+def sync_from_s3(prefix, local_dir, bucket=s3.BUCKET_DEFAULT, delete=False,
+                 checksum=False, workers=SYNC_WORKERS):
+    """
+    Sync a s3 prefix to a local directory, downloading keys which are new,
+    of a different size, or newer (by checksum if specified) than files
+
+    @param prefix: the source prefix (starting under the bucket)
+    @param local_dir: the destination directory (created if not exists)
+    @param bucket: the bucket name (top-level directory in S3)
+    @param delete: True to delete local files not found under the prefix
+    @param checksum: True to compare by checksum (ETag) instead of time
+    @param workers: the number of files downloading in parallel
+
+    @return: a dict of 'transferred', 'bytes', 'skipped', 'deleted' and
+             'errors' (a list of dict with 'Path' and 'Message')
+
+    Note: a downloaded file is written atomically (by renaming), with the
+          modified time of the key, so an unchanged key is skipped next.
+    """
+    prefix = _normalize_prefix(prefix)
+    if not os.path.isdir(local_dir):
+        os.makedirs(local_dir)
+    objects = _list_s3(prefix, bucket, workers)
+    files = _list_local(local_dir)
+    result = {'transferred': 0, 'bytes': 0, 'skipped': 0, 'deleted': 0,
+              'errors': []}
+
+    def download(rel_path):
+        """Download a key if changed"""
+        obj = objects[rel_path]
+        if '..' in rel_path.split('/') or rel_path.startswith('/'):
+            raise ValueError("unsafe key name: {}".format(obj['Key']))
+        path = files.get(rel_path) or os.path.join(
+            local_dir, *rel_path.split('/'))
+        if rel_path in files and not _is_changed(path, obj, 's3', checksum):
+            return 'skipped', 0
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # created by another thread
+                if not os.path.isdir(directory):
+                    raise
+        handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.sync-')
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                body = s3.get_stream(obj['Key'], bucket, decompress=False)
+                try:
+                    for chunk in iter(lambda: body.read(s3.READ_CHUNK_SIZE),
+                                      b''):
+                        temp_file.write(chunk)
+                finally:
+                    body.close()
+            modified = _get_timestamp(obj.get('LastModified'))
+            os.utime(temp_path, (modified, modified))
+            os.rename(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        LOGGER.debug("- downloaded %s to %s", obj['Key'], path)
+        return 'transferred', obj.get('Size', 0)
+
+    _run_tasks(download, sorted(objects), workers, result)
+
+    if delete:
+        for rel_path in sorted(set(files) - set(objects)):
+            try:
+                os.remove(files[rel_path])
+                result['deleted'] += 1
+            except OSError as ex:
+                result['errors'].append({'Path': rel_path,
+                                         'Message': str(ex)})
+    LOGGER.info("synced %s/%s to %s: %s", bucket, prefix, local_dir, result)
+    return result
+
+
+def sync_to_s3(local_dir, prefix, bucket=s3.BUCKET_DEFAULT, delete=False,
+               checksum=False, workers=SYNC_WORKERS, **kwargs):
+    """
+    Sync a local directory to a s3 prefix, uploading files which are new,
+    of a different size, or newer (by checksum if specified) than keys
+
+    @param local_dir: the source directory
+    @param prefix: the destination prefix (starting under the bucket)
+    @param bucket: the bucket name (top-level directory in S3)
+    @param delete: True to delete keys not found in the local directory
+    @param checksum: True to compare by checksum (ETag) instead of time
+    @param workers: the number of files uploading in parallel
+    @param kwargs: additional s3.upload parameters, e.g. ContentType
+
+    @return: a dict of 'transferred', 'bytes', 'skipped', 'deleted' and
+             'errors' (a list of dict with 'Path' and 'Message')
+    """
+    if not os.path.isdir(local_dir):
+        raise ValueError("param 'local_dir' must be a directory: {}".format(
+            local_dir))
+    prefix = _normalize_prefix(prefix)
+    files = _list_local(local_dir)
+    objects = _list_s3(prefix, bucket, workers)
+    result = {'transferred': 0, 'bytes': 0, 'skipped': 0, 'deleted': 0,
+              'errors': []}
+
+    def upload(rel_path):
+        """Upload a file if changed"""
+        path = files[rel_path]
+        obj = objects.get(rel_path)
+        if obj is not None and not _is_changed(path, obj, 'local', checksum):
+            return 'skipped', 0
+        with open(path, 'rb') as file_obj:
+            s3.upload(file_obj, prefix + rel_path, bucket, **kwargs)
+        LOGGER.debug("- uploaded %s to %s", path, prefix + rel_path)
+        return 'transferred', os.path.getsize(path)
+
+    _run_tasks(upload, sorted(files), workers, result)
+
+    if delete:
+        extras = [prefix + rel_path
+                  for rel_path in sorted(set(objects) - set(files))]
+        deleted = s3.delete_keys(extras, bucket)
+        result['deleted'] = deleted['deleted']
+        result['errors'].extend(
+            {'Path': err.get('Key'), 'Message': err.get('Message')}
+            for err in deleted['errors'])
+    LOGGER.info("synced %s to %s/%s: %s", local_dir, bucket, prefix, result)
+    return result
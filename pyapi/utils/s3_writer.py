@@ -0,0 +1,288 @@
+"""
+# s3_writer module includes a rolling JSON-lines writer to s3
+
+A writer buffers records as JSON lines, and streams them to the current
+object, which is compressed (e.g. gzip) and uploaded (by multipart for a
+large object) in a background thread; and rolls to a new object when the
+current one reaches a size or an age, so records are written into a few
+large objects (e.g. ~128 MiB each) rather than millions of tiny ones.
+
+The producer never waits for s3: write() only serializes a record and
+queues a chunk of lines, while compression and uploads run in background
+threads; a failed upload is reported by close() (or by errors).
+
+example:
+    with S3JsonLinesWriter(PREFIX_MINED + '/2020/01/') as writer:
+        for record in records:
+            writer.write(record)
+    print(writer.keys)
+"""
+import logging
+import threading
+import time
+import uuid
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+from pyapi.utils import compression
+from pyapi.utils import json_codec
+from pyapi.utils import s3
+from pyapi.utils.logger import get_logger
+LOGGER = get_logger(__name__, logging.WARN)
+
+# the (uncompressed) size in bytes and the age in seconds of an object to
+# roll to a new object
+ROLL_SIZE = 128 * 1024 * 1024
+ROLL_INTERVAL = 300
+
+# the size (in bytes) of buffered lines queued as one chunk for uploading
+CHUNK_SIZE = 1024 * 1024
+
+# the format of key names, by prefix, time (of opening the object, UTC),
+# writer (a random id per writer), sequence (per writer) and extension
+KEY_FORMAT = '{prefix}{time}-{writer}-{sequence:06d}.jsonl{extension}'
+
+# the key name extensions by Content-Encoding
+KEY_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst', 'lz4': '.lz4'}
+
+
+class _RollingObject(object):
+    """
+    class _RollingObject implements an object being written, whose chunks
+    are queued for an upload in a background thread
+    """
+    def __init__(self, key_name, max_pending=0):
+        """
+        Initializes an object of @key_name, queuing up to @max_pending
+        chunks (0 for no limit)
+        """
+        self.key_name = key_name
+        self.chunks = queue.Queue(maxsize=max(int(max_pending), 0))
+        self.opened = time.time()
+        self.records = 0
+        self.size = 0
+        self.error = None
+        self.thread = None
+        self._ended = False
+
+    def iter_chunks(self):
+        """
+        Yield queued chunks until the object is closed (by None)
+        """
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                self._ended = True
+                return
+            yield chunk
+
+    def upload(self, bucket, **kwargs):
+        """
+        Upload all queued chunks to the key, recording any error
+        """
+        try:
+            s3.upload(self.iter_chunks(), self.key_name, bucket, **kwargs)
+        except Exception as ex:
+            LOGGER.error("- failed to upload %s/%s: %s",
+                         bucket, self.key_name, ex)
+            self.error = ex
+            if not self._ended:
+                for _ in self.iter_chunks():  # unblock a bounded queue
+                    pass
+
+
+class S3JsonLinesWriter(object):
+    """
+    class S3JsonLinesWriter implements a buffered JSON-lines writer to s3
+    objects under a prefix, rolling by size or age of the current object
+
+    Note: the age is checked on write, so an idle writer keeps its current
+          object open until the next write(), roll() or close().
+    """
+    def __init__(self, prefix, bucket=s3.BUCKET_DEFAULT,
+                 content_encoding='gzip', roll_size=ROLL_SIZE,
+                 roll_interval=ROLL_INTERVAL, chunk_size=CHUNK_SIZE,
+                 max_pending=0, part_size=s3.MULTIPART_PART_SIZE,
+                 workers=s3.MULTIPART_WORKERS, key_format=KEY_FORMAT,
+                 **kwargs):
+        """
+        Initializes a writer to objects under @prefix in @bucket
+
+        @param prefix: the prefix of key names (starting under the bucket)
+        @param bucket: the bucket name (top-level directory in S3)
+        @param content_encoding: a compression encoding (e.g. 'gzip',
+                                 'zstd' or 'lz4'), or None for plain text
+        @param roll_size: the size (in bytes, uncompressed) of an object to
+                          roll to a new object
+        @param roll_interval: the age (in seconds) of an object to roll to
+                              a new object, or 0 for no limit
+        @param chunk_size: the size (in bytes) of lines buffered per chunk
+        @param max_pending: the max number of chunks queued per object, or
+                            0 for no limit (write never blocks); a limit
+                            bounds memory if uploads fall behind, making
+                            write wait for them
+        @param part_size: the size (in bytes) of a multipart upload part
+        @param workers: the number of parts uploading in parallel per object
+        @param key_format: the format of key names (see KEY_FORMAT)
+        @param kwargs: additional s3.upload parameters, e.g. ContentType
+        """
+        if content_encoding:
+            content_encoding = compression.get_encoding(content_encoding)
+        self.prefix = prefix
+        self.bucket = bucket
+        self.content_encoding = content_encoding or None
+        self.roll_size = max(int(roll_size), 1)
+        self.roll_interval = roll_interval
+        self.chunk_size = max(int(chunk_size), 1)
+        self.max_pending = max_pending
+        self.key_format = key_format
+        self.upload_kwargs = dict(
+            kwargs, part_size=part_size, workers=workers,
+            content_encoding=self.content_encoding)
+        self.writer_id = uuid.uuid4().hex[:8]
+        self.keys = []  # the key names of uploaded objects
+        self.errors = []  # tuples of (key name, error) of failed objects
+        self.records = 0
+        self.size = 0
+        self.closed = False
+        self._sequence = 0
+        self._buffer = []
+        self._buffered = 0
+        self._current = None
+        self._uploading = []
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _collect(self, wait=False):
+        """
+        Collect finished uploads (all, if wait) into keys and errors
+        """
+        uploading = []
+        for obj in self._uploading:
+            if wait:
+                obj.thread.join()
+            if obj.thread.is_alive():
+                uploading.append(obj)
+            elif obj.error is None:
+                self.keys.append(obj.key_name)
+            else:
+                self.errors.append((obj.key_name, obj.error))
+        self._uploading = uploading
+
+    def _flush_buffer(self):
+        """
+        Queue buffered lines as a chunk of the current object
+        """
+        if self._buffer:
+            self._current.chunks.put(b''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def _open(self):
+        """
+        Open a new object, and start its upload in a background thread
+        """
+        self._sequence += 1
+        key_name = self.key_format.format(
+            prefix=self.prefix,
+            time=time.strftime('%Y%m%dT%H%M%SZ', time.gmtime()),
+            writer=self.writer_id, sequence=self._sequence,
+            extension=KEY_EXTENSIONS.get(self.content_encoding, ''))
+        obj = _RollingObject(key_name, self.max_pending)
+        obj.thread = threading.Thread(
+            target=obj.upload, args=(self.bucket,), kwargs=self.upload_kwargs,
+            name='s3-writer-{}'.format(self._sequence))
+        obj.thread.daemon = True
+        obj.thread.start()
+        self._current = obj
+        LOGGER.debug("- opened %s/%s", self.bucket, key_name)
+        return obj
+
+    def close(self):
+        """
+        Roll the current object, and wait for all uploads to finish
+
+        @return: the key names of all uploaded objects
+        @raise IOError: if any object failed to upload
+        """
+        with self._lock:
+            if not self.closed:
+                self.roll()
+                self.closed = True
+            self._collect(wait=True)
+        if self.errors:
+            raise IOError("failed to upload {} object(s) to {}: {}".format(
+                len(self.errors), self.bucket,
+                ', '.join('{} ({})'.format(k, e) for k, e in self.errors)))
+        return self.keys
+
+    def get_metrics(self):
+        """
+        Get a dict of metrics: 'records' and 'bytes' (uncompressed) written,
+        'objects' uploaded, 'uploading' objects and 'errors'
+        """
+        with self._lock:
+            self._collect()
+            return {
+                'records': self.records, 'bytes': self.size,
+                'objects': len(self.keys),
+                'uploading': len(self._uploading) + (
+                    1 if self._current is not None else 0),
+                'errors': len(self.errors),
+            }
+
+    def roll(self):
+        """
+        Complete the current object (if any), so the next record is written
+        to a new object; the upload finishes in the background
+        """
+        with self._lock:
+            obj = self._current
+            if obj is None:
+                return
+            self._flush_buffer()
+            obj.chunks.put(None)
+            self._current = None
+            self._uploading.append(obj)
+            self._collect()
+            LOGGER.debug("- rolled %s/%s: %s records, %s bytes",
+                         self.bucket, obj.key_name, obj.records, obj.size)
+
+    def write(self, record):
+        """
+        Write a record (any JSON serializable object) as a line
+
+        @raise ValueError: if the writer is closed
+        """
+        line = json_codec.dumps(record)
+        if isinstance(line, type(u'')):
+            line = line.encode('utf-8')
+        line += b'\n'
+        with self._lock:
+            if self.closed:
+                raise ValueError("write to a closed writer: {}/{}".format(
+                    self.bucket, self.prefix))
+            obj = self._current
+            if obj is not None and self.roll_interval and \
+               time.time() - obj.opened >= self.roll_interval:
+                self.roll()
+                obj = None
+            if obj is None:
+                obj = self._open()
+            self._buffer.append(line)
+            self._buffered += len(line)
+            obj.records += 1
+            obj.size += len(line)
+            self.records += 1
+            self.size += len(line)
+            if obj.size >= self.roll_size:
+                self.roll()
+            elif self._buffered >= self.chunk_size:
+                self._flush_buffer()
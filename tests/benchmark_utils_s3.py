@@ -0,0 +1,350 @@
+"""
+# benchmark_utils_s3
+
+Benchmarks of pyapi.utils.s3 against a local S3 stand-in (e.g. moto server
+or MinIO), measuring each function at several concurrency levels:
+
+  * list       - listing keys (generate_pages, or list_objects_sharded)
+  * get_json   - get_json_data throughput of small JSON objects
+  * put_small  - create_key rate of small objects
+  * mv_key     - mv_key rate
+  * large_read - large object read bandwidth (get_content, or
+                 download_to_mmap by parallel ranges)
+
+Results (with per-operation latency from pyapi.utils.s3_metrics) are saved
+as JSON, so runs can be compared by --compare. This is not a unit test
+module (not collected by pytest or nose).
+
+usage:
+    moto_server -p 5000 &
+    export PYTHONPATH=.
+    python tests/benchmark_utils_s3.py --endpoint-url http://localhost:5000 \\
+        --concurrency 1,4,16 --output benchmark-s3.json
+    python tests/benchmark_utils_s3.py --compare base.json benchmark-s3.json
+"""
+from __future__ import absolute_import
+
+import argparse
+import logging
+import os
+import platform
+import sys
+import time
+from concurrent import futures
+
+from pyapi.utils import json_codec
+from pyapi.utils import s3
+from pyapi.utils import s3_metrics
+
+# the default local S3 stand-in, and the bucket to benchmark in
+ENDPOINT_URL = 'http://localhost:5000'
+BENCHMARK_BUCKET = 'pyapi-benchmark'
+
+# the benchmarks in the order of running
+BENCHMARKS = ('list', 'get_json', 'put_small', 'mv_key', 'large_read')
+
+# the default parameters of benchmarks
+CONCURRENCY_LEVELS = (1, 4, 16)
+LIST_KEYS = 100000
+OBJECTS = 1000
+OBJECT_SIZE = 1024
+LARGE_SIZE = 64 * 1024 * 1024
+
+# the number of threads seeding objects
+SEED_WORKERS = 32
+
+
+def _run_concurrent(a_func, items, workers):
+    """
+    Call a_func on each of the items in a pool of workers
+
+    @return: a tuple of (the number of successful calls, total result size),
+             where the result size is len(result) if sized, or 0
+    """
+    counts, size = 0, 0
+    if workers <= 1:
+        results = (a_func(item) for item in items)
+    else:
+        executor = futures.ThreadPoolExecutor(max_workers=workers)
+        results = executor.map(a_func, items)
+    for result in results:
+        if result is None or result is False:
+            continue
+        counts += 1
+        size += len(result) if hasattr(result, '__len__') else 0
+    if workers > 1:
+        executor.shutdown(wait=True)
+    return counts, size
+
+
+def _measure(name, concurrency, a_func):
+    """
+    Measure a benchmark run of a_func (returning a tuple of the number of
+    operations and bytes), with s3 metrics
+
+    @return: a dict of the benchmark result
+    """
+    sink = s3_metrics.MemorySink()
+    previous = s3_metrics.set_sink(sink)
+    started = time.time()
+    try:
+        ops, size = a_func()
+    finally:
+        seconds = time.time() - started
+        s3_metrics.set_sink(previous)
+    result = {
+        'name': name, 'concurrency': concurrency, 'ops': ops, 'bytes': size,
+        'seconds': round(seconds, 3),
+        'ops_per_sec': round(ops / seconds, 1) if seconds else 0.0,
+        'mb_per_sec': round(size / seconds / 1024.0 / 1024.0, 2)
+                      if seconds else 0.0,
+        'requests': sink.snapshot(),
+    }
+    sys.stdout.write(
+        "{name:<12} x{concurrency:<4} {ops:>8} ops {seconds:>9.3f}s "
+        "{ops_per_sec:>10.1f} ops/s {mb_per_sec:>9.2f} MB/s\n".format(
+            **result))
+    sys.stdout.flush()
+    return result
+
+
+def _seed(bucket, key_names, contents=b''):
+    """
+    Create keys of contents in parallel
+    """
+    client = s3.get_client()
+
+    def put(key_name):
+        """Put a key"""
+        client.put_object(Bucket=bucket, Key=key_name, Body=contents)
+        return True
+
+    started = time.time()
+    counts, _ = _run_concurrent(put, key_names, SEED_WORKERS)
+    sys.stdout.write("- seeded {} keys in {:.1f}s\n".format(
+        counts, time.time() - started))
+
+
+def bench_get_json(bucket, levels, objects=OBJECTS, size=OBJECT_SIZE):
+    """
+    Benchmark get_json_data throughput of small JSON objects
+    """
+    keys = ['get_json/{:08d}.json'.format(i) for i in range(objects)]
+    record = {'domain': 'example.com', 'data': 'x' * max(size - 32, 0)}
+    _seed(bucket, keys, json_codec.dumps(record).encode('utf-8'))
+
+    def get_json(key_name):
+        """Get a JSON object"""
+        return json_codec.dumps(s3.get_json_data(key_name, bucket))
+
+    return [_measure('get_json', level,
+                     lambda level=level: _run_concurrent(get_json, keys, level))
+            for level in levels]
+
+
+def bench_large_read(bucket, levels, size=LARGE_SIZE):
+    """
+    Benchmark large object read bandwidth: get_content (single GET) at
+    concurrency 1, download_to_mmap (parallel ranges) at other levels
+    """
+    key_name = 'large_read/object'
+    chunk = os.urandom(1024 * 1024)
+    s3.upload((chunk for _ in range(max(size // len(chunk), 1))),
+              key_name, bucket)
+
+    def read(level):
+        """Read the object"""
+        if level <= 1:
+            return 1, len(s3.get_content(key_name, bucket, use_cache=False))
+        data = s3.download_to_mmap(
+            key_name, bucket, part_size=s3.RANGE_PART_SIZE, workers=level)
+        try:
+            return 1, len(data)
+        finally:
+            data.close()
+
+    return [_measure('large_read', level, lambda level=level: read(level))
+            for level in levels]
+
+
+def bench_list(bucket, levels, keys=LIST_KEYS):
+    """
+    Benchmark listing keys: generate_pages at concurrency 1, and
+    list_objects_sharded (by workers) at other levels
+    """
+    prefix = 'list/'
+    existing = sum(1 for _ in s3.generate_pages(prefix, bucket=bucket))
+    if existing < keys:
+        _seed(bucket, ['{}{:08d}'.format(prefix, i)
+                       for i in range(existing, keys)])
+
+    def list_keys(level):
+        """List all keys"""
+        if level <= 1:
+            objects = s3.generate_pages(prefix, bucket=bucket)
+        else:
+            objects = s3.list_objects_sharded(prefix, bucket, workers=level)
+        return sum(1 for _ in objects), 0
+
+    return [_measure('list', level, lambda level=level: list_keys(level))
+            for level in levels]
+
+
+def bench_mv_key(bucket, levels, objects=OBJECTS, size=OBJECT_SIZE):
+    """
+    Benchmark mv_key rate
+    """
+    results = []
+    for level in levels:
+        keys = ['mv_key/{}/src/{:08d}'.format(level, i)
+                for i in range(objects)]
+        _seed(bucket, keys, b'x' * size)
+
+        def move(key_name):
+            """Move a key"""
+            return s3.mv_key(key_name, key_name.replace('/src/', '/dst/'),
+                             bucket) or None
+
+        results.append(_measure(
+            'mv_key', level,
+            lambda keys=keys, level=level: _run_concurrent(move, keys, level)))
+    return results
+
+
+def bench_put_small(bucket, levels, objects=OBJECTS, size=OBJECT_SIZE):
+    """
+    Benchmark create_key rate of small objects
+    """
+    contents = b'x' * size
+
+    def put(key_name):
+        """Put a small object"""
+        return contents if s3.create_key(contents, key_name, bucket) else None
+
+    return [_measure(
+        'put_small', level, lambda level=level: _run_concurrent(
+            put, ['put_small/{}/{:08d}'.format(level, i)
+                  for i in range(objects)], level))
+            for level in levels]
+
+
+def compare(base_file, new_file):
+    """
+    Print ops/s of two result files side by side, with the ratio
+    """
+    runs = []
+    for filename in (base_file, new_file):
+        with open(filename, 'rb') as file_obj:
+            runs.append(dict(
+                ((r['name'], r['concurrency']), r)
+                for r in json_codec.loads(file_obj.read())['results']))
+    sys.stdout.write("{:<12} {:>5} {:>12} {:>12} {:>8}\n".format(
+        'benchmark', 'x', 'base ops/s', 'new ops/s', 'ratio'))
+    for name, level in sorted(set(runs[0]) & set(runs[1])):
+        base, new = (run[(name, level)]['ops_per_sec'] for run in runs)
+        sys.stdout.write("{:<12} {:>5} {:>12.1f} {:>12.1f} {:>8}\n".format(
+            name, level, base, new,
+            '{:.2f}'.format(new / base) if base else '-'))
+
+
+def run(args):
+    """
+    Run benchmarks per command line args, and save the results
+
+    @return: the results (a dict of 'meta' and 'results')
+    """
+    os.environ['S3_ENDPOINT_URL'] = args.endpoint_url
+    for name, value in (('AWS_ACCESS_KEY_ID', 'testing'),
+                        ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                        ('AWS_DEFAULT_REGION', 'us-east-1')):
+        os.environ.setdefault(name, value)
+    s3.reset_clients()
+    if not s3.check_bucket(args.bucket)['okay']:
+        s3.get_client().create_bucket(Bucket=args.bucket)
+
+    levels = [int(level) for level in args.concurrency.split(',')]
+    benchmarks = {
+        'list': lambda: bench_list(args.bucket, levels, args.list_keys),
+        'get_json': lambda: bench_get_json(
+            args.bucket, levels, args.objects, args.object_size),
+        'put_small': lambda: bench_put_small(
+            args.bucket, levels, args.objects, args.object_size),
+        'mv_key': lambda: bench_mv_key(
+            args.bucket, levels, args.objects, args.object_size),
+        'large_read': lambda: bench_large_read(
+            args.bucket, levels, args.large_size),
+    }
+    names = args.benchmarks.split(',')
+    for name in names:
+        if name not in benchmarks:
+            raise ValueError("unknown benchmark '{}', in {}".format(
+                name, ', '.join(BENCHMARKS)))
+
+    results = {
+        'meta': {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'json_backend': json_codec.get_backend(),
+            'endpoint_url': args.endpoint_url,
+            'bucket': args.bucket,
+            'parameters': dict(
+                (name, getattr(args, name)) for name in (
+                    'concurrency', 'list_keys', 'objects', 'object_size',
+                    'large_size')),
+        },
+        'results': [],
+    }
+    for name in names:
+        results['results'].extend(benchmarks[name]())
+    if not args.keep:
+        for name in names:
+            s3.delete_prefix(name + '/', args.bucket)
+
+    with open(args.output, 'wb') as file_obj:
+        file_obj.write(json_codec.dumps(
+            results, sort_keys=True, indent=2).encode('utf-8'))
+    sys.stdout.write("- saved results to {}\n".format(args.output))
+    return results
+
+
+def main(argv=None):
+    """
+    The main entry of the benchmarks
+    """
+    parser = argparse.ArgumentParser(
+        description='Benchmark pyapi.utils.s3 against a local S3 stand-in')
+    parser.add_argument(
+        '--endpoint-url', default=os.environ.get(
+            'S3_ENDPOINT_URL', ENDPOINT_URL))
+    parser.add_argument('--bucket', default=BENCHMARK_BUCKET)
+    parser.add_argument(
+        '--benchmarks', default=','.join(BENCHMARKS),
+        help='comma separated, in: ' + ', '.join(BENCHMARKS))
+    parser.add_argument(
+        '--concurrency', default=','.join(str(c) for c in CONCURRENCY_LEVELS),
+        help='comma separated concurrency levels')
+    parser.add_argument('--list-keys', type=int, default=LIST_KEYS)
+    parser.add_argument('--objects', type=int, default=OBJECTS)
+    parser.add_argument('--object-size', type=int, default=OBJECT_SIZE)
+    parser.add_argument('--large-size', type=int, default=LARGE_SIZE)
+    parser.add_argument(
+        '--output', default='benchmark-s3-{}.json'.format(
+            time.strftime('%Y%m%d-%H%M%S')))
+    parser.add_argument(
+        '--keep', action='store_true',
+        help='keep benchmark keys (the listed keys are reused next run)')
+    parser.add_argument(
+        '--compare', nargs=2, metavar=('BASE', 'NEW'),
+        help='compare two result files, instead of running benchmarks')
+    args = parser.parse_args(argv)
+    for name in ('boto3', 'botocore', 'urllib3'):
+        logging.getLogger(name).setLevel(logging.WARN)
+    if args.compare:
+        compare(*args.compare)
+        return
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+# test_utils_compression
+
+"""
+from __future__ import absolute_import
+
+import io
+import unittest
+
+from mock import patch
+from pyapi.utils import compression
+
+
+class TestCompression(unittest.TestCase):
+    """
+    TestCompression includes all unit tests for pyapi.utils.compression module
+    """
+
+    def setUp(self):
+        """
+        setup test
+        """
+        self.data = b''.join(
+            b'{"id": %d, "name": "record"}\n' % i for i in range(1000))
+
+    def tearDown(self):
+        """
+        tear down each test
+        """
+        print "\ndone: " + self.id()
+
+    def test_compress(self):
+        """
+        test pyapi.utils.compression compress and decompress
+        """
+        for encoding in compression.get_encodings():
+            compressed = compression.compress(self.data, encoding)
+            self.assertTrue(len(compressed) < len(self.data))
+            self.assertEqual(
+                compression.decompress(compressed, encoding), self.data)
+        self.assertEqual(
+            compression.decompress(compression.compress(u'\xe9', 'gzip'),
+                                   'x-gzip'), b'\xc3\xa9')
+
+    def test_decompress_concatenated(self):
+        """
+        test pyapi.utils.compression.decompress on concatenated gzip members
+        """
+        compressed = compression.compress(b'abc', 'gzip') + \
+            compression.compress(b'def', 'gzip')
+        self.assertEqual(compression.decompress(compressed, 'gzip'), b'abcdef')
+
+    def test_decompressed_stream(self):
+        """
+        test pyapi.utils.compression.DecompressedStream
+        """
+        for encoding in compression.get_encodings():
+            compressed = compression.compress(self.data, encoding)
+            stream = compression.DecompressedStream(
+                io.BytesIO(compressed), encoding, chunk_size=7)
+            self.assertEqual(stream.read(10), self.data[:10])
+            self.assertEqual(
+                b''.join(stream.iter_chunks(100)), self.data[10:])
+            self.assertEqual(stream.read(), b'')
+            stream.close()
+            self.assertTrue(stream.stream.closed)
+
+    def test_decompressed_stream_bounded(self):
+        """
+        test pyapi.utils.compression.DecompressedStream reading a highly
+        compressed stream only up to the requested size
+        """
+        data = b'\0' * (4 * 1024 * 1024)
+        compressed = compression.compress(data, 'gzip') + \
+            compression.compress(self.data, 'gzip')
+        stream = compression.DecompressedStream(
+            io.BytesIO(compressed), 'gzip', chunk_size=len(compressed))
+        self.assertEqual(stream.read(100), data[:100])
+        self.assertTrue(len(stream._buffer) <= 100)
+        buffer = bytearray(1000)
+        self.assertEqual(stream.readinto(buffer), 1000)
+        self.assertTrue(len(stream._buffer) <= 100)
+        self.assertEqual(
+            b''.join(stream.iter_chunks(4096)), data[1100:] + self.data)
+
+        decompressor = compression._get_decompressor('gzip')
+        self.assertEqual(decompressor.decompress(compressed, 10), data[:10])
+        self.assertFalse(decompressor.needs_input)
+        self.assertEqual(decompressor.decompress(b'', 10), data[10:20])
+        self.assertEqual(decompressor.decompress(b''), data[20:] + self.data)
+        self.assertTrue(decompressor.needs_input)
+
+    def test_decompressed_stream_readinto(self):
+        """
+        test pyapi.utils.compression.DecompressedStream.readinto
+        """
+        compressed = compression.compress(self.data, 'gzip')
+        stream = compression.DecompressedStream(
+            io.BytesIO(compressed), 'gzip', chunk_size=7)
+        buffer = bytearray(len(self.data) + 10)
+        view = memoryview(buffer)
+        count = stream.readinto(view[:100])
+        count += stream.readinto(view[100:])
+        self.assertEqual(count, len(self.data))
+        self.assertEqual(bytes(buffer[:count]), self.data)
+        self.assertEqual(stream.readinto(view), 0)
+
+    def test_get_encoding(self):
+        """
+        test pyapi.utils.compression.get_encoding
+        """
+        self.assertEqual(compression.get_encoding(' GZip '), 'gzip')
+        for encoding in [None, 'br', 'identity']:
+            with self.assertRaises(ValueError):
+                compression.get_encoding(encoding)
+        with patch('pyapi.utils.compression.zstandard', None):
+            with self.assertRaises(ValueError):
+                compression.get_encoding('zstd')
+            self.assertTrue(compression.is_compressed('zstd'))
+            self.assertFalse('zstd' in compression.get_encodings())
+        for encoding in [None, '', 'identity', 'aws-chunked']:
+            self.assertFalse(compression.is_compressed(encoding))
+
+    def test_iter_compress(self):
+        """
+        test pyapi.utils.compression iter_compress and iter_decompress
+        """
+        chunks = [self.data[i:i + 100] for i in range(0, len(self.data), 100)]
+        for encoding in compression.get_encodings():
+            compressed = list(compression.iter_compress(chunks, encoding))
+            self.assertEqual(
+                b''.join(compression.iter_decompress(compressed, encoding)),
+                self.data)
+            self.assertEqual(
+                compression.decompress(b''.join(compressed), encoding),
+                self.data)
+        self.assertEqual(
+            b''.join(compression.iter_compress([u'a', b'b'], 'gzip')),
+            compression.compress(b'ab', 'gzip'))
@@ -0,0 +1,101 @@
+"""
+# test_utils_json_codec
+
+"""
+from __future__ import absolute_import
+
+import json
+import unittest
+
+from mock import MagicMock, patch
+from pyapi.utils import json_codec
+
+
+class TestJsonCodec(unittest.TestCase):
+    """
+    TestJsonCodec includes all unit tests for pyapi.utils.json_codec module
+    """
+
+    def setUp(self):
+        """
+        setup test
+        """
+        self.backend = json_codec.get_backend()
+        self.data = {'b': [1, 2.5, None, True], 'a': u'\xe9', 'c': {'d': 'e'}}
+
+    def tearDown(self):
+        """
+        tear down each test
+        """
+        json_codec.set_backend(self.backend)
+        print "\ndone: " + self.id()
+
+    def test_dumps_loads(self):
+        """
+        test pyapi.utils.json_codec dumps and loads on every backend
+        """
+        for name in json_codec.JSON_BACKENDS:
+            try:
+                json_codec.set_backend(name)
+            except ValueError:
+                continue  # not installed
+            text = json_codec.dumps(self.data, sort_keys=True)
+            self.assertEqual(text, json.dumps(self.data, sort_keys=True))
+            self.assertEqual(json_codec.dumps(float('nan')), 'NaN')
+            self.assertEqual(json_codec.loads(text), self.data)
+            text = json_codec.dumps(self.data, sort_keys=True, fast=True)
+            self.assertEqual(json_codec.loads(text), self.data)
+            self.assertEqual(json_codec.loads(text, fast=True), self.data)
+
+            # big integers and NaN are parsed as by stdlib json
+            big = 123456789012345678901234567890
+            self.assertEqual(json_codec.loads(str(big)), big)
+            self.assertEqual(json_codec.loads(b'[' + str(big).encode() + b']'),
+                             [big])
+            value = json_codec.loads('{"n": NaN}')['n']
+            self.assertTrue(value != value)
+            value = json_codec.loads('{"n": NaN}', fast=True)['n']
+            self.assertTrue(value != value)
+            with self.assertRaises(ValueError):
+                json_codec.loads('{"a": ', fast=True)
+            self.assertEqual(
+                json_codec.loads(text.encode('utf-8')), self.data)
+            self.assertEqual(
+                json_codec.dumps(self.data, sort_keys=True, indent=2),
+                json.dumps(self.data, sort_keys=True, indent=2))
+            with self.assertRaises(ValueError):
+                json_codec.loads('{"a": ')
+
+    def test_dumps_default(self):
+        """
+        test pyapi.utils.json_codec.dumps with a default function
+        """
+        result = json_codec.dumps({'s': set([1])}, default=list)
+        self.assertEqual(json_codec.loads(result), {'s': [1]})
+
+    def test_set_backend(self):
+        """
+        test pyapi.utils.json_codec.set_backend
+        """
+        self.assertEqual(json_codec.set_backend('json'), 'json')
+        self.assertEqual(json_codec.get_backend(), 'json')
+        with self.assertRaises(ValueError):
+            json_codec.set_backend('yaml')
+
+        with patch('pyapi.utils.json_codec._get_backend_module') as mock_get:
+            mock_module = MagicMock()
+            mock_get.side_effect = \
+                lambda name: mock_module if name == 'ujson' else None
+            self.assertEqual(json_codec.set_backend(), 'ujson')
+            with self.assertRaises(ValueError):
+                json_codec.set_backend('orjson')
+        mock_module.loads.return_value = {'b': 2}
+        self.assertEqual(json_codec.loads('{"a": 1}'), {'a': 1})
+        self.assertEqual(json_codec.loads('{"a": 1}', fast=True), {'b': 2})
+        mock_module.loads.side_effect = ValueError('NaN')
+        self.assertEqual(json_codec.loads('{"a": 1}', fast=True), {'a': 1})
+        mock_module.dumps.return_value = '{"a":1}'
+        self.assertEqual(json_codec.dumps({'a': 1}), '{"a": 1}')
+        self.assertFalse(mock_module.dumps.called)
+        self.assertEqual(json_codec.dumps({'a': 1}, fast=True), '{"a":1}')
+        mock_module.dumps.assert_called_with({'a': 1}, sort_keys=False)
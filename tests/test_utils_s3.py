@@ -7,12 +7,15 @@
 """
 from __future__ import absolute_import
 
+import io
+import os
 import unittest
 
 import pyapi.utils.s3 as s3
+import pyapi.utils.s3_retry as s3_retry
 
 from botocore.exceptions import ClientError
-from mock import Mock, MagicMock, patch
+from mock import ANY, Mock, MagicMock, patch
 
 
 class TestS3(unittest.TestCase):
@@ -29,7 +32,57 @@ class TestS3(unittest.TestCase):
             keys.append(prefix['Prefix'])
         return keys
 
+    def mock_list_objects_v2(self, keys, page_size=3):
+        """
+        mock s3 client list_objects_v2 (and its paginator) on a list of keys
+        """
+        keys = sorted(keys)
+
+        def list_objects_v2(**kwargs):
+            """get the first page per Prefix, StartAfter and Delimiter"""
+            pages = list(paginate(**kwargs))
+            page = dict(pages[0], IsTruncated=len(pages) > 1)
+            self.list_requests.append(kwargs)
+            return page
+
+        def paginate(**kwargs):
+            """yield pages per Prefix, StartAfter and Delimiter"""
+            prefix = kwargs.get('Prefix', '')
+            delimiter = kwargs.get('Delimiter')
+            after = kwargs.get('StartAfter', '')
+            contents, prefixes = [], []
+            for key in keys:
+                if not key.startswith(prefix) or key <= after:
+                    continue
+                pos = key.find(delimiter, len(prefix)) if delimiter else -1
+                if pos >= 0:
+                    common = key[:pos + len(delimiter)]
+                    if common not in prefixes:
+                        prefixes.append(common)
+                    continue
+                contents.append({
+                    'Key': key, 'Size': len(key), 'ETag': '"{}"'.format(key),
+                    'LastModified': 'modified-' + key})
+            for start in range(0, max(len(contents), 1), page_size):
+                page = {'Contents': contents[start:start + page_size]}
+                if start == 0 and prefixes:
+                    page['CommonPrefixes'] = [{'Prefix': p} for p in prefixes]
+                yield page
+
+        self.list_requests = []
+        self.mock_client.list_objects_v2.side_effect = list_objects_v2
+        paginator = MagicMock()
+        paginator.paginate.side_effect = paginate
+        self.mock_client.get_paginator.side_effect = lambda name: (
+            paginator if name == 'list_objects_v2' else self.mock_paginator)
+        return paginator
+
     def setUp(self):
+        s3.reset_clients()
+        s3.invalidate_key()
+        # retry transient errors (e.g. self.mock_client_err) without delay
+        self.retry_policy = s3.set_retry_policy(
+            s3_retry.RetryPolicy(max_attempts=3, base_delay=0))
         self.mock_doFunc = MagicMock()
         self.mock_iterator = MagicMock()
         self.mock_paginator = MagicMock()
@@ -148,6 +201,7 @@ class TestS3(unittest.TestCase):
         self.mock_new_path = "dir2/new_path"
 
     def tearDown(self):
+        s3.set_retry_policy(self.retry_policy)
         print "\ndone: " + self.id()
 
     @classmethod
@@ -218,13 +272,16 @@ class TestS3(unittest.TestCase):
             self.assertEqual(
                 result, expr1, "Failed on test: {}".format(str(test)))
 
-    @patch('pyapi.utils.s3.get_key')
-    def test_check_key(self, mock_get_key):
+    @patch('pyapi.utils.s3.head_key')
+    def test_check_key(self, mock_head_key):
         """
         test pyapi.utils.s3.check_key
         """
-        s3.check_key('abc', 'xyz')
-        mock_get_key.assert_called_with('abc', 'xyz')
+        mock_head_key.return_value = {'ContentLength': 1}
+        self.assertTrue(s3.check_key('abc', 'xyz'))
+        mock_head_key.assert_called_with('abc', 'xyz')
+        mock_head_key.return_value = None
+        self.assertFalse(s3.check_key('abc', 'xyz'))
 
     @patch('pyapi.utils.s3.boto3_session')
     def test_check_prefix(self, mock_boto3):
@@ -243,11 +300,18 @@ class TestS3(unittest.TestCase):
         """
         mock_boto3.Session.return_value = self.mock_session
         for size in [-1, 0, 1, 99, 65535]:
-            self.mock_client.get_object.return_value = {'ContentLength': size}
+            s3.invalidate_key()
+            self.mock_client.head_object.return_value = {'ContentLength': size}
             result = s3.check_size('prefix/123/key', 'bucket-xyz')
-            self.mock_client.get_object.assert_called_with(
+            self.mock_client.head_object.assert_called_with(
                 Bucket='bucket-xyz', Key='prefix/123/key')
             self.assertEqual(result, size > 0)
+        self.assertEqual(self.mock_client.get_object.call_count, 0)
+
+        s3.invalidate_key()
+        self.mock_client.head_object.side_effect = ClientError(
+            {'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        self.assertFalse(s3.check_size('prefix/123/key', 'bucket-xyz'))
 
     @patch('pyapi.utils.s3.boto3_session')
     def test_check_size_exception(self, mock_boto3):
@@ -255,9 +319,9 @@ class TestS3(unittest.TestCase):
         test pyapi.utils.s3.check_size on exception
         """
         mock_boto3.Session.return_value = self.mock_session
-        self.mock_client.get_object.side_effect = self.mock_client_err
+        self.mock_client.head_object.side_effect = self.mock_client_err
         result = s3.check_size('prefix/123', 'bucket-xyz')
-        self.mock_client.get_object.assert_called_with(
+        self.mock_client.head_object.assert_called_with(
             Bucket='bucket-xyz', Key='prefix/123')
         self.assertFalse(result)
 
@@ -280,32 +344,66 @@ class TestS3(unittest.TestCase):
             self.assertEqual(result, test['result'])
 
     @patch('pyapi.utils.s3.boto3_session')
-    @patch('pyapi.utils.s3.get_key')
-    def test_copy_contents_to_bucket(self, mock_get_key, mock_boto3):
+    def test_copy_contents_to_bucket(self, mock_boto3):
         """
         test pyapi.utils.s3.copy_contents_to_bucket
         """
         mock_boto3.Session.return_value = self.mock_session
         contents, key_name, bucket = "contents", "some/s3/key", self.bucket
 
-        mock_get_key.return_value = None
         result = s3.copy_contents_to_bucket(contents, key_name, bucket)
+        self.assertEqual(self.mock_client.head_object.call_count, 0)
         self.assertEqual(self.mock_client.delete_object.call_count, 0)
         self.mock_client.put_object.assert_called_with(
             Body=contents, Bucket=bucket, Key=key_name)
         self.assertEqual(result, self.mock_s3_put_return)
 
-        mock_get_key.return_value = {}
-        result = s3.copy_contents_to_bucket(contents, key_name, bucket)
-        self.assertEqual(self.mock_client.delete_object.call_count, 1)
-        self.mock_client.put_object.assert_called_with(
-            Body=contents, Bucket=bucket, Key=key_name)
-        self.assertEqual(result, self.mock_s3_put_return)
-
         self.mock_client.put_object.side_effect = self.mock_exception
         result = s3.copy_contents_to_bucket(contents, key_name, bucket)
         self.assertIsNone(result)
 
+    @patch('pyapi.utils.s3.COPY_PART_SIZE', 4)
+    @patch('pyapi.utils.s3.COPY_SIZE_MAX', 5)
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_copy_key(self, mock_boto3):
+        """
+        test pyapi.utils.s3.copy_key by single and multipart copy
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        source = {'Bucket': self.bucket, 'Key': 'src'}
+        self.mock_client.copy_object.return_value = 'copied'
+        self.mock_client.head_object.return_value = {'ContentLength': 5}
+        result = s3.copy_key('src', 'dst', self.bucket, 'bucket2')
+        self.assertEqual(result, 'copied')
+        self.mock_client.copy_object.assert_called_with(
+            Bucket='bucket2', CopySource=source, Key='dst')
+
+        self.mock_client.create_multipart_upload.return_value = {
+            'UploadId': 'id'}
+        self.mock_client.upload_part_copy.side_effect = lambda **kw: {
+            'CopyPartResult': {'ETag': 'e{}'.format(kw['PartNumber'])}}
+        self.mock_client.complete_multipart_upload.return_value = 'done'
+        result = s3.copy_key('src', 'dst', self.bucket, size=10)
+        self.assertEqual(result, 'done')
+        self.assertEqual(self.mock_client.copy_object.call_count, 1)
+        self.assertEqual(
+            sorted((c[1]['PartNumber'], c[1]['CopySourceRange'])
+                   for c in self.mock_client.upload_part_copy.call_args_list),
+            [(1, 'bytes=0-3'), (2, 'bytes=4-7'), (3, 'bytes=8-9')])
+        self.mock_client.complete_multipart_upload.assert_called_with(
+            Bucket=self.bucket, Key='dst', UploadId='id',
+            MultipartUpload={'Parts': [
+                {'ETag': 'e1', 'PartNumber': 1},
+                {'ETag': 'e2', 'PartNumber': 2},
+                {'ETag': 'e3', 'PartNumber': 3},
+            ]})
+
+        self.mock_client.upload_part_copy.side_effect = self.mock_client_err
+        with self.assertRaises(ClientError):
+            s3.copy_key('src', 'dst', self.bucket, size=10)
+        self.mock_client.abort_multipart_upload.assert_called_with(
+            Bucket=self.bucket, Key='dst', UploadId='id')
+
     @patch('pyapi.utils.s3.boto3_session')
     @patch('os.path.isfile')
     def test_copy_to_bucket(self, mock_isfile, mock_boto3):
@@ -348,7 +446,7 @@ class TestS3(unittest.TestCase):
         mock_boto3.Session.return_value = self.mock_session
         contents, key_name, bucket = "contents", "some/s3/key", self.bucket
         result = s3.create_key(contents, key_name, bucket)
-        self.mock_session.client.assert_called_with('s3')
+        self.assertEqual(self.mock_session.client.call_args[0], ('s3',))
         self.mock_client.put_object.assert_called_with(
             Body=contents, Bucket=bucket, Key=key_name)
         self.assertEqual(result, self.mock_s3_put_return)
@@ -394,6 +492,357 @@ class TestS3(unittest.TestCase):
         result = s3.delete_key(key_name, bucket)
         self.assertEqual(result, False)
 
+    @patch('pyapi.utils.s3.DELETE_BATCH_SIZE', 2)
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_delete_keys(self, mock_boto3):
+        """
+        test pyapi.utils.s3.delete_keys in batches
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        keys = ['k1', {'Key': 'k2'}, 'k3', 'k4', 'k5']
+
+        def delete_objects(**kwargs):
+            """fail on k4 and the batch of k5"""
+            objects = kwargs['Delete']['Objects']
+            self.assertTrue(kwargs['Delete']['Quiet'])
+            if {'Key': 'k5'} in objects:
+                raise self.mock_client_err
+            return {'Errors': [
+                {'Key': o['Key'], 'Code': 'AccessDenied', 'Message': 'denied'}
+                for o in objects if o['Key'] == 'k4']}
+
+        self.mock_client.delete_objects.side_effect = delete_objects
+        result = s3.delete_keys(iter(keys), self.bucket, workers=2)
+        # the batch of k5 is attempted 3 times (see setUp)
+        self.assertEqual(self.mock_client.delete_objects.call_count, 5)
+        self.mock_client.delete_objects.assert_any_call(
+            Bucket=self.bucket,
+            Delete={'Objects': [{'Key': 'k1'}, {'Key': 'k2'}], 'Quiet': True})
+        self.assertEqual(result['deleted'], 3)
+        self.assertEqual(
+            sorted((e['Key'], e['Code']) for e in result['errors']),
+            [('k4', 'AccessDenied'), ('k5', '500')])
+
+    @patch('pyapi.utils.s3.time')
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_delete_keys_retry(self, mock_boto3, mock_time):
+        """
+        test pyapi.utils.s3.delete_keys retrying throttled keys
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        responses = [
+            {'Errors': [
+                {'Key': 'k1', 'Code': 'SlowDown', 'Message': 'slow down'},
+                {'Key': 'k2', 'Code': 'AccessDenied', 'Message': 'denied'}]},
+            {},
+        ]
+        self.mock_client.delete_objects.side_effect = responses
+        result = s3.delete_keys(['k1', 'k2', 'k3'], self.bucket)
+        self.mock_client.delete_objects.assert_called_with(
+            Bucket=self.bucket,
+            Delete={'Objects': [{'Key': 'k1'}], 'Quiet': True})
+        self.assertEqual(mock_time.sleep.call_count, 1)
+        self.assertEqual(result['deleted'], 2)
+        self.assertEqual([e['Key'] for e in result['errors']], ['k2'])
+
+    @patch('pyapi.utils.s3_retry.time')
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_get_content_retry(self, mock_boto3, mock_time):
+        """
+        test pyapi.utils.s3.get_content retrying on throttling
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        slow_down = ClientError(
+            {'Error': {'Code': 'SlowDown', 'Message': 'Reduce rate'}}, 'Get')
+        body = MagicMock()
+        body.read.return_value = b'data'
+        self.mock_client.get_object.side_effect = [
+            slow_down, dict(Body=body, ContentLength=4)]
+        self.assertEqual(s3.get_content('k', self.bucket), b'data')
+        self.assertEqual(self.mock_client.get_object.call_count, 2)
+
+        self.mock_client.get_object.side_effect = slow_down
+        with patch('pyapi.utils.s3.LOGGER') as mock_logger:
+            self.assertEqual(s3.get_content('k', self.bucket), None)
+            self.assertEqual(mock_logger.warning.call_count, 1)
+        self.assertEqual(self.mock_client.get_object.call_count, 5)
+
+    def test_call_with_retry(self):
+        """
+        test pyapi.utils.s3.call_with_retry by the shared retry policy
+        """
+        slow_down = ClientError(
+            {'Error': {'Code': 'SlowDown', 'Message': 'Reduce rate'}}, 'Get')
+        a_func = MagicMock(side_effect=[slow_down, {'ok': 1}])
+        self.assertEqual(s3.call_with_retry(a_func, Key='k'), {'ok': 1})
+        a_func.assert_called_with(Key='k')
+        self.assertEqual(a_func.call_count, 2)
+
+        a_func = MagicMock(side_effect=ValueError('not retryable'))
+        self.assertRaises(ValueError, s3.call_with_retry, a_func)
+        self.assertEqual(a_func.call_count, 1)
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_delete_prefix(self, mock_boto3):
+        """
+        test pyapi.utils.s3.delete_prefix
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        self.mock_iterator.search.return_value = [
+            {'Key': 'more/k1'}, None, {'Key': 'more/k2'}]
+        self.mock_client.delete_objects.return_value = {}
+        result = s3.delete_prefix('more/', self.bucket)
+        self.mock_client.get_paginator.assert_called_with('list_objects_v2')
+        self.mock_paginator.paginate.assert_called_with(
+            Bucket=self.bucket, Prefix='more/')
+        self.mock_client.delete_objects.assert_called_once_with(
+            Bucket=self.bucket, Delete={
+                'Objects': [{'Key': 'more/k1'}, {'Key': 'more/k2'}],
+                'Quiet': True})
+        self.assertEqual(result, {'deleted': 2, 'errors': []})
+
+        with self.assertRaises(ValueError):
+            s3.delete_prefix('', self.bucket)
+
+    def mock_get_range(self, contents):
+        """
+        mock s3 client get_object with Range parameter on contents
+        """
+        def get_object(**kwargs):
+            """get a byte range of contents"""
+            start, end = kwargs['Range'][len('bytes='):].split('-')
+            body = io.BytesIO(contents[int(start):int(end) + 1])
+            return {'Body': body, 'ContentLength': len(body.getvalue())}
+
+        self.mock_client.head_object.return_value = {
+            'ContentLength': len(contents), 'ETag': '"etag"'}
+        self.mock_client.get_object.side_effect = get_object
+
+    def test_buffer_pool(self):
+        """
+        test pyapi.utils.s3.BufferPool
+        """
+        pool = s3.BufferPool(16, max_buffers=1)
+        with pool.buffer() as buffer:
+            self.assertEqual(len(buffer), 16)
+            first = buffer
+        self.assertTrue(pool.acquire() is first)
+        second = pool.acquire()
+        self.assertFalse(second is first)
+        pool.release(first)
+        pool.release(second)  # pool is full
+        pool.release(bytearray(8))  # not of the pool size
+        self.assertTrue(pool.acquire() is first)
+        self.assertFalse(pool.acquire() is second)
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_download_to_fd(self, mock_boto3):
+        """
+        test pyapi.utils.s3.download_to_fd
+        """
+        import tempfile
+        from pyapi.utils import compression
+        mock_boto3.Session.return_value = self.mock_session
+        contents = b'0123456789' * 10
+        self.mock_client.get_object.side_effect = lambda **kwargs: dict(
+            Body=io.BytesIO(contents), ContentLength=len(contents))
+        with tempfile.TemporaryFile() as file_obj:
+            file_obj.write(b'>')
+            self.assertEqual(s3.download_to_fd(
+                'k', file_obj, self.bucket, chunk_size=7), 100)
+            file_obj.seek(0)
+            self.assertEqual(file_obj.read(), b'>' + contents)
+
+            with self.assertRaises(ValueError):
+                s3.download_to_fd('k', file_obj.fileno(), max_size=99)
+
+            compressed = compression.compress(contents, 'gzip')
+            self.mock_client.get_object.side_effect = lambda **kwargs: dict(
+                Body=io.BytesIO(compressed), ContentLength=len(compressed),
+                ContentEncoding='gzip')
+            file_obj.seek(0)
+            file_obj.truncate()
+            self.assertEqual(s3.download_to_fd('k', file_obj), 100)
+            file_obj.seek(0)
+            self.assertEqual(file_obj.read(), contents)
+            with self.assertRaises(ValueError):
+                s3.download_to_fd('k', file_obj, max_size=50, chunk_size=8)
+
+        self.mock_client.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchKey', 'Message': ''}}, 'GetObject')
+        self.assertEqual(s3.download_to_fd('k', 1), None)
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_get_contents_many(self, mock_boto3):
+        """
+        test pyapi.utils.s3.get_contents_many and get_json_many
+        """
+        import threading
+        mock_boto3.Session.return_value = self.mock_session
+        lock = threading.Lock()
+        in_flight = {'bytes': 0, 'max': 0}
+        contents = dict(('k{}'.format(i), b'{"i": %d}' % i) for i in range(20))
+        contents['bad'] = b'{bad'
+
+        def get_object(Bucket, Key):
+            """get an object, tracking bytes in flight"""
+            if Key not in contents:
+                raise ClientError(
+                    {'Error': {'Code': 'NoSuchKey', 'Message': ''}},
+                    'GetObject')
+            body = MagicMock()
+            body.read.return_value = contents[Key]
+            return dict(Body=body, ContentLength=len(contents[Key]))
+
+        def consume(data):
+            """consume a result"""
+            with lock:
+                in_flight['bytes'] -= len(data)
+            return data
+
+        self.mock_client.get_object.side_effect = get_object
+        keys = ['k{}'.format(i) for i in range(20)]
+        results = dict(s3.get_contents_many(
+            iter(keys + ['missing']), self.bucket, workers=4, max_bytes=24))
+        self.assertEqual(sorted(results), sorted(keys + ['missing']))
+        self.assertEqual(results['k7'], b'{"i": 7}')
+        self.assertTrue(isinstance(results['missing'], ClientError))
+
+        # bytes in flight are capped until consumed
+        real_acquire = s3._ByteBudget.acquire
+
+        def acquire(budget, size):
+            """acquire budget, tracking bytes in flight"""
+            real_acquire(budget, size)
+            with lock:
+                in_flight['bytes'] += size
+                in_flight['max'] = max(in_flight['max'], in_flight['bytes'])
+
+        with patch.object(s3._ByteBudget, 'acquire', acquire):
+            results = [consume(data) for _, data in s3.get_contents_many(
+                keys, self.bucket, workers=8, max_bytes=24)]
+        self.assertEqual(len(results), 20)
+        self.assertTrue(in_flight['max'] <= 24)
+
+        results = dict(s3.get_json_many(['k1', 'k2', 'bad'], self.bucket))
+        self.assertEqual((results['k1'], results['k2']), ({'i': 1}, {'i': 2}))
+        self.assertTrue(isinstance(results['bad'], ValueError))
+
+        # breaking out early does not hang on fetches waiting for budget
+        for i in range(50):
+            contents['big{}'.format(i)] = b'x' * 100
+
+        def break_early(use_cache):
+            """consume the first result only, and close the generator"""
+            gen = s3.get_contents_many(
+                ['big{}'.format(i) for i in range(50)], self.bucket,
+                workers=8, max_bytes=250, use_cache=use_cache)
+            for _ in gen:
+                break
+            gen.close()
+
+        for use_cache in (False, True):
+            thread = threading.Thread(target=break_early, args=(use_cache,))
+            thread.daemon = True
+            thread.start()
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_get_content_into(self, mock_boto3):
+        """
+        test pyapi.utils.s3.get_content_into
+        """
+        from pyapi.utils import compression
+        mock_boto3.Session.return_value = self.mock_session
+        contents = b'{"key": "value"}'
+        self.mock_client.get_object.side_effect = lambda **kwargs: dict(
+            Body=io.BytesIO(contents), ContentLength=len(contents))
+        view = s3.get_content_into('k', self.bucket)
+        self.assertEqual(view.tobytes(), contents)
+        self.mock_client.get_object.assert_called_with(
+            Bucket=self.bucket, Key='k')
+
+        # into a pooled buffer, no larger than the buffer
+        pool = s3.BufferPool(32)
+        with pool.buffer() as buffer:
+            view = s3.get_content_into('k', self.bucket, buffer)
+            self.assertEqual(view.tobytes(), contents)
+            self.assertEqual(bytes(buffer[:len(contents)]), contents)
+        with self.assertRaises(ValueError):
+            s3.get_content_into('k', self.bucket, bytearray(8))
+        with self.assertRaises(ValueError):
+            s3.get_content_into('k', self.bucket, max_size=8)
+
+        # decompressed, with or without buffer
+        compressed = compression.compress(contents * 4, 'gzip')
+        self.mock_client.get_object.side_effect = lambda **kwargs: dict(
+            Body=io.BytesIO(compressed), ContentLength=len(compressed),
+            ContentEncoding='gzip')
+        self.assertEqual(
+            s3.get_content_into('k', self.bucket).tobytes(), contents * 4)
+        self.assertEqual(
+            s3.get_content_into('k', self.bucket, bytearray(100)).tobytes(),
+            contents * 4)
+        with self.assertRaises(ValueError):
+            s3.get_content_into('k', self.bucket, bytearray(50))
+        with self.assertRaises(ValueError):
+            s3.get_content_into('k', self.bucket, max_size=50)
+
+        self.mock_client.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchKey', 'Message': ''}}, 'GetObject')
+        self.assertEqual(s3.get_content_into('k', self.bucket), None)
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_download_to_mmap(self, mock_boto3):
+        """
+        test pyapi.utils.s3.download_to_mmap
+        """
+        import os
+        import tempfile
+        mock_boto3.Session.return_value = self.mock_session
+        contents = b'0123456789abcdefghij'
+        self.mock_get_range(contents)
+
+        result = s3.download_to_mmap('k', self.bucket, part_size=3, workers=3)
+        self.assertEqual(result[:], contents)
+        self.assertEqual(self.mock_client.get_object.call_count, 7)
+        self.mock_client.get_object.assert_any_call(
+            Bucket=self.bucket, Key='k', Range='bytes=18-19', IfMatch='"etag"')
+        result.close()
+
+        temp_dir = tempfile.mkdtemp()
+        filename = os.path.join(temp_dir, 'k.data')
+        result = s3.download_to_mmap('k', self.bucket, filename=filename)
+        result.close()
+        with open(filename, 'rb') as data_file:
+            self.assertEqual(data_file.read(), contents)
+        os.remove(filename)
+        os.rmdir(temp_dir)
+
+        self.mock_client.head_object.return_value = {'ContentLength': 0}
+        self.assertEqual(s3.download_to_mmap('k', self.bucket), b'')
+        self.mock_client.head_object.side_effect = ClientError(
+            {'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        self.assertIsNone(s3.download_to_mmap('none', self.bucket))
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_download_to_mmap_exception(self, mock_boto3):
+        """
+        test pyapi.utils.s3.download_to_mmap on exception
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        self.mock_get_range(b'0123456789')
+        self.mock_client.get_object.side_effect = self.mock_client_err
+        with self.assertRaises(ClientError):
+            s3.download_to_mmap('k', self.bucket, part_size=2)
+
+        # short read of a range
+        self.mock_client.get_object.side_effect = None
+        self.mock_client.get_object.return_value = {'Body': io.BytesIO(b'0')}
+        with self.assertRaises(IOError):
+            s3.download_to_mmap('k', self.bucket, part_size=20)
+
     @patch('pyapi.utils.s3.boto3_session')
     def test_get_client(self, mock_boto3):
         """
@@ -401,9 +850,93 @@ class TestS3(unittest.TestCase):
         """
         mock_boto3.Session.return_value = self.mock_session
         result = s3.get_client()
-        self.mock_session.client.assert_called_with('s3')
+        self.assertEqual(self.mock_session.client.call_args[0], ('s3',))
         self.assertEqual(result, self.mock_client)
 
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_get_client_pooled(self, mock_boto3):
+        """
+        test pyapi.utils.s3.get_client reusing pooled client
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        result1 = s3.get_client()
+        result2 = s3.get_client()
+        self.assertEqual(result1, result2)
+        self.assertEqual(mock_boto3.Session.call_count, 1)
+        self.assertEqual(self.mock_session.client.call_count, 1)
+        config = self.mock_session.client.call_args[1]['config']
+        self.assertEqual(config.max_pool_connections, s3.MAX_POOL_CONNECTIONS)
+
+        s3.get_client(region_name='eu-west-1', max_pool_connections=7)
+        self.assertEqual(self.mock_session.client.call_count, 2)
+        mock_boto3.Session.assert_called_with(region_name='eu-west-1')
+        config = self.mock_session.client.call_args[1]['config']
+        self.assertEqual(config.max_pool_connections, 7)
+
+        s3.reset_clients()
+        s3.get_client()
+        self.assertEqual(self.mock_session.client.call_count, 3)
+
+    def test_get_client_retries(self):
+        """
+        test pyapi.utils.s3.get_client retrying only by the retry policy
+        """
+        from botocore.awsrequest import AWSResponse
+        attempts = []
+
+        def send(**kwargs):
+            """respond to every request by a throttling error"""
+            attempts.append(kwargs['request'].url)
+            raw = MagicMock()
+            raw.stream.return_value = [
+                b'<Error><Code>SlowDown</Code><Message></Message></Error>']
+            return AWSResponse(kwargs['request'].url, 503, {}, raw)
+
+        s3.reset_clients()
+        client = s3.get_client(
+            region_name='us-east-1', aws_access_key_id='testing',
+            aws_secret_access_key='testing',
+            endpoint_url='http://localhost:1')
+        client.meta.events.register('before-send.s3', send)
+        with self.assertRaises(ClientError):
+            s3.call_with_retry(client.get_object, Bucket='b', Key='k')
+        self.assertEqual(len(attempts), 3)  # by RetryPolicy(max_attempts=3)
+        s3.reset_clients()
+
+    @patch.dict('os.environ', {'S3_ENDPOINT_URL': 'http://localhost:5000'})
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_get_client_endpoint(self, mock_boto3):
+        """
+        test pyapi.utils.s3.get_client with endpoint url from environment
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        s3.reset_clients()
+        s3.get_client()
+        self.assertEqual(
+            self.mock_session.client.call_args[1]['endpoint_url'],
+            'http://localhost:5000')
+        s3.get_client(endpoint_url='http://localhost:9000')
+        self.assertEqual(
+            self.mock_session.client.call_args[1]['endpoint_url'],
+            'http://localhost:9000')
+        s3.reset_clients()
+
+    @patch('pyapi.utils.s3.os.getpid')
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_get_client_forked(self, mock_boto3, mock_getpid):
+        """
+        test pyapi.utils.s3.get_client dropping pooled client after fork
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        mock_getpid.return_value = 1001
+        s3.reset_clients()
+        s3.get_client()
+        s3.get_client()
+        self.assertEqual(self.mock_session.client.call_count, 1)
+        mock_getpid.return_value = 1002
+        s3.get_client()
+        self.assertEqual(self.mock_session.client.call_count, 2)
+
     @patch('pyapi.utils.s3.boto3_session')
     def test_get_resource(self, mock_boto3):
         """
@@ -411,8 +944,10 @@ class TestS3(unittest.TestCase):
         """
         mock_boto3.Session.return_value = self.mock_session
         result = s3.get_resource()
-        self.mock_session.resource.assert_called_with('s3')
+        self.assertEqual(self.mock_session.resource.call_args[0], ('s3',))
         self.assertEqual(result, self.mock_s3)
+        self.assertEqual(s3.get_resource(), result)
+        self.assertEqual(self.mock_session.resource.call_count, 1)
 
     @patch('pyapi.utils.s3.boto3_session')
     def test_get_content(self, mock_boto3):
@@ -432,6 +967,53 @@ class TestS3(unittest.TestCase):
                 Bucket=bucket, Key=key_name)
             self.assertEqual(result, content)
 
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_get_content_cached(self, mock_boto3):
+        """
+        test pyapi.utils.s3.get_content with a content cache
+        """
+        import shutil
+        import tempfile
+        from pyapi.utils.s3_cache import S3ContentCache
+        key_name, bucket = "some/s3/keyname", "s3_bucket"
+        mock_boto3.Session.return_value = self.mock_session
+        not_modified = ClientError(
+            {'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        temp_dir = tempfile.mkdtemp()
+        s3.set_content_cache(S3ContentCache(temp_dir, 1024))
+        try:
+            body = MagicMock()
+            body.read.return_value = b'{"key": "value"}'
+            self.mock_client.get_object.return_value = dict(
+                Body=body, ContentLength=16, ETag='"v1"')
+            self.assertEqual(
+                s3.get_content(key_name, bucket), b'{"key": "value"}')
+            self.mock_client.get_object.assert_called_with(
+                Bucket=bucket, Key=key_name)
+
+            # revalidated by ETag, not modified
+            self.mock_client.get_object.side_effect = not_modified
+            self.assertEqual(
+                s3.get_json_data(key_name, bucket), {'key': 'value'})
+            self.mock_client.get_object.assert_called_with(
+                Bucket=bucket, Key=key_name, IfNoneMatch='"v1"')
+            self.assertEqual(body.read.call_count, 1)
+
+            # bypass the cache
+            self.mock_client.get_object.side_effect = None
+            s3.get_content(key_name, bucket, use_cache=False)
+            self.mock_client.get_object.assert_called_with(
+                Bucket=bucket, Key=key_name)
+
+            # missing key is removed from the cache
+            self.mock_client.get_object.side_effect = ClientError(
+                {'Error': {'Code': 'NoSuchKey', 'Message': ''}}, 'GetObject')
+            self.assertEqual(s3.get_content(key_name, bucket), None)
+            self.assertEqual(s3._CONTENT_CACHE.get(bucket, key_name), None)
+        finally:
+            s3.set_content_cache(None)
+            shutil.rmtree(temp_dir)
+
     @patch('pyapi.utils.s3.boto3_session')
     def test_get_content_exception(self, mock_boto3):
         """
@@ -497,11 +1079,21 @@ class TestS3(unittest.TestCase):
         key_name = 'some/key'
         mock_boto3.Session.return_value = self.mock_session
         mock_object = Mock(key=key_name)  # mock an object property
-        self.mock_s3_bucket.objects.filter.return_value = [mock_object]
+        self.mock_s3.ObjectSummary.return_value = mock_object
+        self.mock_client.head_object.return_value = {
+            'ContentLength': 3, 'ETag': '"abc"', 'LastModified': 'now'}
         key = s3.get_key(key_name, 'bucket')
-        self.mock_s3.Bucket.assert_called_with('bucket')
-        self.mock_s3_bucket.objects.filter.assert_called_with(Prefix=key_name)
+        self.mock_s3.ObjectSummary.assert_called_with('bucket', key_name)
+        self.mock_client.head_object.assert_called_with(
+            Bucket='bucket', Key=key_name)
         self.assertEqual(key, mock_object)
+        self.assertEqual(key.meta.data['Size'], 3)
+        self.assertEqual(key.meta.data['LastModified'], 'now')
+        self.assertEqual(self.mock_s3_bucket.objects.filter.call_count, 0)
+
+        self.mock_client.head_object.side_effect = ClientError(
+            {'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        self.assertIsNone(s3.get_key('missing/key', 'bucket'))
 
     @patch('pyapi.utils.s3.boto3_session')
     @patch('pyapi.utils.s3.check_bucket')
@@ -522,23 +1114,282 @@ class TestS3(unittest.TestCase):
         self.assertEqual(len(result), len(self.mock_prefix_test_json))
         self.assertEqual(result, keys)
 
-    @patch('pyapi.utils.s3.get_content')
-    def test_get_parquet_data(self, mock_get_content):
+    @patch('pyapi.utils.s3.get_stream')
+    def test_get_parquet_data(self, mock_get_stream):
         """
         test pyapi.utils.s3.get_json_data
         """
         key_name, bucket = "part-", "b"
-        contents = '''
+        contents = b'''
         {"prop1": "value1"}
         {"prop2": "value2"}
         {"prop3": "value3"}
         '''
-        mock_get_content.return_value = contents
+        mock_get_stream.return_value = io.BytesIO(contents)
         result = s3.get_parquet_data(key_name, bucket)
+        mock_get_stream.assert_called_with(key_name, bucket)
         self.assertEqual(result[0]['prop1'], 'value1')
         self.assertEqual(result[1]['prop2'], 'value2')
         self.assertEqual(result[2]['prop3'], 'value3')
 
+        for contents in [b'', b'{"prop1": "value1",}']:
+            mock_get_stream.return_value = io.BytesIO(contents)
+            self.assertIsNone(s3.get_parquet_data(key_name, bucket))
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_get_stream(self, mock_boto3):
+        """
+        test pyapi.utils.s3.get_stream
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        mock_body = MagicMock()
+        self.mock_client.get_object.return_value = {'Body': mock_body}
+        result = s3.get_stream('k', self.bucket)
+        self.mock_client.get_object.assert_called_with(
+            Bucket=self.bucket, Key='k')
+        self.assertEqual(result, mock_body)
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_get_stream_compressed(self, mock_boto3):
+        """
+        test pyapi.utils.s3.get_stream and get_content on a gzip object
+        """
+        import gzip
+        mock_boto3.Session.return_value = self.mock_session
+        contents = b'{"a": 1}\n{"b": 2}\n'
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as gz_file:
+            gz_file.write(contents)
+        data = buf.getvalue()
+
+        def get_object(**kwargs):
+            """return a gzip object"""
+            return {'Body': io.BytesIO(data), 'ContentLength': len(data),
+                    'ContentEncoding': 'gzip'}
+        self.mock_client.get_object.side_effect = get_object
+        self.assertEqual(s3.get_stream('k', self.bucket).read(), contents)
+        self.assertEqual(
+            s3.get_stream('k', self.bucket, decompress=False).read(), data)
+        self.assertEqual(s3.get_content('k', self.bucket), contents)
+        self.assertEqual(
+            list(s3.iter_json_lines('k', self.bucket, chunk_size=4)),
+            [{'a': 1}, {'b': 2}])
+
+    def test_iter_lines(self):
+        """
+        test pyapi.utils.s3._iter_lines across chunks
+        """
+        tests = [
+            (b'', []),
+            (b'abc', [b'abc']),
+            (b'a\nbc\n', [b'a', b'bc']),
+            (b'long-line\n\nx\r\nyz', [b'long-line', b'', b'x\r', b'yz']),
+        ]
+        for data, expected in tests:
+            for chunk_size in [1, 2, 3, 100]:
+                result = list(s3._iter_lines(io.BytesIO(data), chunk_size))
+                self.assertEqual(result, expected)
+
+    def test_iter_parts(self):
+        """
+        test pyapi.utils.s3._iter_parts of sources across chunks
+        """
+        tests = [
+            (b'', []),
+            (b'0123456789', [b'0123', b'4567', b'89']),
+            (u'01234567', [b'0123', b'4567']),
+            (iter([b'01', b'234567', u'8', b'9']), [b'0123', b'4567', b'89']),
+            (io.BytesIO(b'0123456'), [b'0123', b'456']),
+        ]
+        for source, expected in tests:
+            self.assertEqual(list(s3._iter_parts(source, 4)), expected)
+
+    @patch('pyapi.utils.s3.get_stream')
+    def test_iter_json_lines(self, mock_get_stream):
+        """
+        test pyapi.utils.s3.iter_json_lines
+        """
+        contents = b'{"a": 1}\r\n\n{"b": 2}\n{"c": "\xc3\xa9"}\n{"d": 4}'
+        mock_body = MagicMock(wraps=io.BytesIO(contents))
+        mock_get_stream.return_value = mock_body
+        result = list(s3.iter_json_lines('k', 'b', chunk_size=5))
+        self.assertEqual(
+            result, [{'a': 1}, {'b': 2}, {'c': u'\xe9'}, {'d': 4}])
+        mock_body.close.assert_called_once_with()
+
+        mock_get_stream.return_value = io.BytesIO(contents)
+        result = list(s3.iter_json_lines('k', 'b', batch_size=3))
+        self.assertEqual(
+            result, [[{'a': 1}, {'b': 2}, {'c': u'\xe9'}], [{'d': 4}]])
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_head_key(self, mock_boto3):
+        """
+        test pyapi.utils.s3.head_key with metadata cache
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        meta = {'ContentLength': 3, 'ETag': '"abc"', 'ResponseMetadata': {}}
+        self.mock_client.head_object.return_value = meta
+        result = s3.head_key('k', self.bucket)
+        self.assertEqual(result, {'ContentLength': 3, 'ETag': '"abc"'})
+        self.assertEqual(s3.head_key('k', self.bucket), result)
+        self.assertEqual(self.mock_client.head_object.call_count, 1)
+        s3.head_key('k', self.bucket, use_cache=False)
+        self.assertEqual(self.mock_client.head_object.call_count, 2)
+
+        # writes invalidate the cached key
+        s3.create_key('contents', 'k', self.bucket)
+        s3.head_key('k', self.bucket)
+        self.assertEqual(self.mock_client.head_object.call_count, 3)
+        s3.delete_key('k', self.bucket)
+        s3.head_key('k', self.bucket)
+        self.assertEqual(self.mock_client.head_object.call_count, 4)
+
+        # negative entry
+        self.mock_client.head_object.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'Head')
+        self.assertIsNone(s3.head_key('none', self.bucket))
+        self.assertIsNone(s3.head_key('none', self.bucket))
+        self.assertEqual(self.mock_client.head_object.call_count, 5)
+
+        # other errors are not cached
+        self.mock_client.head_object.side_effect = self.mock_client_err
+        with self.assertRaises(ClientError):
+            s3.head_key('err', self.bucket)
+        with self.assertRaises(ClientError):
+            s3.head_key('err', self.bucket)
+
+    @patch('pyapi.utils.s3.time')
+    def test_key_cache(self, mock_time):
+        """
+        test pyapi.utils.s3._KeyCache for LRU and TTL
+        """
+        mock_time.time.return_value = 1000
+        cache = s3._KeyCache(maxsize=2, ttl=60, ttl_missing=10)
+        cache.set('a', {'ETag': 'a'})
+        cache.set('b', None)
+        self.assertEqual(cache.get('a'), (True, {'ETag': 'a'}))
+        self.assertEqual(cache.get('b'), (True, None))
+        cache.set('c', {'ETag': 'c'})  # evicts 'a', the least recently used
+        self.assertEqual(cache.get('a'), (False, None))
+        mock_time.time.return_value = 1011
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual(cache.get('c'), (True, {'ETag': 'c'}))
+        mock_time.time.return_value = 1061
+        self.assertEqual(cache.get('c'), (False, None))
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_list_objects_sharded(self, mock_boto3):
+        """
+        test pyapi.utils.s3.list_objects_sharded
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        keys = ['p/0', 'p/A', 'p/Az', 'p/a/1', 'p/a/2', 'p/b', 'p/b/c',
+                'p/b/c/d', 'p/c', 'p/z', 'p/~', 'p/~~', 'x/0']
+        expected = sorted(k for k in keys if k.startswith('p/'))
+        self.mock_list_objects_v2(keys, page_size=2)
+        tests = [
+            {'delimiter': None, 'shards': 1},
+            {'delimiter': None, 'shards': 7},
+            {'delimiter': None, 'shards': 200},
+            {'delimiter': '/'},
+        ]
+        for test in tests:
+            for sort in [True, False]:
+                result = [obj['Key'] for obj in s3.list_objects_sharded(
+                    'p/', self.bucket, workers=3, sort=sort, **test)]
+                if not sort:
+                    result.sort()
+                self.assertEqual(result, expected, str(test))
+
+        # keys of one page are listed by one request
+        self.list_requests = []
+        result = list(s3.list_objects_sharded('p/A', self.bucket, workers=8))
+        self.assertEqual([obj['Key'] for obj in result], ['p/A', 'p/Az'])
+        self.assertEqual(len(self.list_requests), 1)
+
+        # keys all starting with digits are split at deeper characters
+        keys = ['d/2020-01-{:02d}/{:03d}'.format(day, i)
+                for day in range(1, 31) for i in range(10)]
+        self.mock_list_objects_v2(keys, page_size=10)
+        for sort in [True, False]:
+            self.list_requests = []
+            result = [obj['Key'] for obj in s3.list_objects_sharded(
+                'd/', self.bucket, workers=4, sort=sort)]
+            self.assertEqual(sorted(result), keys)
+            if sort:
+                self.assertEqual(result, keys)
+            self.assertTrue(len(self.list_requests) < 2 * 30)
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_prefix_stats(self, mock_boto3):
+        """
+        test pyapi.utils.s3.prefix_stats from listings
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        keys = ['p/a', 'p/bb', 'p/c/dd', 'p/eeeeee', 'x/0']
+        self.mock_list_objects_v2(keys, page_size=2)
+        result = s3.prefix_stats('p/', self.bucket, workers=2, bounds=(8, 4))
+        self.assertEqual(result['count'], 4)
+        self.assertEqual(result['bytes'], 3 + 4 + 6 + 8)
+        self.assertEqual((result['min_size'], result['max_size']), (3, 8))
+        self.assertEqual(result['oldest_key'], 'p/a')
+        self.assertEqual(result['newest'], 'modified-p/eeeeee')
+        self.assertEqual(
+            [(h['min'], h['max'], h['count'], h['bytes'])
+             for h in result['histogram']],
+            [(0, 4, 1, 3), (4, 8, 2, 10), (8, None, 1, 8)])
+        self.assertEqual(
+            result['storage_classes'], {'STANDARD': {'count': 4, 'bytes': 21}})
+        self.assertEqual(self.mock_client.get_object.call_count, 0)
+
+        result = s3.prefix_stats('none/', self.bucket, bounds=[10])
+        self.assertEqual(result['count'], 0)
+        self.assertEqual(result['oldest'], None)
+        self.assertEqual(len(result['histogram']), 2)
+
+    def test_split_key_range(self):
+        """
+        test pyapi.utils.s3._split_key_range by actual keys
+        """
+        tests = [
+            ('p/', None, None),
+            ('p/', 'p/2020-01-01/a', None),
+            ('p/', 'p/2020-01-01/a', 'p/2020-01-09'),
+            ('p/', 'p/2020-01-01/a', 'p/2020-01-02'),
+            ('p/', 'p/a', 'p/b'),
+            ('', 'a', None),
+        ]
+        for prefix, start_after, end in tests:
+            key_name = s3._split_key_range(prefix, start_after, end)
+            self.assertTrue(key_name.startswith(prefix))
+            self.assertTrue(key_name > (start_after or prefix))
+            if end is not None:
+                self.assertTrue(key_name < end)
+        self.assertEqual(
+            s3._split_key_range('p/', 'p/2020-01-01/a', 'p/2020-01-09'),
+            'p/2020-01-05')
+        self.assertEqual(s3._split_key_range('p/', 'p/a', 'p/a!'), None)
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_list_objects_sharded_exception(self, mock_boto3):
+        """
+        test pyapi.utils.s3.list_objects_sharded on exception
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        for sort in [True, False]:
+            self.mock_client.list_objects_v2.side_effect = \
+                self.mock_client_err
+            with self.assertRaises(ClientError):
+                list(s3.list_objects_sharded('p/', self.bucket, sort=sort))
+
+            # on listing a shard
+            self.mock_client.list_objects_v2.side_effect = [
+                {'Contents': [{'Key': 'p/a'}], 'IsTruncated': True}] + [
+                    self.mock_client_err] * 10
+            with self.assertRaises(ClientError):
+                list(s3.list_objects_sharded('p/', self.bucket, sort=sort))
+
     @patch('pyapi.utils.s3.boto3_session')
     def test_mv(self, mock_boto3):
         """
@@ -598,6 +1449,190 @@ class TestS3(unittest.TestCase):
         result = s3.mv_key("old", "new", self.bucket)
         self.assertEqual(result, False)
 
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_upload(self, mock_boto3):
+        """
+        test pyapi.utils.s3.upload by single PUT
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        key_name, bucket = "some/s3/key", self.bucket
+        tests = [
+            (b'bytes', b'bytes'),
+            (u'text \xe9', u'text \xe9'),
+            (io.BytesIO(b'file'), b'file'),
+            (iter([b'it', u'er']), b'iter'),
+            (iter([]), b''),
+        ]
+        for source, body in tests:
+            result = s3.upload(source, key_name, bucket, ContentType='x/y')
+            self.mock_client.put_object.assert_called_with(
+                Body=body, Bucket=bucket, Key=key_name, ContentType='x/y')
+            self.assertEqual(result, self.mock_s3_put_return)
+        self.assertEqual(
+            self.mock_client.create_multipart_upload.call_count, 0)
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_upload_compressed(self, mock_boto3):
+        """
+        test pyapi.utils.s3.upload with a content encoding
+        """
+        import zlib
+        mock_boto3.Session.return_value = self.mock_session
+        key_name, bucket = "some/s3/key", self.bucket
+        for source in [b'data' * 100, io.BytesIO(b'data' * 100)]:
+            s3.upload(source, key_name, bucket, content_encoding='GZIP')
+            kwargs = self.mock_client.put_object.call_args[1]
+            self.assertEqual(kwargs['ContentEncoding'], 'gzip')
+            self.assertEqual(
+                zlib.decompress(kwargs['Body'], 16 + zlib.MAX_WBITS),
+                b'data' * 100)
+        with self.assertRaises(ValueError):
+            s3.upload(b'data', key_name, bucket, content_encoding='br')
+
+        s3.create_key(u'text', key_name, bucket, content_encoding='gzip')
+        kwargs = self.mock_client.put_object.call_args[1]
+        self.assertEqual(kwargs['ContentEncoding'], 'gzip')
+
+    @patch('pyapi.utils.s3.MULTIPART_PART_SIZE_MIN', 4)
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_upload_multipart(self, mock_boto3):
+        """
+        test pyapi.utils.s3.upload by multipart upload
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        key_name, bucket = "some/s3/key", self.bucket
+        self.mock_client.create_multipart_upload.return_value = {
+            'UploadId': 'id'}
+        self.mock_client.upload_part.side_effect = lambda **kw: {
+            'ETag': 'etag-{}'.format(kw['PartNumber'])}
+        self.mock_client.complete_multipart_upload.return_value = 'done'
+        sources = [
+            b'0123456789',
+            io.BytesIO(b'0123456789'),
+            iter([b'0', b'12345', b'6789']),
+        ]
+        for source in sources:
+            self.mock_client.upload_part.reset_mock()
+            result = s3.upload(source, key_name, bucket, part_size=4)
+            self.assertEqual(result, 'done')
+            self.assertEqual(self.mock_client.put_object.call_count, 0)
+            parts = sorted(
+                (c[1]['PartNumber'], c[1]['Body'])
+                for c in self.mock_client.upload_part.call_args_list)
+            self.assertEqual(parts, [(1, b'0123'), (2, b'4567'), (3, b'89')])
+            self.mock_client.complete_multipart_upload.assert_called_with(
+                Bucket=bucket, Key=key_name, UploadId='id',
+                MultipartUpload={'Parts': [
+                    {'ETag': 'etag-1', 'PartNumber': 1},
+                    {'ETag': 'etag-2', 'PartNumber': 2},
+                    {'ETag': 'etag-3', 'PartNumber': 3},
+                ]})
+
+        self.mock_client.upload_part.side_effect = self.mock_client_err
+        with self.assertRaises(ClientError):
+            s3.upload(b'0123456789', key_name, bucket, part_size=4)
+        self.mock_client.abort_multipart_upload.assert_called_with(
+            Bucket=bucket, Key=key_name, UploadId='id')
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_mv_prefix(self, mock_boto3):
+        """
+        test pyapi.utils.s3.mv_prefix
+        """
+        from datetime import datetime
+        mock_boto3.Session.return_value = self.mock_session
+        older, newer = datetime(2020, 1, 1), datetime(2020, 1, 2)
+        listed = {
+            'src/': [
+                {'Key': 'src/new', 'Size': 1, 'ETag': '"a"'},
+                {'Key': 'src/moved', 'Size': 2, 'ETag': '"b"'},
+                {'Key': 'src/changed', 'Size': 3, 'ETag': '"c"'},
+                {'Key': 'src/error', 'Size': 4, 'ETag': '"d"'},
+                {'Key': 'src/multi', 'Size': 5, 'ETag': '"e-2"',
+                 'LastModified': older},
+                {'Key': 'src/stale', 'Size': 6, 'ETag': '"f-2"',
+                 'LastModified': newer},
+            ],
+            'dst/': [
+                {'Key': 'dst/moved', 'Size': 2, 'ETag': '"b"'},
+                {'Key': 'dst/changed', 'Size': 3, 'ETag': '"x"'},
+                {'Key': 'dst/multi', 'Size': 5, 'ETag': '"y-2"',
+                 'LastModified': newer},
+                {'Key': 'dst/stale', 'Size': 6, 'ETag': '"z-2"',
+                 'LastModified': older},
+            ],
+        }
+        not_found = ClientError(
+            {'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+
+        def paginate(**kwargs):
+            """list source or destination keys"""
+            p_iterator = MagicMock()
+            p_iterator.search.return_value = listed[kwargs['Prefix']]
+            return p_iterator
+
+        def head_object(**kwargs):
+            """head listed keys"""
+            for obj in listed['src/'] + listed['dst/']:
+                if obj['Key'] == kwargs['Key']:
+                    return {'ContentLength': obj['Size'], 'ETag': obj['ETag'],
+                            'LastModified': obj.get('LastModified')}
+            raise not_found
+
+        def copy_object(**kwargs):
+            """fail on src/error"""
+            if kwargs['Key'] == 'dst/error':
+                raise self.mock_client_err
+
+        self.mock_paginator.paginate.side_effect = paginate
+        self.mock_client.head_object.side_effect = head_object
+        self.mock_client.copy_object.side_effect = copy_object
+        self.mock_client.delete_objects.return_value = {}
+
+        result = s3.mv_prefix('src/', 'dst/', self.bucket, workers=2)
+        self.assertEqual(
+            [c[1] for c in self.mock_paginator.paginate.call_args_list],
+            [{'Bucket': self.bucket, 'Prefix': 'src/'},
+             {'Bucket': self.bucket, 'Prefix': 'dst/'}])
+        self.assertEqual(self.mock_client.head_object.call_count, 0)
+        self.assertEqual(
+            sorted(c[1]['Key'] for c in
+                   self.mock_client.copy_object.call_args_list),
+            ['dst/changed'] + ['dst/error'] * 3 + ['dst/new', 'dst/stale'])
+        deleted = self.mock_client.delete_objects.call_args[1]['Delete']
+        self.assertEqual(
+            sorted(o['Key'] for o in deleted['Objects']),
+            ['src/changed', 'src/moved', 'src/multi', 'src/new', 'src/stale'])
+        self.assertEqual(result['moved'], 5)
+        self.assertEqual(result['skipped'], 2)
+        self.assertEqual(
+            result['errors'],
+            [{'Key': 'src/error', 'Code': '500', 'Message': str(
+                self.mock_client_err)}])
+
+        # an explicit key list is compared by HEAD requests
+        self.mock_client.copy_object.reset_mock()
+        result = s3.mv_prefix('src/', 'dst/', self.bucket,
+                              keys=['src/changed', 'src/moved', 'src/gone'])
+        self.assertEqual(self.mock_paginator.paginate.call_count, 2)
+        self.assertEqual(self.mock_client.head_object.call_count, 5)
+        self.assertEqual(
+            [c[1]['Key'] for c in self.mock_client.copy_object.call_args_list],
+            ['dst/changed'])
+        deleted = self.mock_client.delete_objects.call_args[1]['Delete']
+        self.assertEqual(
+            sorted(o['Key'] for o in deleted['Objects']),
+            ['src/changed', 'src/moved'])
+        self.assertEqual(result['moved'], 2)
+        self.assertEqual(result['skipped'], 1)
+        result = s3.mv_prefix('src/', 'dst/', self.bucket, keys=['other/a'])
+        self.assertEqual(result['moved'], 0)
+        self.assertEqual([e['Key'] for e in result['errors']], ['other/a'])
+
+        for src, dst in [('', 'dst/'), ('a/', 'a/b/'), ('a/b/', 'a/')]:
+            with self.assertRaises(ValueError):
+                s3.mv_prefix(src, dst, self.bucket)
+
     def test_process_func(self):
         """
         test pyapi.utils.s3.process_func
@@ -723,6 +1758,211 @@ class TestS3(unittest.TestCase):
         self.mock_iterator.search.assert_called_with('Contents')
         self.assertEqual(counts, len(self.mock_prefix_test_dirs))
 
+    @patch('pyapi.utils.s3.boto3_session')
+    @patch('pyapi.utils.s3.check_bucket')
+    def test_process_keys_concurrent(self, mock_check, mock_boto3):
+        """
+        process_keys should be able to process keys concurrently
+        """
+        self.mock_iterator.search.return_value = self.mock_prefix_more_keys
+        mock_check.return_value = self.mock_check_true
+        mock_boto3.Session.return_value = self.mock_session
+        keys = []
+
+        def do_func(obj, **kwargs):
+            """record processed key"""
+            self.assertEqual(kwargs, {'bucket': self.bucket})
+            keys.append(obj['Key'])
+
+        counts = s3.process_keys(
+            do_func, "more", bucket=self.bucket, workers=4, ordered=True)
+        self.assertEqual(counts, len(self.mock_prefix_more_keys))
+        self.assertEqual(
+            sorted(keys), [k['Key'] for k in self.mock_prefix_more_keys])
+
+    @patch('pyapi.utils.s3.boto3_session')
+    @patch('pyapi.utils.s3.check_bucket')
+    def test_process_concurrent_errors(self, mock_check, mock_boto3):
+        """
+        process should aggregate errors in concurrent mode
+        """
+        self.mock_iterator.search.return_value = self.mock_prefix_test_json
+        mock_check.return_value = self.mock_check_true
+        mock_boto3.Session.return_value = self.mock_session
+
+        def do_func(key_name, **kwargs):
+            """fail on sub-path keys"""
+            if '/a/b/' in key_name:
+                raise self.mock_exception
+
+        with self.assertRaises(s3.ProcessError) as context:
+            s3.process(do_func, "test", ".json", bucket=self.bucket,
+                       workers=3, max_in_flight=2)
+        self.assertEqual(context.exception.counts, 4)
+        self.assertEqual(
+            sorted(k for k, _ in context.exception.errors),
+            ['test/a/b/c/d/_test1.json', 'test/a/b/c/d/_test2.json'])
+
+    @patch('pyapi.utils.s3.boto3_session')
+    @patch('pyapi.utils.s3.check_bucket')
+    def test_process_keys_checkpoint(self, mock_check, mock_boto3):
+        """
+        process_keys should save a checkpoint, and resume after its marker
+        """
+        import json
+        import shutil
+        import tempfile
+        objects = [{'Key': 'p/{}'.format(i)} for i in range(6)]
+        mock_check.return_value = self.mock_check_true
+        mock_boto3.Session.return_value = self.mock_session
+        temp_dir = tempfile.mkdtemp()
+        path = os.path.join(temp_dir, 'job.checkpoint')
+        keys = []
+
+        def do_func(obj, **kwargs):
+            """record processed key, fail on p/3"""
+            if obj['Key'] == 'p/3':
+                raise self.mock_exception
+            keys.append(obj['Key'])
+
+        try:
+            self.mock_iterator.search.return_value = objects
+            with self.assertRaises(Exception):
+                s3.process_keys(do_func, "p/", bucket=self.bucket,
+                                checkpoint=path, checkpoint_interval=0)
+            with open(path) as file_obj:
+                data = json.load(file_obj)
+            self.assertEqual(
+                (data['marker'], data['processed'], data['completed']),
+                ('p/2', 3, False))
+            self.assertEqual(
+                data['scope'], {'bucket': self.bucket, 'prefix': 'p/'})
+
+            # resumed by Marker, and any listed key up to marker is skipped
+            keys[:] = []
+            self.mock_iterator.search.return_value = objects[2:]
+            counts = s3.process_keys(
+                lambda obj, **kwargs: keys.append(obj['Key']), "p/",
+                bucket=self.bucket, checkpoint=path, resume=True)
+            self.assertEqual(counts, 3)
+            self.assertEqual(keys, ['p/3', 'p/4', 'p/5'])
+            self.mock_paginator.paginate.assert_called_with(
+                Bucket=self.bucket, Prefix='p/', Delimiter='', Marker='p/2')
+            with open(path) as file_obj:
+                data = json.load(file_obj)
+            self.assertEqual(
+                (data['marker'], data['processed'], data['completed']),
+                ('p/5', 6, True))
+
+            # another scope, or resume without checkpoint
+            with self.assertRaises(ValueError):
+                s3.process_keys(do_func, "q/", bucket=self.bucket,
+                                checkpoint=path, resume=True)
+            with self.assertRaises(ValueError):
+                s3.process_keys(do_func, "p/", bucket=self.bucket, resume=True)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @patch('pyapi.utils.s3.boto3_session')
+    @patch('pyapi.utils.s3.check_bucket')
+    def test_process_checkpoint_concurrent(self, mock_check, mock_boto3):
+        """
+        process should checkpoint to s3 by the marker of all keys done
+        """
+        import json
+        import threading
+        mock_check.return_value = self.mock_check_true
+        mock_boto3.Session.return_value = self.mock_session
+        prefixes = ['p/{}/'.format(i) for i in range(8)]
+        self.mock_iterator.search.return_value = [
+            {'Prefix': prefix} for prefix in prefixes]
+        release = threading.Event()
+        saved = []
+
+        def do_func(key_name, **kwargs):
+            """hold p/0/ until others are done, fail on p/5/"""
+            if key_name == 'p/0/':
+                release.wait(5)
+            if key_name == 'p/5/':
+                raise self.mock_exception
+
+        def put_object(**kwargs):
+            """record a saved checkpoint, releasing p/0/"""
+            saved.append(json.loads(kwargs['Body'].decode('utf-8')))
+            if len(saved) == 6:
+                release.set()
+
+        self.mock_client.put_object.side_effect = put_object
+        with self.assertRaises(s3.ProcessError) as context:
+            s3.process(do_func, "p/", "/", bucket=self.bucket, workers=4,
+                       max_in_flight=8, checkpoint='s3://jobs/p.checkpoint',
+                       checkpoint_interval=0)
+        self.assertEqual(context.exception.counts, 7)
+        self.mock_client.put_object.assert_called_with(
+            Body=ANY, Bucket='jobs', Key='p.checkpoint')
+        # no marker until p/0/ is done
+        self.assertEqual(saved[0]['marker'], None)
+        self.assertEqual(
+            (saved[-1]['marker'], saved[-1]['processed'], saved[-1]['failed'],
+             saved[-1]['failed_keys'], saved[-1]['completed']),
+            ('p/7/', 7, 1, ['p/5/'], True))
+
+    @patch('pyapi.utils.s3.boto3_session')
+    def test_checkpoint_read(self, mock_boto3):
+        """
+        test pyapi.utils.s3._Checkpoint loading from s3, raising on errors
+        """
+        mock_boto3.Session.return_value = self.mock_session
+        checkpoint = s3._Checkpoint('s3://jobs/p.checkpoint', bucket='b')
+        self.mock_client.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchKey', 'Message': ''}}, 'GetObject')
+        checkpoint.load()
+        self.assertEqual(checkpoint.state['marker'], None)
+
+        self.mock_client.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'AccessDenied', 'Message': ''}}, 'GetObject')
+        with self.assertRaises(ClientError):
+            checkpoint.load()
+        with self.assertRaises(ClientError):
+            s3.process_keys(
+                self.doFunc, 'p/', bucket=self.bucket,
+                checkpoint='s3://jobs/p.checkpoint', resume=True)
+        self.assertEqual(self.mock_client.put_object.call_count, 0)
+
+    def test_map_concurrent(self):
+        """
+        test pyapi.utils.s3._map_concurrent in order and as completed
+        """
+        import threading
+        import time
+        lock = threading.Lock()
+        running = {'now': 0, 'max': 0}
+
+        def a_func(item):
+            """square an item, fail on 3"""
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            time.sleep(0.001 * (10 - item))
+            with lock:
+                running['now'] -= 1
+            if item == 3:
+                raise ValueError(item)
+            return item * item
+
+        results = list(s3._map_concurrent(
+            a_func, range(10), 4, max_in_flight=5, ordered=True))
+        self.assertEqual([r[0] for r in results], list(range(10)))
+        self.assertEqual(results[2], (2, 4, None))
+        self.assertTrue(isinstance(results[3][2], ValueError))
+        self.assertTrue(running['max'] <= 4)
+
+        results = list(s3._map_concurrent(a_func, range(10), 3))
+        self.assertEqual(sorted(r[0] for r in results), list(range(10)))
+        self.assertEqual(
+            sorted(r[1] for r in results if r[2] is None),
+            sorted(i * i for i in range(10) if i != 3))
+
     @patch('pyapi.utils.s3.boto3_session')
     @patch('pyapi.utils.s3.check_bucket')
     def test_generate_pages(self, mock_check, mock_boto3):
@@ -745,3 +1985,63 @@ class TestS3(unittest.TestCase):
         self.mock_paginator.paginate.assert_called_with(
             **self.mock_params_test_dirs)
         self.mock_iterator.search.assert_called_with('Contents')
+
+    @patch('pyapi.utils.s3.boto3_session')
+    @patch('pyapi.utils.s3.check_bucket')
+    def test_generate_pages_prefetch(self, mock_check, mock_boto3):
+        """
+        test pyapi.utils.s3.generate_pages prefetching pages and bodies
+        """
+        mock_check.return_value = self.mock_check_true
+        mock_boto3.Session.return_value = self.mock_session
+        pages = [
+            {'Contents': [{'Key': 'p/a', 'Size': 4}, {'Key': 'p/', 'Size': 0}]},
+            {'Contents': [{'Key': 'p/b', 'Size': 8}, {'Key': 'p/c', 'Size': 4}]},
+            {},
+        ]
+        self.mock_iterator.__iter__.return_value = iter(pages)
+        res = s3.generate_pages("p/", prefetch_pages=1, bucket=self.bucket)
+        self.assertEqual([obj['Key'] for obj in res], ['p/a', 'p/b', 'p/c'])
+        self.assertEqual(self.mock_iterator.search.call_count, 0)
+
+        # bodies in listed order, within the memory cap
+        in_flight = {'bytes': 0, 'max': 0}
+
+        def get_object(Bucket, Key):
+            """get an object, tracking bytes fetched ahead"""
+            size = {'p/a': 4, 'p/b': 8, 'p/c': 4}[Key]
+            in_flight['bytes'] += size
+            in_flight['max'] = max(in_flight['max'], in_flight['bytes'])
+            body = MagicMock()
+            body.read.return_value = Key.upper()
+            return dict(Body=body, ContentLength=size)
+
+        def consume(obj):
+            """consume an object"""
+            in_flight['bytes'] -= obj['Size']
+            return obj['Contents']
+
+        self.mock_client.get_object.side_effect = get_object
+        self.mock_iterator.__iter__.return_value = iter(pages)
+        res = s3.generate_pages("p/", prefetch_pages=2, prefetch_bodies=3,
+                                prefetch_bytes=12, bucket=self.bucket)
+        self.assertEqual([consume(obj) for obj in res], ['P/A', 'P/B', 'P/C'])
+        self.assertTrue(in_flight['max'] <= 12)
+        self.mock_client.get_object.assert_called_with(
+            Bucket=self.bucket, Key='p/c')
+
+        # listing error is raised to the consumer
+        self.mock_iterator.__iter__.side_effect = ValueError('listing')
+        res = s3.generate_pages("p/", prefetch_pages=1, bucket=self.bucket)
+        self.assertRaises(ValueError, list, res)
+
+        # fetching error is raised when its object is reached
+        self.mock_iterator.search.return_value = [
+            {'Key': 'p/a', 'Size': 4}, {'Key': 'p/b', 'Size': 8}]
+        not_found = ClientError(
+            {'Error': {'Code': 'NoSuchKey', 'Message': ''}}, 'GetObject')
+        self.mock_client.get_object.side_effect = [
+            dict(Body=io.BytesIO(b'a'), ContentLength=1), not_found]
+        res = s3.generate_pages("p/", prefetch_bodies=2, bucket=self.bucket)
+        self.assertEqual(next(res)['Contents'], b'a')
+        self.assertRaises(ClientError, next, res)
@@ -0,0 +1,76 @@
+"""
+# test_utils_s3_cache
+
+"""
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyapi.utils import s3_cache
+
+
+class TestS3ContentCache(unittest.TestCase):
+    """
+    TestS3ContentCache includes all unit tests for pyapi.utils.s3_cache module
+    """
+
+    def setUp(self):
+        """
+        setup test
+        """
+        self.bucket = "s3-bucket"
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        tear down each test
+        """
+        shutil.rmtree(self.temp_dir)
+        print "\ndone: " + self.id()
+
+    def test_get_put(self):
+        """
+        test pyapi.utils.s3_cache.S3ContentCache get, put and invalidate
+        """
+        cache = s3_cache.S3ContentCache(self.temp_dir, 100)
+        self.assertEqual(cache.get(self.bucket, 'a'), None)
+        self.assertEqual(cache.get_etag(self.bucket, 'a'), None)
+        self.assertTrue(cache.put(self.bucket, 'a', '"e1"', b'aaaa'))
+        self.assertEqual(cache.get(self.bucket, 'a'), ('"e1"', b'aaaa'))
+        self.assertEqual(cache.get_etag(self.bucket, 'a'), '"e1"')
+        self.assertTrue(cache.put(self.bucket, 'a', '"e2"', b'bb'))
+        self.assertEqual(cache.get(self.bucket, 'a'), ('"e2"', b'bb'))
+        self.assertEqual(cache.size, 2)
+
+        # too large, or without ETag
+        self.assertFalse(cache.put(self.bucket, 'b', '"e1"', b'x' * 101))
+        self.assertFalse(cache.put(self.bucket, 'b', None, b'x'))
+
+        cache.invalidate(self.bucket, 'a')
+        self.assertEqual(cache.get(self.bucket, 'a'), None)
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_evict(self):
+        """
+        test pyapi.utils.s3_cache.S3ContentCache LRU eviction
+        """
+        cache = s3_cache.S3ContentCache(self.temp_dir, 10)
+        cache.put(self.bucket, 'a', '"a"', b'aaaa')
+        cache.put(self.bucket, 'b', '"b"', b'bbbb')
+        cache.get(self.bucket, 'a')
+        cache.put(self.bucket, 'c', '"c"', b'cccc')
+        self.assertEqual(cache.get(self.bucket, 'b'), None)
+        self.assertEqual(cache.get(self.bucket, 'a'), ('"a"', b'aaaa'))
+        self.assertEqual(cache.size, 8)
+
+        # reload from the directory
+        cache = s3_cache.S3ContentCache(self.temp_dir, 10)
+        self.assertEqual(cache.size, 8)
+        self.assertEqual(cache.get(self.bucket, 'c'), ('"c"', b'cccc'))
+        cache.clear()
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(os.listdir(self.temp_dir), [])
@@ -0,0 +1,150 @@
+"""
+# test_utils_s3_index
+
+"""
+from __future__ import absolute_import
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+from pyapi.utils import s3_index
+
+
+class TestS3KeyIndex(unittest.TestCase):
+    """
+    TestS3KeyIndex includes all unit tests for pyapi.utils.s3_index module
+    """
+
+    def setUp(self):
+        """
+        setup test
+        """
+        self.bucket = "s3-bucket"
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'index.db')
+        self.objects = [
+            self.get_object('p/2017/a.json', '2017-01-16T08:00:00'),
+            self.get_object('p/2017/b.txt', '2017-01-17T08:00:00'),
+            self.get_object('p/2018/c.json', '2018-01-01T00:00:00'),
+        ]
+
+    def tearDown(self):
+        """
+        tear down each test
+        """
+        shutil.rmtree(self.temp_dir)
+        print "\ndone: " + self.id()
+
+    def get_object(self, key, last_modified):
+        """
+        get a listed object
+        """
+        return {
+            'Key': key, 'Size': len(key), 'ETag': '"{}"'.format(key),
+            'LastModified': datetime.datetime.strptime(
+                last_modified, '%Y-%m-%dT%H:%M:%S')}
+
+    @patch('pyapi.utils.s3_index.s3')
+    def test_refresh(self, mock_s3):
+        """
+        test pyapi.utils.s3_index.S3KeyIndex refresh and query
+        """
+        mock_s3.list_objects_sharded.return_value = iter(self.objects)
+        index = s3_index.S3KeyIndex(self.db_path, 'p/', self.bucket)
+        self.assertEqual(index.refresh(), 3)
+        mock_s3.list_objects_sharded.assert_called_with(
+            'p/', self.bucket, workers=8)
+        self.assertEqual(index.get_meta('last_key'), 'p/2018/c.json')
+        self.assertEqual(
+            index.get_meta('full_refreshed'), index.get_meta('refreshed'))
+
+        # incremental refresh lists after the last key
+        new_obj = self.get_object('p/2018/d.json', '2018-02-01T00:00:00')
+        mock_paginator = MagicMock()
+        mock_paginator.paginate.return_value.search.return_value = [new_obj]
+        mock_s3.get_client.return_value.get_paginator.return_value = \
+            mock_paginator
+        self.assertEqual(index.refresh(), 1)
+        mock_paginator.paginate.assert_called_with(
+            Bucket=self.bucket, Prefix='p/', StartAfter='p/2018/c.json')
+        self.assertEqual(index.count(), 4)
+        index.close()
+
+        # reopen the index
+        with s3_index.S3KeyIndex(self.db_path, 'p/', self.bucket) as index:
+            self.assertEqual(index.get_meta('last_key'), 'p/2018/d.json')
+            self.assertEqual(
+                index.keys(suffix='.json'),
+                ['p/2017/a.json', 'p/2018/c.json', 'p/2018/d.json'])
+            self.assertEqual(
+                index.keys(prefix='p/2017/'), ['p/2017/a.json', 'p/2017/b.txt'])
+            self.assertEqual(
+                index.keys(since='2017-01-17', until=datetime.datetime(2018, 1, 2)),
+                ['p/2017/b.txt', 'p/2018/c.json'])
+            self.assertEqual(index.count(prefix='p/2018/', suffix='.json'), 2)
+            self.assertEqual(index.query(prefix='p/2017/a')[0], {
+                'Key': 'p/2017/a.json', 'Size': 13, 'ETag': '"p/2017/a.json"',
+                'LastModified': '2017-01-16T08:00:00'})
+
+            # full refresh removes deleted keys
+            mock_s3.list_objects_sharded.return_value = iter(self.objects[1:])
+            self.assertEqual(index.refresh(full=True), 2)
+            self.assertEqual(index.keys(), ['p/2017/b.txt', 'p/2018/c.json'])
+
+    @patch('pyapi.utils.s3_index.s3')
+    def test_refresh_empty(self, mock_s3):
+        """
+        test pyapi.utils.s3_index.S3KeyIndex refresh after an empty listing
+        """
+        mock_s3.list_objects_sharded.return_value = iter([])
+        with s3_index.S3KeyIndex(self.db_path, 'p/', self.bucket) as index:
+            self.assertEqual(index.refresh(), 0)
+            self.assertEqual(index.get_meta('last_key'), None)
+
+            # no last key to list after, so list all keys again
+            mock_s3.list_objects_sharded.return_value = iter(self.objects)
+            self.assertEqual(index.refresh(), 3)
+            self.assertEqual(mock_s3.list_objects_sharded.call_count, 2)
+
+            # no new keys after the last key
+            mock_paginator = MagicMock()
+            mock_paginator.paginate.return_value.search.return_value = []
+            mock_s3.get_client.return_value.get_paginator.return_value = \
+                mock_paginator
+            self.assertEqual(index.refresh(full_interval=3600), 0)
+            self.assertEqual(index.get_meta('last_key'), 'p/2018/c.json')
+            self.assertEqual(mock_s3.list_objects_sharded.call_count, 2)
+
+            # the last full refresh is too old
+            index.set_meta(full_refreshed='2017-01-01T00:00:00')
+            mock_s3.list_objects_sharded.return_value = iter(self.objects[:1])
+            self.assertEqual(index.refresh(full_interval=3600), 1)
+            self.assertEqual(mock_s3.list_objects_sharded.call_count, 3)
+            self.assertEqual(index.keys(), ['p/2017/a.json'])
+
+    def test_scope(self):
+        """
+        test pyapi.utils.s3_index.S3KeyIndex on a different prefix
+        """
+        s3_index.S3KeyIndex(self.db_path, 'p/', self.bucket).close()
+        with self.assertRaises(ValueError):
+            s3_index.S3KeyIndex(self.db_path, 'q/', self.bucket)
+
+    def test_to_utc_text(self):
+        """
+        test pyapi.utils.s3_index._to_utc_text
+        """
+        from dateutil import tz
+        tests = [
+            (None, None),
+            ('2017-01-16', '2017-01-16'),
+            (datetime.datetime(2017, 1, 16, 8), '2017-01-16T08:00:00'),
+            (datetime.datetime(2017, 1, 16, 8, tzinfo=tz.tzoffset(None, 3600)),
+             '2017-01-16T07:00:00'),
+        ]
+        for value, expected in tests:
+            self.assertEqual(s3_index._to_utc_text(value), expected)
@@ -0,0 +1,171 @@
+"""
+# test_utils_s3_metrics
+
+"""
+from __future__ import absolute_import
+
+import socket
+import unittest
+
+import boto3.session
+from botocore.exceptions import ClientError
+from botocore.awsrequest import AWSResponse
+from mock import MagicMock, patch
+from pyapi.utils import s3
+from pyapi.utils import s3_metrics
+from pyapi.utils import s3_retry
+from pyapi.utils.s3_metrics import LogSink, MemorySink, StatsdSink
+
+
+class TestS3Metrics(unittest.TestCase):
+    """
+    TestS3Metrics includes all unit tests for pyapi.utils.s3_metrics module
+    """
+
+    def setUp(self):
+        """
+        setup test
+        """
+        self.sink = MemorySink(bounds=(10, 100))
+        self.previous = s3_metrics.set_sink(self.sink)
+
+    def tearDown(self):
+        """
+        tear down each test
+        """
+        s3_metrics.set_sink(self.previous)
+        print "\ndone: " + self.id()
+
+    def get_client(self):
+        """
+        get a real (stubbed) s3 client with the metrics hooks
+        """
+        session = boto3.session.Session(
+            aws_access_key_id='key', aws_secret_access_key='secret',
+            region_name='us-east-1')
+        client = session.client('s3')
+        s3_metrics.register(client)
+        return client
+
+    def test_memory_sink(self):
+        """
+        test pyapi.utils.s3_metrics.MemorySink
+        """
+        self.sink.record('GET', 0.005, bytes_in=100, status=200)
+        self.sink.record('GET', 0.050, bytes_in=50, status=200)
+        self.sink.record('GET', 0.500, status=404, error=True)
+        self.sink.record('PUT', 0.002, bytes_out=10, error=True)
+        self.sink.record_retry('PUT')
+        result = self.sink.snapshot()
+        get = result['GET']
+        self.assertEqual(
+            (get['requests'], get['errors'], get['retries'],
+             get['bytes_in'], get['bytes_out']), (3, 1, 0, 150, 0))
+        self.assertEqual(get['status'], {'200': 2, '404': 1})
+        self.assertEqual(get['latency_ms']['histogram'], [
+            {'le': 10, 'count': 1}, {'le': 100, 'count': 1},
+            {'le': None, 'count': 1}])
+        self.assertEqual(
+            (get['latency_ms']['min'], get['latency_ms']['max'],
+             get['latency_ms']['avg']), (5.0, 500.0, 185.0))
+        self.assertEqual(
+            (get['latency_ms']['p50'], get['latency_ms']['p90']), (100, None))
+        self.assertEqual(
+            (result['PUT']['retries'], result['PUT']['status']),
+            (1, {'error': 1}))
+
+        self.assertEqual(len(self.sink.snapshot(reset=True)), 2)
+        self.assertEqual(self.sink.snapshot(), {})
+
+    def test_log_sink(self):
+        """
+        test pyapi.utils.s3_metrics.LogSink
+        """
+        logger = MagicMock()
+        sink = LogSink(interval=3600, logger=logger)
+        sink.record('HEAD', 0.001, status=200)
+        sink.record_retry('HEAD')
+        self.assertEqual(logger.log.call_count, 0)
+        sink.flush()
+        self.assertEqual(logger.log.call_count, 1)
+        self.assertEqual(logger.log.call_args[0][2:5], ('HEAD', 1, 0))
+        self.assertEqual(sink.snapshot(), {})
+
+        sink.interval = 0
+        sink.record('LIST', 0.001, status=200)
+        self.assertEqual(logger.log.call_count, 2)
+
+    def test_statsd_sink(self):
+        """
+        test pyapi.utils.s3_metrics.StatsdSink
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        sink = StatsdSink('127.0.0.1', server.getsockname()[1], 'test.s3')
+        try:
+            sink.record('GET', 0.0125, bytes_in=10, status=500, error=True)
+            self.assertEqual(server.recv(4096).decode('utf-8').split('\n'), [
+                'test.s3.get.latency:12.500|ms', 'test.s3.get.requests:1|c',
+                'test.s3.get.bytes_in:10|c', 'test.s3.get.errors:1|c'])
+            sink.record_retry('DELETE')
+            self.assertEqual(
+                server.recv(4096), b'test.s3.delete.retries:1|c')
+        finally:
+            sink.close()
+            server.close()
+
+    def test_hooks(self):
+        """
+        test pyapi.utils.s3_metrics hooks on a botocore client
+        """
+        client = self.get_client()
+        responses = [
+            (AWSResponse('url', 200, {}, None), {}),
+            (AWSResponse('url', 404, {}, None), {'Error': {'Code': '404'}}),
+            (AWSResponse('url', 200, {'content-length': '120'}, None),
+             {'Contents': [], 'ResponseMetadata': {'RetryAttempts': 2}}),
+        ]
+        with patch.object(client, '_make_request', side_effect=responses):
+            client.put_object(Bucket='b', Key='k', Body=b'data')
+            with self.assertRaises(ClientError):
+                client.head_object(Bucket='b', Key='k')
+            client.list_objects(Bucket='b')
+        result = self.sink.snapshot()
+        self.assertEqual(sorted(result), ['HEAD', 'LIST', 'PUT'])
+        self.assertEqual(
+            (result['PUT']['requests'], result['PUT']['bytes_out']), (1, 4))
+        self.assertEqual(
+            (result['HEAD']['errors'], result['HEAD']['status']),
+            (1, {'404': 1}))
+        self.assertEqual(
+            (result['LIST']['bytes_in'], result['LIST']['retries']), (120, 2))
+
+        # disabled
+        s3_metrics.set_sink(None)
+        self.assertFalse(s3_metrics.is_enabled())
+        response = (AWSResponse('url', 200, {}, None), {'Contents': []})
+        with patch.object(client, '_make_request', return_value=response):
+            client.list_objects(Bucket='b')
+        self.assertEqual(self.sink.snapshot()['LIST']['requests'], 1)
+
+    def test_count_retries(self):
+        """
+        test pyapi.utils.s3_metrics.count_retries by the s3 retry policy
+        """
+        previous = s3.set_retry_policy(
+            s3_retry.RetryPolicy(max_attempts=3, base_delay=0))
+        throttled = ClientError(
+            {'Error': {'Code': 'SlowDown', 'Message': ''}}, 'GetObject')
+        get_object = MagicMock(side_effect=[throttled, throttled, {}])
+        get_object.__name__ = 'get_object'
+        try:
+            self.assertEqual(s3._call(get_object, Bucket='b', Key='k'), {})
+        finally:
+            s3.set_retry_policy(previous)
+        self.assertEqual(self.sink.snapshot()['GET']['retries'], 2)
+
+        s3_metrics.set_sink(None)
+        with patch('pyapi.utils.s3_metrics.count_retries') as mock_count:
+            s3._call(MagicMock())
+        self.assertEqual(mock_count.call_count, 0)
@@ -0,0 +1,177 @@
+"""
+# test_utils_s3_parquet
+
+"""
+from __future__ import absolute_import
+
+import io
+import unittest
+
+from mock import MagicMock, patch
+from pyapi.utils import s3_parquet
+
+
+class TestS3Parquet(unittest.TestCase):
+    """
+    TestS3Parquet includes all unit tests for pyapi.utils.s3_parquet module
+    """
+
+    def setUp(self):
+        """
+        setup test
+        """
+        self.bucket = "s3-bucket"
+        self.mock_client = MagicMock()
+        self.data = b''
+
+        def get_object(**kwargs):
+            """return the requested range of data"""
+            start, end = kwargs['Range'][len('bytes='):].split('-')
+            return {'Body': io.BytesIO(self.data[int(start):int(end) + 1])}
+        self.mock_client.get_object.side_effect = get_object
+
+    def tearDown(self):
+        """
+        tear down each test
+        """
+        print "\ndone: " + self.id()
+
+    def get_parquet_data(self):
+        """
+        get the content of a Parquet file with 10 row groups
+        """
+        import pyarrow.parquet as pq
+        table = s3_parquet.pyarrow.table({
+            'id': list(range(100)),
+            'day': ['2017-01-%02d' % (i // 10 + 1) for i in range(100)],
+            'value': [float(i) for i in range(100)]})
+        buf = io.BytesIO()
+        pq.write_table(table, buf, row_group_size=10)
+        return buf.getvalue()
+
+    @patch('pyapi.utils.s3_parquet.s3')
+    def test_range_file(self, mock_s3):
+        """
+        test pyapi.utils.s3_parquet.S3RangeFile
+        """
+        mock_s3.get_client.return_value = self.mock_client
+        mock_s3.call_with_retry.side_effect = \
+            lambda a_func, **kwargs: a_func(**kwargs)
+        mock_s3.head_key.return_value = {'ContentLength': 10, 'ETag': '"e"'}
+        self.data = b'0123456789'
+        s3_file = s3_parquet.S3RangeFile('k', self.bucket, block_size=4)
+        mock_s3.head_key.assert_called_with('k', self.bucket, use_cache=False)
+        self.assertEqual(s3_file.seek(-3, 2), 7)
+        self.assertEqual(s3_file.read(2), b'78')
+        self.mock_client.get_object.assert_called_with(
+            Bucket=self.bucket, Key='k', Range='bytes=7-9', IfMatch='"e"')
+        self.assertEqual(s3_file.read(), b'9')  # read ahead
+        self.assertEqual(s3_file.read(), b'')
+        s3_file.seek(1)
+        self.assertEqual(s3_file.read(6), b'123456')
+        self.assertEqual(s3_file.tell(), 7)
+        self.assertEqual(s3_file.requests, 2)
+        self.assertEqual(mock_s3.call_with_retry.call_count, 2)
+        self.assertEqual(s3_file.bytes_read, 9)
+        s3_file.close()
+        with self.assertRaises(ValueError):
+            s3_file.read()
+
+        mock_s3.head_key.return_value = None
+        with self.assertRaises(IOError):
+            s3_parquet.S3RangeFile('k', self.bucket)
+
+    @patch('pyapi.utils.s3_parquet.s3')
+    def test_range_file_short_read(self, mock_s3):
+        """
+        test pyapi.utils.s3_parquet.S3RangeFile on a short read
+        """
+        mock_s3.get_client.return_value = self.mock_client
+        mock_s3.call_with_retry.side_effect = \
+            lambda a_func, **kwargs: a_func(**kwargs)
+        self.data = b'01234'
+        s3_file = s3_parquet.S3RangeFile('k', self.bucket, size=10)
+        with self.assertRaises(IOError):
+            s3_file.read()
+
+    def test_match_stats(self):
+        """
+        test pyapi.utils.s3_parquet._match_stats
+        """
+        stats = {'id': (10, 19), 'day': ('2017-01-02', '2017-01-02')}
+        tests = [
+            ([], True),
+            ([('id', '==', 15)], True),
+            ([('id', '==', 20)], False),
+            ([('id', '<', 10)], False),
+            ([('id', '<=', 10)], True),
+            ([('id', '>', 19)], False),
+            ([('id', '>=', 19)], True),
+            ([('id', 'in', [1, 25])], False),
+            ([('id', 'in', [1, 12])], True),
+            ([('day', '!=', '2017-01-02')], False),
+            ([('id', '>', 15), ('day', '==', '2017-01-03')], False),
+            ([('other', '==', 1)], True),
+        ]
+        for filters, expected in tests:
+            self.assertEqual(
+                s3_parquet._match_stats(stats, filters), expected, filters)
+
+    def test_check_filters(self):
+        """
+        test pyapi.utils.s3_parquet._check_filters
+        """
+        s3_parquet._check_filters([('a', 'in', (1, 2)), ('b', '<', 1)])
+        with self.assertRaises(ValueError):
+            s3_parquet._check_filters([('a', '=', 1)])
+        with self.assertRaises(ValueError):
+            s3_parquet._check_filters([('a', 'in', 1)])
+
+    @patch('pyapi.utils.s3_parquet.pq', None)
+    def test_no_pyarrow(self):
+        """
+        test pyapi.utils.s3_parquet.iter_batches without pyarrow
+        """
+        with self.assertRaises(ImportError):
+            list(s3_parquet.iter_batches('k', self.bucket))
+
+    @unittest.skipIf(s3_parquet.pq is None, 'requires pyarrow')
+    @patch('pyapi.utils.s3_parquet.s3')
+    def test_iter_records(self, mock_s3):
+        """
+        test pyapi.utils.s3_parquet.iter_records with projection and filters
+        """
+        self.data = self.get_parquet_data()
+        mock_s3.get_client.return_value = self.mock_client
+        mock_s3.call_with_retry.side_effect = \
+            lambda a_func, **kwargs: a_func(**kwargs)
+        mock_s3.head_key.return_value = {'ContentLength': len(self.data)}
+        result = list(s3_parquet.iter_records(
+            'k', self.bucket, columns=['id'],
+            filters=[('day', '>=', '2017-01-09'), ('id', 'in', [5, 85, 91])]))
+        self.assertEqual(result, [{'id': 85}, {'id': 91}])
+
+        table = s3_parquet.read_table(
+            'k', self.bucket, columns=['value'], filters=[('id', '<', 2)])
+        self.assertEqual(table.to_pydict(), {'value': [0.0, 1.0]})
+        table = s3_parquet.read_table(
+            'k', self.bucket, columns=['value'], filters=[('id', '>', 100)])
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.schema.names, ['value'])
+
+    @unittest.skipIf(s3_parquet.pq is None, 'requires pyarrow')
+    @patch('pyapi.utils.s3_parquet.s3')
+    def test_get_row_groups(self, mock_s3):
+        """
+        test pyapi.utils.s3_parquet.get_row_groups per statistics
+        """
+        self.data = self.get_parquet_data()
+        mock_s3.get_client.return_value = self.mock_client
+        mock_s3.call_with_retry.side_effect = \
+            lambda a_func, **kwargs: a_func(**kwargs)
+        s3_file = s3_parquet.S3RangeFile('k', self.bucket, len(self.data))
+        parquet_file = s3_parquet.pq.ParquetFile(s3_file)
+        self.assertEqual(s3_parquet.get_row_groups(
+            parquet_file, [('day', '==', '2017-01-03')]), [2])
+        self.assertEqual(s3_parquet.get_row_groups(
+            parquet_file, [('id', '>=', 75)]), [7, 8, 9])
@@ -0,0 +1,170 @@
+"""
+# test_utils_s3_pipeline
+
+"""
+from __future__ import absolute_import
+
+import io
+import itertools
+import threading
+import time
+import unittest
+
+from mock import patch
+from pyapi.utils import s3_pipeline
+from pyapi.utils.s3_pipeline import Pipeline, Stage
+
+
+class TestS3Pipeline(unittest.TestCase):
+    """
+    TestS3Pipeline includes all unit tests for pyapi.utils.s3_pipeline module
+    """
+
+    def tearDown(self):
+        """
+        tear down each test
+        """
+        print "\ndone: " + self.id()
+
+    def test_pipeline(self):
+        """
+        test pyapi.utils.s3_pipeline.Pipeline
+        """
+        results = []
+        lock = threading.Lock()
+
+        def double(item):
+            """Double an item, failing on 7"""
+            if item == 7:
+                raise ValueError('seven')
+            return item * 2
+
+        def skip(item):
+            """Drop items of multiple of 4"""
+            return None if item % 4 == 0 else item
+
+        def collect(item):
+            """Collect an item"""
+            with lock:
+                results.append(item)
+            return item
+
+        pipeline = Pipeline([
+            Stage('double', double, workers=3),
+            Stage('skip', skip, workers=2),
+            Stage('collect', collect)])
+        metrics = pipeline.run(range(10))
+        self.assertEqual(sorted(results), [2, 6, 10, 18])
+        self.assertEqual(metrics['source_items'], 10)
+        self.assertEqual(metrics['errors'], [
+            {'Stage': 'double', 'Item': '7', 'Message': 'seven'}])
+        stages = dict((s['name'], s) for s in metrics['stages'])
+        self.assertEqual(
+            (stages['double']['processed'], stages['double']['errors'],
+             stages['double']['emitted']), (10, 1, 9))
+        self.assertEqual(
+            (stages['skip']['processed'], stages['skip']['dropped']), (9, 5))
+        self.assertEqual(stages['collect']['emitted'], 4)
+        self.assertEqual(stages['collect']['queued'], 0)
+
+        with self.assertRaises(ValueError):
+            Pipeline([])
+        with self.assertRaises(ValueError):
+            Stage('bad', 'not a function')
+
+    def test_pipeline_fan_out(self):
+        """
+        test pyapi.utils.s3_pipeline.Pipeline with a fan-out stage
+        """
+        results = []
+        pipeline = Pipeline([
+            Stage('split', lambda x: range(x), fan_out=True),
+            Stage('collect', lambda x: results.append(x) or x)])
+        metrics = pipeline.run([1, 2, 3])
+        self.assertEqual(sorted(results), [0, 0, 0, 1, 1, 2])
+        self.assertEqual(metrics['stages'][0]['emitted'], 6)
+
+    def test_pipeline_backpressure(self):
+        """
+        test pyapi.utils.s3_pipeline.Pipeline bounded by a slow stage
+        """
+        def slow(item):
+            """Process slowly"""
+            time.sleep(0.01)
+            return item
+
+        pipeline = Pipeline([
+            Stage('fast', lambda x: x, workers=4),
+            Stage('slow', slow, queue_size=2)])
+        metrics = pipeline.run(range(20))
+        fast, slow_metrics = metrics['stages']
+        self.assertEqual(slow_metrics['processed'], 20)
+        self.assertTrue(slow_metrics['max_queued'] <= 2)
+        self.assertTrue(fast['blocked_seconds'] > 0)
+
+    def test_pipeline_stop(self):
+        """
+        test pyapi.utils.s3_pipeline.Pipeline.stop draining items in flight
+        """
+        results = []
+        holder = {}
+
+        def collect(item):
+            """Collect an item, stopping the pipeline at 5"""
+            results.append(item)
+            if item == 5:
+                holder['pipeline'].stop()
+            return item
+
+        pipeline = Pipeline([Stage('collect', collect, queue_size=2)])
+        holder['pipeline'] = pipeline
+        metrics = pipeline.run(itertools.count())
+        self.assertEqual(len(results), metrics['source_items'])
+        self.assertTrue(5 < len(results) < 10)
+        self.assertEqual(sorted(results), list(range(len(results))))
+
+    @patch('pyapi.utils.s3.upload')
+    @patch('pyapi.utils.s3.get_stream')
+    @patch('pyapi.utils.s3.list_objects_sharded')
+    def test_run_pipeline(self, mock_list, mock_get, mock_upload):
+        """
+        test pyapi.utils.s3_pipeline.run_pipeline
+        """
+        mock_list.return_value = [
+            {'Key': 'raw/a.json'}, {'Key': 'raw/b.json'}, {'Key': 'raw/c.txt'},
+            {'Key': 'raw/bad.json'}, {'Key': 'raw/gone.json'},
+            {'Key': 'raw/sub/'}]
+        contents = {
+            'raw/a.json': b'{"v": 1}\n{"v": 2}\n',
+            'raw/b.json': b'{"v": 3}\n',
+            'raw/bad.json': b'{bad',
+        }
+
+        def get_stream(key_name, bucket):
+            """Get a stream of contents, failing on a missing key"""
+            if key_name not in contents:
+                raise IOError('NoSuchKey')
+            return io.BytesIO(contents[key_name])
+
+        mock_get.side_effect = get_stream
+
+        def transform(key_name, records):
+            """Add one to all values"""
+            return key_name.replace('raw/', 'clean/'), [
+                {'v': r['v'] + 1} for r in records]
+
+        metrics = s3_pipeline.run_pipeline(
+            transform, 'raw/', 'src', suffix='.json', dst_bucket='dst',
+            json_lines=True, fetch_workers=2, content_encoding='gzip')
+        self.assertEqual(metrics['source_items'], 4)
+        self.assertEqual(sorted(e['Stage'] for e in metrics['errors']),
+                         ['fetch', 'parse'])
+        self.assertEqual(metrics['stages'][0]['errors'], 1)
+        uploads = sorted(c[0] + (c[1],) for c in mock_upload.call_args_list)
+        self.assertEqual(uploads, [
+            (u'{"v": 2}\n{"v": 3}\n', 'clean/a.json', 'dst',
+             {'content_encoding': 'gzip'}),
+            (u'{"v": 4}\n', 'clean/b.json', 'dst',
+             {'content_encoding': 'gzip'}),
+        ])
+        self.assertEqual(metrics['stages'][0]['workers'], 2)
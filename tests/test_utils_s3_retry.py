@@ -0,0 +1,136 @@
+"""
+# test_utils_s3_retry
+
+"""
+from __future__ import absolute_import
+
+import threading
+import unittest
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+from mock import MagicMock, patch
+from pyapi.utils import s3_retry
+
+
+class TestS3Retry(unittest.TestCase):
+    """
+    TestS3Retry includes all unit tests for pyapi.utils.s3_retry module
+    """
+
+    def setUp(self):
+        """
+        setup test
+        """
+        self.slow_down = ClientError(
+            {'Error': {'Code': 'SlowDown', 'Message': 'Reduce rate'}}, 'Get')
+        self.denied = ClientError(
+            {'Error': {'Code': 'AccessDenied', 'Message': 'denied'}}, 'Get')
+
+    def tearDown(self):
+        """
+        tear down each test
+        """
+        print "\ndone: " + self.id()
+
+    def test_classify_error(self):
+        """
+        test pyapi.utils.s3_retry.classify_error
+        """
+        unavailable = ClientError(
+            {'Error': {}, 'ResponseMetadata': {'HTTPStatusCode': 503}}, 'Get')
+        tests = [
+            (self.slow_down, s3_retry.ERROR_THROTTLE),
+            (unavailable, s3_retry.ERROR_THROTTLE),
+            (ClientError({'Error': {'Code': 'InternalError'}}, 'Get'),
+             s3_retry.ERROR_TRANSIENT),
+            (EndpointConnectionError(endpoint_url='http://s3'),
+             s3_retry.ERROR_TRANSIENT),
+            (self.denied, None),
+            (ValueError('value'), None),
+        ]
+        for error, expected in tests:
+            self.assertEqual(s3_retry.classify_error(error), expected)
+
+    @patch('pyapi.utils.s3_retry.time')
+    def test_retry_policy(self, mock_time):
+        """
+        test pyapi.utils.s3_retry.RetryPolicy.call
+        """
+        limiter = s3_retry.AdaptiveLimiter(8, cooldown=0)
+        mock_time.time.return_value = 100.0
+        policy = s3_retry.RetryPolicy(
+            max_attempts=3, base_delay=1, limiter=limiter)
+        a_func = MagicMock(side_effect=[self.slow_down, self.slow_down, 'ok'])
+        self.assertEqual(policy.call(a_func, 'a', b=1), 'ok')
+        a_func.assert_called_with('a', b=1)
+        self.assertEqual(a_func.call_count, 3)
+        self.assertEqual(mock_time.sleep.call_count, 2)
+        self.assertEqual(limiter.throttles, 2)
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertTrue(limiter.limit < 8)
+
+        # give up after max attempts
+        a_func = MagicMock(side_effect=self.slow_down)
+        with self.assertRaises(ClientError):
+            policy.call(a_func)
+        self.assertEqual(a_func.call_count, 3)
+
+        # not retryable
+        a_func = MagicMock(side_effect=self.denied)
+        with self.assertRaises(ClientError):
+            policy.call(a_func)
+        self.assertEqual(a_func.call_count, 1)
+
+    def test_get_delay(self):
+        """
+        test pyapi.utils.s3_retry.RetryPolicy.get_delay by full jitter
+        """
+        policy = s3_retry.RetryPolicy(base_delay=0.5, max_delay=3)
+        for attempt, cap in [(1, 0.5), (2, 1), (3, 2), (4, 3), (10, 3)]:
+            for _ in range(20):
+                delay = policy.get_delay(attempt)
+                self.assertTrue(0 <= delay <= cap)
+
+    @patch('pyapi.utils.s3_retry.time')
+    def test_limiter(self, mock_time):
+        """
+        test pyapi.utils.s3_retry.AdaptiveLimiter by AIMD
+        """
+        limiter = s3_retry.AdaptiveLimiter(8, min_limit=2, cooldown=1.0)
+        mock_time.time.return_value = 100.0
+        limiter.on_throttle()
+        self.assertEqual(limiter.limit, 4)
+        limiter.on_throttle()  # within cooldown
+        self.assertEqual(limiter.limit, 4)
+        mock_time.time.return_value = 102.0
+        limiter.on_throttle()
+        limiter.on_throttle()
+        self.assertEqual(limiter.limit, 2)  # min limit
+        self.assertEqual(limiter.throttles, 4)
+
+        for _ in range(3):  # 2 + 1/2 + 1/2.5 + 1/2.9
+            limiter.on_success()
+        self.assertEqual(int(limiter.limit), 3)
+        for _ in range(100):
+            limiter.on_success()
+        self.assertEqual(limiter.limit, 8)
+
+    def test_limiter_blocking(self):
+        """
+        test pyapi.utils.s3_retry.AdaptiveLimiter limits requests in flight
+        """
+        limiter = s3_retry.AdaptiveLimiter(1)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            """acquire in another thread"""
+            with limiter:
+                acquired.set()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release()
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual(limiter.in_flight, 0)
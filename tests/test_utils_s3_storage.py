@@ -46,7 +46,12 @@ class TestS3Storage(unittest.TestCase):
         """
         self.s3_storage.create('s3/key/path', 'contents')
         mock_s3.create_key.assert_called_with(
-            'contents', 's3/key/path', bucket=self.bucket)
+            'contents', 's3/key/path', bucket=self.bucket,
+            content_encoding=None)
+        self.s3_storage.create('s3/key/path', 'contents', 'gzip')
+        mock_s3.create_key.assert_called_with(
+            'contents', 's3/key/path', bucket=self.bucket,
+            content_encoding='gzip')
 
     @patch('pyapi.utils.s3_storage.s3')
     def test_delete(self, mock_s3):
@@ -85,8 +90,12 @@ class TestS3Storage(unittest.TestCase):
         """
         test pyapi.utils.s3_storage.S3Storage interfaces - get_last_modified method
         """
-        self.s3_storage.get_last_modified('s3/key/path')
-        mock_s3.get_key.assert_called_with('s3/key/path', bucket=self.bucket)
+        mock_s3.head_key.return_value = {'LastModified': 'now'}
+        result = self.s3_storage.get_last_modified('s3/key/path')
+        mock_s3.head_key.assert_called_with('s3/key/path', bucket=self.bucket)
+        self.assertEqual(result, 'now')
+        mock_s3.head_key.return_value = None
+        self.assertIsNone(self.s3_storage.get_last_modified('s3/key/path'))
 
     @patch('pyapi.utils.s3_storage.s3')
     def test_get_parquet_content(self, mock_s3):
@@ -96,6 +105,25 @@ class TestS3Storage(unittest.TestCase):
         self.s3_storage.get_parquet_content('s3/key/path')
         mock_s3.get_parquet_data.assert_called_with('s3/key/path', bucket=self.bucket)
 
+    @patch('pyapi.utils.s3_storage.s3')
+    def test_iter_json_lines(self, mock_s3):
+        """
+        test pyapi.utils.s3_storage.S3Storage interfaces - iter_json_lines method
+        """
+        self.s3_storage.iter_json_lines('s3/key/path', batch_size=10)
+        mock_s3.iter_json_lines.assert_called_with(
+            's3/key/path', bucket=self.bucket, batch_size=10)
+
+    @patch('pyapi.utils.s3_storage.s3_parquet')
+    def test_iter_parquet_records(self, mock_s3_parquet):
+        """
+        test pyapi.utils.s3_storage.S3Storage interfaces - iter_parquet_records
+        """
+        filters = [('day', '>=', '2017-01-16')]
+        self.s3_storage.iter_parquet_records('s3/key/path', ['id'], filters)
+        mock_s3_parquet.iter_records.assert_called_with(
+            's3/key/path', bucket=self.bucket, columns=['id'], filters=filters)
+
     @patch('pyapi.utils.s3_storage.s3')
     def test_move(self, mock_s3):
         """
@@ -127,4 +155,9 @@ class TestS3Storage(unittest.TestCase):
         """
         self.s3_storage.save('s3/key/path', 'contents')
         mock_s3.copy_contents_to_bucket.assert_called_with(
-            'contents', 's3/key/path', bucket=self.bucket)
+            'contents', 's3/key/path', bucket=self.bucket,
+            content_encoding=None)
+        self.s3_storage.save('s3/key/path', 'contents', content_encoding='zstd')
+        mock_s3.copy_contents_to_bucket.assert_called_with(
+            'contents', 's3/key/path', bucket=self.bucket,
+            content_encoding='zstd')
@@ -0,0 +1,176 @@
+"""
+# test_utils_s3_sync
+
+"""
+from __future__ import absolute_import
+
+import datetime
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from dateutil import tz
+from mock import patch
+from pyapi.utils import s3_sync
+
+
+class TestS3Sync(unittest.TestCase):
+    """
+    TestS3Sync includes all unit tests for pyapi.utils.s3_sync module
+    """
+
+    def setUp(self):
+        """
+        setup test
+        """
+        self.bucket = "s3-bucket"
+        self.local_dir = tempfile.mkdtemp()
+        self.modified = datetime.datetime(2017, 1, 16, 8, tzinfo=tz.tzutc())
+        self.timestamp = 1484553600  # 2017-01-16T08:00:00Z
+
+    def tearDown(self):
+        """
+        tear down each test
+        """
+        shutil.rmtree(self.local_dir)
+        print "\ndone: " + self.id()
+
+    def get_object(self, key, contents, modified=None):
+        """
+        get a listed object
+        """
+        return {'Key': key, 'Size': len(contents),
+                'ETag': '"{}"'.format(hashlib.md5(contents).hexdigest()),
+                'LastModified': modified or self.modified}
+
+    def write_file(self, rel_path, contents, mtime=None):
+        """
+        write a local file
+        """
+        path = os.path.join(self.local_dir, *rel_path.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as file_obj:
+            file_obj.write(contents)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    @patch('pyapi.utils.s3_sync.s3')
+    def test_sync_to_s3(self, mock_s3):
+        """
+        test pyapi.utils.s3_sync.sync_to_s3
+        """
+        self.write_file('same.json', b'same', self.timestamp - 10)
+        self.write_file('newer.json', b'newer', self.timestamp + 10)
+        self.write_file('sub/size.json', b'size')
+        self.write_file('sub/new.json', b'new')
+        mock_s3.list_objects_sharded.return_value = [
+            self.get_object('p/same.json', b'same'),
+            self.get_object('p/newer.json', b'older'),
+            self.get_object('p/sub/size.json', b'size changed'),
+            self.get_object('p/sub/', b''),
+            self.get_object('p/extra.json', b'extra'),
+        ]
+        mock_s3.delete_keys.return_value = {'deleted': 1, 'errors': []}
+        # create the child mock before worker threads call it (a mock does
+        # not create children thread-safely, losing calls on a race)
+        mock_s3.upload.return_value = None
+        result = s3_sync.sync_to_s3(
+            self.local_dir, 'p', self.bucket, delete=True, workers=2)
+        mock_s3.list_objects_sharded.assert_called_with(
+            'p/', self.bucket, workers=2)
+        uploaded = sorted(c[0][1] for c in mock_s3.upload.call_args_list)
+        self.assertEqual(
+            uploaded, ['p/newer.json', 'p/sub/new.json', 'p/sub/size.json'])
+        mock_s3.delete_keys.assert_called_with(['p/extra.json'], self.bucket)
+        self.assertEqual(result, {
+            'transferred': 3, 'bytes': 12, 'skipped': 1, 'deleted': 1,
+            'errors': []})
+
+        with self.assertRaises(ValueError):
+            s3_sync.sync_to_s3(os.path.join(self.local_dir, 'none'), 'p')
+
+    @patch('pyapi.utils.s3_sync.s3')
+    def test_sync_to_s3_checksum(self, mock_s3):
+        """
+        test pyapi.utils.s3_sync.sync_to_s3 by checksum
+        """
+        self.write_file('same.json', b'same', self.timestamp + 10)
+        self.write_file('diff.json', b'diff', self.timestamp - 10)
+        mock_s3.list_objects_sharded.return_value = [
+            self.get_object('same.json', b'same'),
+            self.get_object('diff.json', b'DIFF'),
+        ]
+        mock_s3.upload.side_effect = IOError('failed')
+        result = s3_sync.sync_to_s3(
+            self.local_dir, '', self.bucket, checksum=True)
+        self.assertEqual(mock_s3.upload.call_count, 1)
+        self.assertEqual(result['skipped'], 1)
+        self.assertEqual(
+            result['errors'], [{'Path': 'diff.json', 'Message': 'failed'}])
+
+    @patch('pyapi.utils.s3_sync.s3')
+    def test_sync_from_s3(self, mock_s3):
+        """
+        test pyapi.utils.s3_sync.sync_from_s3
+        """
+        self.write_file('same.json', b'same', self.timestamp)
+        self.write_file('older.json', b'older', self.timestamp - 10)
+        self.write_file('extra.json', b'extra')
+        contents = {'p/older.json': b'newer', 'p/sub/new.json': b'new'}
+        mock_s3.READ_CHUNK_SIZE = 2
+        mock_s3.list_objects_sharded.return_value = [
+            self.get_object('p/same.json', b'same'),
+            self.get_object('p/older.json', b'newer'),
+            self.get_object('p/sub/new.json', b'new'),
+        ]
+        mock_s3.get_stream.side_effect = \
+            lambda key, bucket, decompress: io.BytesIO(contents[key])
+        result = s3_sync.sync_from_s3(
+            'p/', self.local_dir, self.bucket, delete=True)
+        self.assertEqual(result, {
+            'transferred': 2, 'bytes': 8, 'skipped': 1, 'deleted': 1,
+            'errors': []})
+        self.assertEqual(
+            sorted(s3_sync._list_local(self.local_dir)),
+            ['older.json', 'same.json', 'sub/new.json'])
+        path = os.path.join(self.local_dir, 'sub', 'new.json')
+        with open(path, 'rb') as file_obj:
+            self.assertEqual(file_obj.read(), b'new')
+        self.assertEqual(int(os.stat(path).st_mtime), self.timestamp)
+
+        # unchanged keys are skipped next
+        result = s3_sync.sync_from_s3('p/', self.local_dir, self.bucket)
+        self.assertEqual((result['transferred'], result['skipped']), (0, 3))
+
+    @patch('pyapi.utils.s3_sync.s3')
+    def test_sync_from_s3_unsafe_key(self, mock_s3):
+        """
+        test pyapi.utils.s3_sync.sync_from_s3 on a key out of local dir
+        """
+        mock_s3.list_objects_sharded.return_value = [
+            self.get_object('p/../escape.json', b'x')]
+        mock_s3.get_stream.return_value = io.BytesIO(b'x')
+        result = s3_sync.sync_from_s3('p/', self.local_dir, self.bucket)
+        self.assertEqual(len(result['errors']), 1)
+        self.assertEqual(mock_s3.get_stream.call_count, 0)
+
+    @patch('pyapi.utils.s3_sync.s3')
+    def test_get_file_etag(self, mock_s3):
+        """
+        test pyapi.utils.s3_sync._get_file_etag
+        """
+        mock_s3.MULTIPART_PART_SIZE = 4
+        mock_s3.MULTIPART_PART_SIZE_MIN = 4
+        path = self.write_file('data', b'0123456789')
+        md5 = hashlib.md5(b'0123456789').hexdigest()
+        self.assertEqual(s3_sync._get_file_etag(path, 10, md5), md5)
+        parts = [hashlib.md5(p).digest() for p in [b'0123', b'4567', b'89']]
+        expected = hashlib.md5(b''.join(parts)).hexdigest() + '-3'
+        self.assertEqual(
+            s3_sync._get_file_etag(path, 10, 'etag-3'), expected)
+        self.assertEqual(s3_sync._get_file_etag(path, 10, 'etag-2'), None)
@@ -0,0 +1,112 @@
+"""
+# test_utils_s3_writer
+
+"""
+from __future__ import absolute_import
+
+import threading
+import time
+import unittest
+
+from mock import patch
+from pyapi.utils import compression
+from pyapi.utils import json_codec
+from pyapi.utils.s3_writer import S3JsonLinesWriter
+
+
+class TestS3Writer(unittest.TestCase):
+    """
+    TestS3Writer includes all unit tests for pyapi.utils.s3_writer module
+    """
+
+    def setUp(self):
+        """
+        setup for test
+        """
+        self.uploaded = {}
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        """
+        tear down each test
+        """
+        print "\ndone: " + self.id()
+
+    def _upload(self, source, key_name, bucket, **kwargs):
+        """
+        Consume an upload source as s3.upload does (compressing it)
+        """
+        encoding = kwargs.get('content_encoding')
+        if encoding:
+            source = compression.iter_compress(source, encoding)
+        data = b''.join(source)
+        if 'fail' in key_name:
+            raise IOError('upload failed')
+        if encoding:
+            data = compression.decompress(data, encoding)
+        with self.lock:
+            self.uploaded[key_name] = (bucket, data, kwargs)
+
+    def _get_records(self, key_name):
+        """
+        Get the records of an uploaded key
+        """
+        data = self.uploaded[key_name][1].decode('utf-8')
+        return [json_codec.loads(line) for line in data.splitlines()]
+
+    @patch('pyapi.utils.s3_writer.s3.upload')
+    def test_s3_json_lines_writer(self, mock_upload):
+        """
+        test pyapi.utils.s3_writer.S3JsonLinesWriter
+        """
+        mock_upload.side_effect = self._upload
+        records = [{'id': i, 'domain': 'example{}.com'.format(i)}
+                   for i in range(10)]
+        with S3JsonLinesWriter('mined/', 'bucket', roll_size=100,
+                               chunk_size=40, ContentType='x') as writer:
+            for record in records:
+                writer.write(record)
+        self.assertTrue(writer.closed)
+        self.assertEqual(sorted(writer.keys), sorted(self.uploaded))
+        self.assertTrue(len(writer.keys) > 1)
+        for key_name in writer.keys:
+            self.assertTrue(key_name.startswith('mined/'))
+            self.assertTrue(key_name.endswith('.jsonl.gz'))
+            self.assertIn(writer.writer_id, key_name)
+            bucket, _, kwargs = self.uploaded[key_name]
+            self.assertEqual(bucket, 'bucket')
+            self.assertEqual(kwargs['content_encoding'], 'gzip')
+            self.assertEqual(kwargs['ContentType'], 'x')
+        written = []
+        for key_name in sorted(writer.keys):
+            written.extend(self._get_records(key_name))
+        self.assertEqual(written, records)
+        metrics = writer.get_metrics()
+        self.assertEqual(metrics['records'], 10)
+        self.assertEqual(metrics['objects'], len(writer.keys))
+        self.assertEqual(metrics['uploading'], 0)
+        self.assertEqual(metrics['errors'], 0)
+        self.assertRaises(ValueError, writer.write, {'id': 10})
+
+        # roll by the age of an object, and no object of no record
+        self.uploaded = {}
+        writer = S3JsonLinesWriter('logs/', content_encoding=None,
+                                   roll_interval=0.05)
+        writer.write({'id': 1})
+        time.sleep(0.1)
+        writer.write({'id': 2})
+        writer.roll()
+        writer.roll()
+        keys = sorted(writer.close())
+        self.assertEqual(len(keys), 2)
+        self.assertTrue(keys[0].endswith('-000001.jsonl'))
+        self.assertEqual(self._get_records(keys[0]), [{'id': 1}])
+        self.assertEqual(self._get_records(keys[1]), [{'id': 2}])
+
+        # a failed upload is raised by close
+        writer = S3JsonLinesWriter('fail/', max_pending=1, chunk_size=1)
+        for i in range(5):
+            writer.write({'id': i})
+        self.assertRaises(IOError, writer.close)
+        self.assertEqual(len(writer.errors), 1)
+        self.assertEqual(writer.keys, [])